@@ -0,0 +1,129 @@
+import os
+import json
+import argparse
+import datetime
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from binaps_data.utils.logs import set_logger
+from binaps_data.main import main
+
+log = logging.getLogger('main')
+
+
+def argument_parser(cp_args=None) -> argparse.Namespace:
+    """
+    Get argument from command line
+    :param cp_args: possible way to pass arguments to the parser
+    :return: [argparse.Namespace]
+    """
+    parser = argparse.ArgumentParser(description='Run several binaps data generations inside one process')
+    parser.add_argument('configs', type=str,
+                        help="JSON file with a list of runs, each one a dict of main arguments (e.g. "
+                             "{\"nbr_of_rows\": 1000, \"format\": \"csr\", \"categories_off\": true}) or a string "
+                             "of command line arguments")
+    parser.add_argument('-o', '--output_dir', type=str, default=".",
+                        help="Output directory, each run not giving its own output_dir is saved inside run_<i>")
+    parser.add_argument('--workers', type=int, default="1",
+                        help="Number of runs done at the same time, each one inside its own process")
+    parser.add_argument('--pattern_cache', type=str, default=None,
+                        help="Directory caching the pattern tables, shared by the runs. Defaults to "
+                             "<output_dir>/pattern_cache, 'none' to disable it")
+    parser.add_argument('--pattern_cache_size', type=int, default="64",
+                        help="Maximum number of pattern tables kept inside the cache")
+    return parser.parse_args(cp_args)
+
+
+def config_to_args(config) -> list:
+    """
+    Command line arguments of main for one run
+    :param config: dict of arguments (True for a flag, False or None to leave it out) or string
+    :return: list of str
+    """
+    if isinstance(config, str):
+        return config.split()
+    args = []
+    for name, value in config.items():
+        if value is None or value is False:
+            continue
+        args.append(f"--{name}")
+        if value is not True:
+            args.append(str(value))
+    return args
+
+
+def job_args(config, output_dir: str, pattern_cache: str = None, pattern_cache_size: int = 64) -> list:
+    """
+    Command line arguments of main for one job, written to output_dir unless it gives its own output directory
+    :param config: dict of arguments or string, see config_to_args
+    :param output_dir: output directory of the job, created if needed
+    :param pattern_cache: cache directory used unless the job gives its own, None for no cache
+    :return: list of str
+    """
+    args = config_to_args(config)
+    if "-o" not in args and "--output_dir" not in args:
+        args += ["--output_dir", output_dir]
+    if pattern_cache and "--pattern_cache" not in args:
+        args += ["--pattern_cache", pattern_cache, "--pattern_cache_size", str(pattern_cache_size)]
+    os.makedirs(args[args.index("-o" if "-o" in args else "--output_dir") + 1], exist_ok=True)
+    return args
+
+
+def _run(args: list) -> dict:
+    """
+    Run main for one job
+    :return: config of the run, or {"error": message} if it failed
+    """
+    try:
+        return main(args)
+    except SystemExit as e:  # argparse exits on invalid arguments
+        return {"error": f"invalid arguments (exit code {e.code})"}
+    except Exception as e:
+        return {"error": repr(e)}
+
+
+def run_batch(configs: list, output_dir: str = ".", workers: int = 1, pattern_cache: str = None,
+              pattern_cache_size: int = 64) -> list:
+    """
+    Generate one dataset by config. Runs share the imports of this process (or of its workers) and a pattern cache,
+    so runs with the same pattern parameters and seed only draw the patterns once. A failed run, invalid arguments
+    included, doesn't stop the others
+    :param configs: list of runs, see config_to_args
+    :param output_dir: directory of the runs not giving their own output_dir
+    :param workers: number of runs done at the same time
+    :param pattern_cache: cache directory, None for no cache
+    :return: config of each run (see main), or {"error": message} for a failed one
+    """
+    all_args = [job_args(config, os.path.join(output_dir, f"run_{i}"), pattern_cache, pattern_cache_size)
+                for i, config in enumerate(configs)]
+
+    results = []
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_run, args) for args in all_args]
+            for i, future in enumerate(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:  # the worker process died
+                    results.append({"error": repr(e)})
+    else:
+        results = [_run(args) for args in all_args]
+    for i, result in enumerate(results):
+        if "error" in result:
+            log.error(f"Run {i} failed: {result['error']}")
+    log.info(f"{sum('error' not in r for r in results)}/{len(results)} runs done")
+    return results
+
+
+if __name__ == '__main__':
+    log = set_logger()
+    args = argument_parser()
+    with open(args.configs) as fd:
+        configs = json.load(fd)
+    pattern_cache = args.pattern_cache or os.path.join(args.output_dir, "pattern_cache")
+    if pattern_cache.lower() == "none":
+        pattern_cache = None
+    results = run_batch(configs, args.output_dir, args.workers, pattern_cache, args.pattern_cache_size)
+    today = datetime.datetime.now().strftime("%Y-%m-%dT%Hh%Mm%Ss")
+    with open(os.path.join(args.output_dir, f"batch_{today}.json"), 'w') as fd:
+        json.dump(results, fd)
@@ -0,0 +1,126 @@
+import os
+import json
+import glob
+import hashlib
+import logging
+import collections
+
+import numpy as np
+
+log = logging.getLogger('main')
+
+CACHE_EXTENSION = ".patterns.npz"
+MEMORY_ENTRIES = 8  # number of entries kept in memory by a long-lived process, see get_cache
+
+_caches = {}  # caches of this process by directory, see get_cache
+
+
+class PatternCache:
+    """
+    On-disk cache of pattern tables, addressed by a hash of everything the patterns depend on. Entries are .npz files
+    written atomically; the least recently used ones are removed when there are more than max_entries. The last
+    entries used can also be kept in memory, so a process running many jobs doesn't read them again
+
+        cache_dir      : directory of the entries
+        max_entries    : maximum number of entries kept, 0 for no limit
+        memory_entries : maximum number of entries kept in memory, 0 to always read them from disk
+    """
+
+    def __init__(self, cache_dir: str, max_entries: int = 0, memory_entries: int = 0):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = collections.OrderedDict()  # key -> (state, arrays), least recently used first
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(**params) -> str:
+        """
+        Content address of a pattern table
+        :param params: JSON-able parameters the patterns depend on
+        :return: hex digest
+        """
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + CACHE_EXTENSION)
+
+    def get(self, key: str):
+        """
+        Load an entry and mark it as recently used
+        :return: (state, arrays) as given to put, None if the entry is missing
+        """
+        file = self._file(key)
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            try:
+                os.utime(file)
+            except OSError:  # evicted from disk by another process, still valid
+                pass
+            log.info(f"Patterns loaded from memory cache {key}")
+            state, arrays = self._memory[key]
+            return state, {name: array.copy() for name, array in arrays.items()}  # callers may modify them
+        try:
+            with np.load(file) as data:
+                arrays = {name: data[name] for name in data.files if name != "state"}
+                state = json.loads(str(data["state"]))
+        except (OSError, ValueError):  # missing, or removed by another process meanwhile
+            return None
+        os.utime(file)
+        log.info(f"Patterns loaded from cache {file}")
+        self._remember(key, (state, arrays))
+        return state, arrays
+
+    def put(self, key: str, state: dict, arrays: dict):
+        """
+        Save an entry then evict the least recently used ones
+        :param state: JSON-able state
+        :param arrays: numpy arrays
+        """
+        file = self._file(key)
+        tmp_file = f"{file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'wb') as fd:
+            np.savez(fd, state=np.array(json.dumps(state)), **arrays)
+        os.replace(tmp_file, file)
+        log.info(f"Patterns saved to cache {file}")
+        self._remember(key, (state, arrays))
+        self._evict()
+
+    def _remember(self, key: str, entry: tuple):
+        if not self.memory_entries:
+            return
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        if not self.max_entries:
+            return
+        entries = []
+        for file in glob.glob(os.path.join(self.cache_dir, "*" + CACHE_EXTENSION)):
+            try:
+                entries.append((os.path.getmtime(file), file))
+            except OSError:
+                continue
+        entries.sort()
+        for _, file in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(file)
+                log.info(f"Pattern cache entry {file} evicted")
+            except OSError:
+                pass
+
+
+def get_cache(cache_dir: str, max_entries: int = 0) -> PatternCache:
+    """
+    Cache of this process for a directory, created on first use. Jobs run one after the other by the same process
+    (batch, service) share it, so the last pattern tables used stay in memory
+    :param cache_dir: directory of the entries
+    :param max_entries: maximum number of entries kept on disk, 0 for no limit
+    """
+    cache = _caches.get(cache_dir)
+    if cache is None:
+        cache = _caches[cache_dir] = PatternCache(cache_dir, max_entries, MEMORY_ENTRIES)
+    cache.max_entries = max_entries
+    return cache
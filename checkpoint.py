@@ -0,0 +1,73 @@
+import os
+import json
+import random
+import logging
+
+import numpy as np
+
+log = logging.getLogger('main')
+
+
+class Checkpointer:
+    """
+    Save the state of a line generation every few rows, so an interrupted run can be resumed and give the same
+    output as an uninterrupted one. A checkpoint is a single .npz file replaced atomically, holding
+        - state  : JSON with the row cursor, the state of the random module and of the numpy generator, the state
+                   of the writer (file offsets) and the counters of the line manager
+        - arrays : pattern table and pools, with the use of each pattern (see PatternManager.get_state)
+
+        checkpoint_file : output file
+        every           : number of rows between two checkpoints
+        last_row        : row of the last checkpoint
+    """
+
+    def __init__(self, checkpoint_file: str, every: int, last_row: int = 0):
+        self.checkpoint_file = checkpoint_file
+        self.every = every
+        self.last_row = last_row
+
+    def due(self, row: int) -> bool:
+        """
+        :param row: number of rows generated so far
+        :return: True if a checkpoint should be saved now
+        """
+        return row - self.last_row >= self.every
+
+    def save(self, row: int, state: dict, arrays: dict):
+        """
+        Save a checkpoint atomically (write a temporary file then rename it)
+        :param row: number of rows generated (and written) so far
+        :param state: JSON-able state
+        :param arrays: numpy arrays
+        """
+        state = dict(state, row=row, random_state=random_state_to_json(random.getstate()))
+        tmp_file = self.checkpoint_file + ".tmp"
+        with open(tmp_file, 'wb') as fd:
+            np.savez(fd, state=np.array(json.dumps(state)), **arrays)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(tmp_file, self.checkpoint_file)
+        self.last_row = row
+        log.info(f"Checkpoint at row {row} saved to {self.checkpoint_file}")
+
+
+def load_checkpoint(checkpoint_file: str) -> tuple:
+    """
+    Load a checkpoint saved by Checkpointer
+    :return: (state, arrays)
+    """
+    with np.load(checkpoint_file) as data:
+        arrays = {name: data[name] for name in data.files if name != "state"}
+        state = json.loads(str(data["state"]))
+    log.info(f"Resuming from row {state['row']} of {checkpoint_file}")
+    return state, arrays
+
+
+def random_state_to_json(state: tuple) -> list:
+    version, internal, gauss_next = state
+    return [version, list(internal), gauss_next]
+
+
+def random_state_from_json(state: list) -> tuple:
+    version, internal, gauss_next = state
+    return version, tuple(internal), gauss_next
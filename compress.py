@@ -0,0 +1,105 @@
+import os
+import bz2
+import gzip
+import lzma
+import logging
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger('main')
+
+COMPRESS_BLOCK_SIZE = 1 << 22  # bytes compressed by one task, each block becomes one member of the stream
+WRITE_BUFFER_SIZE = 1 << 20  # buffer of uncompressed output files, so chunks reach the disk in large writes
+
+# name -> (function compressing one block into a complete stream, file extension)
+COMPRESSIONS = {
+    "gzip": (lambda data: gzip.compress(data, compresslevel=6, mtime=0), ".gz"),
+    "bz2": (lambda data: bz2.compress(data, compresslevel=9), ".bz2"),
+    "xz": (lambda data: lzma.compress(data, format=lzma.FORMAT_XZ, preset=6), ".xz"),
+}
+
+
+def compressed_name(file: str, compress: str = None) -> str:
+    """
+    Name of a file once compressed
+    :param compress: key of COMPRESSIONS, None for no compression
+    """
+    return file + COMPRESSIONS[compress][1] if compress else file
+
+
+class ParallelCompressedFile:
+    """
+    Write-only file compressed by blocks inside a thread pool (zlib, bz2 and lzma release the GIL).
+    Each block is a complete compressed stream and streams are written in order, so the file is a valid
+    multi-member stream read back as a whole by gzip.open, bz2.open, lzma.open or the command line tools
+
+        file    : output file
+        threads : number of compression threads
+    """
+
+    def __init__(self, file: str, compress: str, threads: int = None, append: bool = False):
+        self.file = file
+        self._compress = COMPRESSIONS[compress][0]
+        self.threads = threads or os.cpu_count() or 1
+        self._descriptor = open(file, 'ab' if append else 'wb')
+        self._executor = ThreadPoolExecutor(self.threads)
+        self._pending = collections.deque()  # futures of the blocks being compressed, in file order
+        self._buffer = []
+        self._buffer_size = 0
+
+    def write(self, data):
+        """
+        Add data to the file
+        :param data: str (ASCII) or bytes
+        """
+        if isinstance(data, str):
+            data = data.encode('ascii')
+        self._buffer.append(data)
+        self._buffer_size += len(data)
+        if self._buffer_size >= COMPRESS_BLOCK_SIZE:
+            self._submit()
+        return len(data)
+
+    def _submit(self):
+        block = b''.join(self._buffer)
+        self._buffer = []
+        self._buffer_size = 0
+        self._pending.append(self._executor.submit(self._compress, block))
+        while len(self._pending) > 2 * self.threads:  # bound the memory held by pending blocks
+            self._descriptor.write(self._pending.popleft().result())
+
+    def flush(self):
+        """
+        Compress the data given so far as a member of its own and write everything to the file
+        """
+        if self._buffer_size:
+            self._submit()
+        while self._pending:
+            self._descriptor.write(self._pending.popleft().result())
+        self._descriptor.flush()
+
+    def fileno(self) -> int:
+        return self._descriptor.fileno()
+
+    def close(self):
+        if self._buffer_size or not (self._pending or self._descriptor.tell()):
+            self._submit()  # an empty file is still a valid (empty) stream
+        self.flush()
+        self._executor.shutdown()
+        self._descriptor.close()
+
+
+def open_output(file: str, mode: str = 'w', compress: str = None, offset: int = None):
+    """
+    Open a file to write, compressed by blocks in parallel if asked
+    :param file: output file, already named with its compression extension
+    :param mode: 'w' for text, 'wb' for bytes (only used without compression)
+    :param compress: key of COMPRESSIONS, None for no compression
+    :param offset: if given, the file is cut to this size and written from there (resume a run)
+    :return: object with write, flush and close
+    """
+    if offset is not None:
+        os.truncate(file, offset)
+    if compress:
+        return ParallelCompressedFile(file, compress, append=offset is not None)
+    return open(file, mode.replace('w', 'a') if offset is not None else mode, buffering=WRITE_BUFFER_SIZE)
@@ -0,0 +1,121 @@
+import os
+import json
+import argparse
+import logging
+
+import numpy as np
+
+from binaps_data.writer import DatWriter, CsrWriter
+from binaps_data.reader import DatReader
+
+log = logging.getLogger('main')
+
+CONVERT_CHUNK_SIZE = 100000  # number of lines converted at once
+
+
+def load_csr(header_file: str, mode: str = 'r') -> tuple:
+    """
+    Memory-map a binary CSR matrix written by CsrWriter
+    :param header_file: .csr.json header
+    :param mode: np.memmap mode
+    :return: (indptr, indices, labels, header), labels is None if they were not saved
+    """
+    with open(header_file) as fd:
+        header = json.load(fd)
+    directory = os.path.dirname(header_file)
+
+    def _map(name):
+        if name not in header:
+            return None
+        if not header[name]["length"]:
+            return np.zeros(0, dtype=header[name]["dtype"])
+        return np.memmap(os.path.join(directory, header[name]["file"]), dtype=header[name]["dtype"], mode=mode,
+                         shape=(header[name]["length"],))
+
+    return _map("indptr"), _map("indices"), _map("labels"), header
+
+
+def load_packed(header_file: str, mode: str = 'r') -> tuple:
+    """
+    Memory-map a bit matrix written by PackedWriter. Rows are unpacked with
+    np.unpackbits(bits[a:b], axis=1, count=header["nbr_of_feature"]), column j being the feature j+1
+    :param header_file: .packed.json header
+    :param mode: np.memmap mode
+    :return: (bits, labels, header), bits of shape (nbr_of_rows, row bytes), labels is None if they were not saved
+    """
+    with open(header_file) as fd:
+        header = json.load(fd)
+    directory = os.path.dirname(header_file)
+    shape = tuple(header["bits"]["shape"])
+    if shape[0] and shape[1]:
+        bits = np.memmap(os.path.join(directory, header["bits"]["file"]), dtype=header["bits"]["dtype"], mode=mode,
+                         shape=shape)
+    else:
+        bits = np.zeros(shape, dtype=header["bits"]["dtype"])
+    labels = None
+    if "labels" in header:
+        labels = np.zeros(0, dtype=header["labels"]["dtype"])
+        if header["labels"]["length"]:
+            labels = np.memmap(os.path.join(directory, header["labels"]["file"]), dtype=header["labels"]["dtype"],
+                               mode=mode, shape=(header["labels"]["length"],))
+    return bits, labels, header
+
+
+def dat_to_csr(data_file: str, label_file: str = None, output_file: str = None) -> tuple:
+    """
+    Convert a .dat file (and its .label file) to a binary CSR matrix
+    :param data_file: .dat file
+    :param label_file: .label file, None if there is no labels
+    :param output_file: output header, by default next to the .dat file
+    :return: (header file, label file or None)
+    """
+    prefix = data_file[:-len(DatWriter.extension)] if data_file.endswith(DatWriter.extension) else data_file
+    output_file = output_file or prefix + CsrWriter.extension
+    output_label_file = output_file[:-len(CsrWriter.extension)] + CsrWriter.label_extension if label_file else None
+    log.info(f"Converting {data_file} to {output_file}")
+
+    writer = CsrWriter(output_file, output_label_file)
+    with DatReader(data_file, label_file) as reader:
+        for indptr, indices, labels in reader.iter_chunks(CONVERT_CHUNK_SIZE):
+            writer.write_csr(indptr, indices, labels if labels is not None else [])
+    writer.close()
+    return output_file, output_label_file
+
+
+def csr_to_dat(header_file: str, data_file: str = None, label_file: str = None) -> tuple:
+    """
+    Convert a binary CSR matrix to a .dat file (and a .label file if the labels were saved)
+    :param header_file: .csr.json header
+    :param data_file: output .dat file, by default next to the header
+    :param label_file: output .label file, by default next to the header
+    :return: (data file, label file or None)
+    """
+    indptr, indices, labels, _ = load_csr(header_file)
+    prefix = header_file[:-len(CsrWriter.extension)]
+    data_file = data_file or prefix + DatWriter.extension
+    if labels is not None:
+        label_file = label_file or prefix + DatWriter.label_extension
+    else:
+        label_file = None
+    log.info(f"Converting {header_file} to {data_file}")
+
+    writer = DatWriter(data_file, label_file)
+    for start in range(0, len(indptr) - 1, CONVERT_CHUNK_SIZE):
+        end = min(start + CONVERT_CHUNK_SIZE, len(indptr) - 1)
+        flat = indices[indptr[start]:indptr[end]].tolist()
+        bounds = (indptr[start:end + 1] - indptr[start]).tolist()
+        writer.write([flat[a:b] for a, b in zip(bounds[:-1], bounds[1:])],
+                     labels[start:end].tolist() if labels is not None else [])
+    writer.close()
+    return data_file, label_file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert synthetic data between .dat and binary CSR formats')
+    parser.add_argument('input', type=str, help=".dat file or .csr.json header")
+    parser.add_argument('--label', type=str, default=None, help=".label file of the .dat file to convert")
+    args = parser.parse_args()
+    if args.input.endswith(CsrWriter.extension):
+        print(*csr_to_dat(args.input))
+    else:
+        print(*dat_to_csr(args.input, args.label))
@@ -0,0 +1,165 @@
+import queue
+import random
+import logging
+import threading
+
+import numpy as np
+
+from binaps_data.engine import class_proportions as make_class_proportions
+from binaps_data.pattern import PatternManager, PatternManagerWithCat
+from binaps_data.line import LineManager, LineManagerWithCat
+
+log = logging.getLogger('main')
+
+PREFETCH_END = None  # put inside the prefetch queue once the stream is over
+
+
+def csr_to_dense(indptr, indices, nbr_of_feature: int) -> np.ndarray:
+    """
+    Convert lines to a dense matrix
+    :param indptr: lines[i] is indices[indptr[i]:indptr[i+1]]
+    :param indices: 1-based features
+    :return: uint8 array of shape (nbr_of_rows, nbr_of_feature), column j is the feature j+1
+    """
+    dense = np.zeros((len(indptr) - 1, nbr_of_feature), dtype=np.uint8)
+    dense[np.repeat(np.arange(len(indptr) - 1), np.diff(indptr)), indices - 1] = 1
+    return dense
+
+
+class SyntheticDataset:
+    """
+    Stream of synthetic data generated in memory, for training loops reading the data as it is created (no file).
+    Patterns are drawn once when the dataset is created, each iteration then generates new lines from them (the
+    same lines with the counter engine, each row depending only on the seed and its index).
+    Batches are (indptr, indices, labels) CSR arrays of 1-based features, or (matrix, labels) with dense, labels
+    being None without categories
+
+        nbr_of_feature  : number of features
+        batch_size      : number of rows by batch
+        nbr_of_rows     : number of rows of one iteration, None for an endless stream
+        dense           : give dense uint8 matrices instead of CSR arrays
+        prefetch        : number of batches generated in advance by a background thread, 0 to generate them on demand
+        seed            : seed of the random module, drawn if not given
+        pattern_manager : PatternManager holding the patterns
+        line_manager    : LineManager generating the lines (see its stats)
+    """
+
+    def __init__(self,
+                 nbr_of_feature: int = 100,
+                 nbr_pattern: int = 10,
+                 min_size: int = 2,
+                 max_size: int = 10,
+                 split: int = 50,
+                 nbr_of_class: int = 2,
+                 class_proportions=None,
+                 no_intersections: bool = False,
+                 categories_off: bool = False,
+                 max_using_pattern: int = 0,
+                 max_pattern_on_a_line: int = 10,
+                 noise: float = 0.001,
+                 noise_model: str = 'exact',
+                 noise_rates=None,
+                 engine: str = 'numpy',
+                 batch_size: int = 1024,
+                 nbr_of_rows: int = None,
+                 dense: bool = False,
+                 prefetch: int = 0,
+                 seed: int = None,
+                 cache=None):
+        """
+        :param cache: PatternCache to load the patterns from, see PatternManager.create_patterns
+        Other parameters are the ones of main
+        """
+        if batch_size <= 0:
+            raise ValueError(f"Arguments can't be followed: batch size {batch_size} is not positive")
+        self.nbr_of_feature = nbr_of_feature
+        self.split = split
+        self.noise = noise
+        self.noise_model = noise_model
+        self.noise_rates = noise_rates
+        self.engine = engine
+        self.batch_size = batch_size
+        self.nbr_of_rows = nbr_of_rows
+        self.dense = dense
+        self.prefetch = prefetch
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.categories_off = categories_off
+
+        random.seed(self.seed)
+        if categories_off:
+            self.pattern_manager = PatternManager(max_using_pattern=max_using_pattern)
+            self.line_manager = LineManager()
+            self.max_pat_line = min(max_pattern_on_a_line, nbr_pattern)
+        else:
+            self.pattern_manager = PatternManagerWithCat(max_using_pattern=max_using_pattern,
+                                                         class_proportions=make_class_proportions(nbr_of_class,
+                                                                                                  class_proportions))
+            self.line_manager = LineManagerWithCat()
+            self.max_pat_line = max_pattern_on_a_line if max_pattern_on_a_line < (nbr_pattern / 2) else nbr_pattern / 2
+        self.pattern_manager.create_patterns(nbr_of_feature, nbr_pattern, min_size, max_size, split,
+                                             no_intersections, cache=cache, seed=self.seed)
+
+    def _batches(self):
+        for indptr, indices, labels in self.line_manager.iter_batches(nbr_of_feature=self.nbr_of_feature,
+                                                                      patterns_manager=self.pattern_manager,
+                                                                      max_pat_by_line=self.max_pat_line,
+                                                                      noise=self.noise,
+                                                                      split=self.split,
+                                                                      batch_size=self.batch_size,
+                                                                      nbr_of_rows=self.nbr_of_rows,
+                                                                      engine=self.engine,
+                                                                      noise_model=self.noise_model,
+                                                                      noise_rates=self.noise_rates,
+                                                                      seed=self.seed):
+            labels = None if self.categories_off else labels
+            if self.dense:
+                yield csr_to_dense(indptr, indices, self.nbr_of_feature), labels
+            else:
+                yield indptr, indices, labels
+
+    def _prefetched(self):
+        """
+        Generate the batches on a background thread, at most prefetch batches ahead of the consumer
+        """
+        batches = queue.Queue(self.prefetch)
+        stop = threading.Event()
+        errors = []
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for batch in self._batches():
+                    if not put(batch):
+                        return
+            except Exception as e:
+                errors.append(e)
+            put(PREFETCH_END)
+
+        thread = threading.Thread(target=produce, name="binaps-prefetch", daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is PREFETCH_END:
+                    if errors:
+                        raise errors[0]
+                    return
+                yield batch
+        finally:
+            stop.set()  # the consumer stopped early (break, exception)
+            thread.join()
+
+    def __iter__(self):
+        """
+        :return: generator of batches, each iteration continues the random stream of the previous one (the counter
+            engine starts again from the first row)
+        """
+        return self._prefetched() if self.prefetch > 0 else self._batches()
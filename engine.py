@@ -0,0 +1,581 @@
+import os
+import math
+import random
+import logging
+
+import numpy as np
+
+from binaps_data.writer import label_dtype
+
+log = logging.getLogger('main')
+
+BATCH_SIZE = 4096  # number of rows drawn at once by the numpy engine
+DENSE_SAMPLING_LIMIT = 1 << 22  # maximum number of random keys drawn at once by the dense sampling
+
+
+def new_rng():
+    """
+    Create a numpy generator seeded from the global random module, so random.seed drives both engines
+    :return: numpy Generator
+    """
+    return np.random.default_rng(random.getrandbits(64))
+
+
+def sample_without_replacement(rng, n: int, k):
+    """
+    Draw, for each row, k[r] distinct integers in [0, n) with uniform probability
+    :param rng: numpy Generator
+    :param n: size of the population
+    :param k: array of int, number of values to draw for each row (each one <= n)
+    :return: (rows, values) flat arrays, values are grouped by row
+    """
+    k = np.asarray(k, dtype=np.int64)
+    rows = np.repeat(np.arange(len(k)), k)
+    kmax = int(k.max()) if len(k) else 0
+    if kmax == 0:
+        return rows, np.empty(0, dtype=np.int64)
+
+    if kmax * 4 > n:
+        # dense: random keys for the whole population, the kmax smallest keys of a row are the picks
+        step = max(1, DENSE_SAMPLING_LIMIT // n)
+        picks = []
+        for start in range(0, len(k), step):
+            keys = rng.random((min(step, len(k) - start), n))
+            part = np.argpartition(keys, kmax - 1, axis=1)[:, :kmax]
+            order = np.argsort(np.take_along_axis(keys, part, axis=1), axis=1)  # random order inside the picks
+            picks.append(np.take_along_axis(part, order, axis=1))
+        values = np.concatenate(picks)
+        return rows, values[np.arange(kmax) < k[:, None]]
+    else:
+        # sparse: draw with replacement then redraw the duplicates until every row is made of distinct values
+        values = rng.integers(0, n, len(rows))
+        while True:
+            keys = rows * n + values
+            keys.sort()  # rows are already sorted, so only the values move inside their row
+            values = keys - rows * n
+            dup = np.flatnonzero(keys[1:] == keys[:-1]) + 1
+            if not len(dup):
+                return rows, values  # values are sorted inside each row
+            values[dup] = rng.integers(0, n, len(dup))
+
+
+def sample_without_replacement_by_row(rng, n, k):
+    """
+    Same as sample_without_replacement with its own population size for each row: draw k[r] distinct integers in
+    [0, n[r]). Rows drawing most of their population use random keys (their population is smaller than 4*k[r], so
+    the matrix of keys stays narrow), the others draw with replacement then redraw the duplicates
+    :param n: array of int, size of the population of each row
+    :param k: array of int, number of values to draw for each row (each one <= n[r])
+    :return: (rows, values) flat arrays, values are grouped by row
+    """
+    n = np.asarray(n, dtype=np.int64)
+    k = np.asarray(k, dtype=np.int64)
+    rows = np.repeat(np.arange(len(k)), k)
+    values = np.empty(len(rows), dtype=np.int64)
+    dense = n < 4 * k
+    in_dense = np.repeat(dense, k)
+
+    picked = np.flatnonzero(dense & (k > 0))
+    if len(picked):
+        width = int(n[picked].max())
+        keys = rng.random((len(picked), width))
+        keys[np.arange(width) >= n[picked][:, None]] = 2.  # outside the population, never among the k smallest
+        order = np.argsort(keys, axis=1)[:, :int(k[picked].max())]
+        values[in_dense] = order[np.arange(order.shape[1]) < k[picked][:, None]]
+
+    sparse_rows = rows[~in_dense]
+    if len(sparse_rows):
+        stride = int(n.max())
+        sparse = rng.integers(0, n[sparse_rows])
+        while True:
+            keys = sparse_rows * stride + sparse
+            keys.sort()
+            sparse = keys - sparse_rows * stride
+            dup = np.flatnonzero(keys[1:] == keys[:-1]) + 1
+            if not len(dup):
+                break
+            sparse[dup] = rng.integers(0, n[sparse_rows[dup]])
+        values[~in_dense] = sparse
+    return rows, values
+
+
+def class_proportions(nbr_of_class: int = 2, proportions=None):
+    """
+    Proportion of each class of the multi-class mode
+    :param nbr_of_class: number of classes
+    :param proportions: weight of each class (array, string of comma-separated weights or file with one weight by
+        line), None for classes of the same size
+    :return: float array of K proportions summing to 1, None for the two categories drawn with the split
+    """
+    if proportions is None:
+        if nbr_of_class == 2:
+            return None
+        proportions = np.ones(nbr_of_class)
+    elif isinstance(proportions, str):
+        proportions = np.loadtxt(proportions, dtype=np.float64, ndmin=1) if os.path.exists(proportions) \
+            else np.array(proportions.split(','), dtype=np.float64)
+    proportions = np.asarray(proportions, dtype=np.float64)
+    if nbr_of_class != 2 and len(proportions) != nbr_of_class:
+        raise ValueError(f"Arguments can't be followed: {len(proportions)} class proportions given for "
+                         f"{nbr_of_class} classes")
+    if len(proportions) < 2 or np.any(proportions < 0) or not proportions.sum() > 0:
+        raise ValueError("Arguments can't be followed: class proportions must be at least 2 non-negative weights "
+                         "with a positive sum")
+    return proportions / proportions.sum()
+
+
+class ClassSampler:
+    """
+    Draw the class of rows following a proportion vector in O(1) by row whatever the number of classes, with the
+    alias method: a class is drawn uniformly, then a biased coin keeps it or gives its alias
+
+        proportions : probability of each class
+        threshold   : probability of keeping the class drawn
+        alias       : class given instead of the class drawn
+        dtype       : dtype of the labels, the smallest one holding every class
+    """
+
+    def __init__(self, proportions):
+        self.proportions = np.asarray(proportions, dtype=np.float64)
+        nbr_of_class = len(self.proportions)
+        self.dtype = np.dtype(label_dtype(nbr_of_class))
+        scaled = self.proportions * nbr_of_class
+        self.threshold = np.ones(nbr_of_class)
+        self.alias = np.arange(nbr_of_class)
+        small = np.flatnonzero(scaled < 1).tolist()
+        large = np.flatnonzero(scaled >= 1).tolist()
+        while small and large:
+            i, j = small.pop(), large[-1]
+            self.threshold[i] = scaled[i]
+            self.alias[i] = j
+            scaled[j] -= 1 - scaled[i]
+            if scaled[j] < 1:
+                small.append(large.pop())
+        self._threshold = self.threshold.tolist()
+        self._alias = self.alias.tolist()
+
+    def __len__(self):
+        return len(self.proportions)
+
+    def sample(self, rng, nbr_of_rows: int) -> np.ndarray:
+        """
+        Draw the class of a batch of rows with a numpy Generator
+        """
+        drawn = rng.integers(0, len(self), nbr_of_rows)
+        return self.pick(drawn, rng.random(nbr_of_rows))
+
+    def pick(self, drawn, coins) -> np.ndarray:
+        """
+        Class of rows from the class drawn uniformly and the coin in [0, 1) of each row
+        """
+        return np.where(coins < self.threshold[drawn], drawn, self.alias[drawn]).astype(self.dtype)
+
+    def sample_one(self) -> int:
+        """
+        Draw the class of one row with the random module
+        """
+        drawn = random.randrange(len(self._alias))
+        return drawn if random.random() < self._threshold[drawn] else self._alias[drawn]
+
+
+def merge_noise_pat_batch(pat_rows, pat_values, noise_rows, noise_values, nbr_of_rows: int, stride: int):
+    """
+    Flat version of LineManager.merge_noise_pat for a batch of rows: values of patterns are united then the noise
+    is applied with a symmetric difference
+    :param pat_rows: row of each pattern value
+    :param pat_values: pattern values
+    :param noise_rows: row of each noise value
+    :param noise_values: noise values (distinct inside a row)
+    :param nbr_of_rows: number of rows inside the batch
+    :param stride: strictly greater than any value
+    :return: (indptr, indices) CSR arrays, indices are sorted inside each row
+    """
+    # keys are tagged with their origin (even for patterns, odd for noise) and sorted once
+    keys = np.concatenate([(pat_rows * stride + pat_values) * 2, (noise_rows * stride + noise_values) * 2 + 1])
+    keys.sort()
+    if not len(keys):
+        return np.zeros(nbr_of_rows + 1, dtype=np.int64), keys
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = (keys[1:] >> 1) != (keys[:-1] >> 1)
+    starts = np.flatnonzero(first)
+    ends = np.append(starts[1:], len(keys)) - 1
+
+    # a value is kept if it comes only from patterns or only from noise, i.e. NOT present in both
+    in_pattern = (keys[starts] & 1) == 0
+    in_noise = (keys[ends] & 1) == 1
+    keys = keys[starts[in_pattern != in_noise]] >> 1
+
+    rows = keys // stride
+    indptr = np.zeros(nbr_of_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=nbr_of_rows), out=indptr[1:])
+    return indptr, keys - rows * stride
+
+
+class BatchLineEngine:
+    """
+    Generate lines by batch of rows with numpy. Follow the same distributions as LineManager.compile_lines:
+        - label drawn with the split, or with the class proportions of the pattern manager (see ClassSampler)
+        - number of patterns drawn uniformly in [1, max_pat_by_line+1] and limited by the available patterns
+        - patterns picked without replacement among the patterns of the label
+        - noisy features drawn by the noise model, applied with a symmetric difference
+
+        patterns_manager : pattern manager to reach pattern
+        noise_model      : noise model drawing the noisy features of a batch (see noise.py)
+        rng              : numpy Generator
+        truth            : GroundTruth counting the patterns of each row, None to not count them
+    """
+
+    def __init__(self,
+                 patterns_manager: object,
+                 nbr_of_feature: int,
+                 max_pat_by_line: int,
+                 noise_model: object,
+                 split: int,
+                 rng=None,
+                 truth=None):
+        self.patterns_manager = patterns_manager
+        self.nbr_of_feature = nbr_of_feature
+        self.max_pat_by_line = int(max_pat_by_line)
+        self.noise_model = noise_model
+        self.split = split
+        self.rng = rng if rng is not None else new_rng()
+        self.nbr_of_flip = 0  # number of noisy features drawn so far
+        self.truth = truth
+
+    def generate(self, nbr_of_rows: int) -> tuple:
+        """
+        Generate a batch of lines
+        :param nbr_of_rows: number of rows inside the batch
+        :return: (indptr, indices, labels), lines as CSR arrays and their labels
+        """
+        rng = self.rng
+        classes = self.patterns_manager.classes
+        if classes is None:
+            labels = (rng.random(nbr_of_rows) > (self.split / 100)).astype(np.uint8)
+        else:
+            labels = classes.sample(rng, nbr_of_rows)
+        nbr_pattern = rng.integers(1, self.max_pat_by_line + 2, nbr_of_rows)
+
+        if classes is None:
+            pat_rows, pat_values = self._pick_patterns(nbr_pattern, labels)
+        else:
+            pat_rows, pat_values = self._pick_class_patterns(nbr_pattern, labels)
+
+        noise_rows, noise_values = self.noise_model.sample_batch(rng, nbr_of_rows)
+        self.nbr_of_flip += len(noise_values)
+        indptr, indices = merge_noise_pat_batch(pat_rows, pat_values, noise_rows, noise_values,
+                                                nbr_of_rows, self.nbr_of_feature + 1)
+        return indptr, indices, labels
+
+    def _pick_patterns(self, nbr_pattern, labels) -> tuple:
+        """
+        Pick patterns of each row inside the pool of its label and gather their values
+        :return: (rows, values) flat arrays
+        """
+        all_rows = []
+        all_values = []
+        pools = [(self.patterns_manager.get_pool(label), label) for label in (0, 1)]
+        for i, (pool, label) in enumerate(pools):
+            if any(pool is other for other, _ in pools[:i]):
+                continue
+            # rows of every label sharing this pool draw together, in row order
+            rows = np.flatnonzero(np.isin(labels, [other_label for other, other_label in pools if other is pool]))
+            pool_rows, ids = pool.sample_batch(self.rng, nbr_pattern[rows])  # positions inside rows
+            picked_rows, values = pool.gather(rows[pool_rows], ids)
+            all_rows.append(picked_rows)
+            all_values.append(values)
+            if self.truth is not None:
+                self.truth.add_patterns_by_row(np.bincount(pool_rows, minlength=len(rows)))
+        return np.concatenate(all_rows), np.concatenate(all_values)
+
+    def _pick_class_patterns(self, nbr_pattern, labels) -> tuple:
+        """
+        Pick patterns of each row inside the pool of its class, for many classes: pools are reached by index, and
+        without use limit the rows of every class draw at once, so the cost by row doesn't grow with the number of
+        classes
+        :return: (rows, values) flat arrays
+        """
+        manager = self.patterns_manager
+        if manager.max_using_pattern:
+            # use counts make a row depend on the rows before it inside its pool, so each class draws on its own
+            order = np.argsort(labels, kind='stable')
+            bounds = np.flatnonzero(np.diff(labels[order])) + 1
+            all_rows = []
+            all_values = []
+            for rows in np.split(order, bounds):
+                pool = manager.get_pool(int(labels[rows[0]]))
+                pool_rows, ids = pool.sample_batch(self.rng, nbr_pattern[rows])
+                picked_rows, values = pool.gather(rows[pool_rows], ids)
+                all_rows.append(picked_rows)
+                all_values.append(values)
+                if self.truth is not None:
+                    self.truth.add_patterns_by_row(np.bincount(pool_rows, minlength=len(rows)))
+            if not all_rows:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+            return np.concatenate(all_rows), np.concatenate(all_values)
+
+        class_ptr, class_ids = manager.get_class_index()
+        sizes = class_ptr[labels.astype(np.int64) + 1] - class_ptr[labels]
+        counts = np.minimum(nbr_pattern, sizes)
+        rows, picks = sample_without_replacement_by_row(self.rng, sizes, counts)
+        ids = class_ids[class_ptr[labels[rows]] + picks]
+        manager.get_pool(0).use(ids)  # every pool counts the use inside the same table
+        if self.truth is not None:
+            self.truth.add_patterns_by_row(counts)
+        return manager.get_pool(0).gather(rows, ids)
+
+
+class CounterHash:
+    """
+    Counter-based random numbers: the draw j of the stream s of the row i is a pure function of (key, i, s, j),
+    computed with the SplitMix64 mixing. Draws of any set of rows are vectorized and don't depend on the other rows
+
+        key : 64 bits key derived from the seed
+    """
+    GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+    def __init__(self, seed: int):
+        key = 0
+        seed = int(seed)
+        while seed:  # seeds of more than 64 bits are folded
+            key ^= seed & 0xFFFFFFFFFFFFFFFF
+            seed >>= 64
+        self.key = self._mix(np.array([key], dtype=np.uint64))[0]
+
+    @staticmethod
+    def _mix(x):
+        x = x ^ (x >> np.uint64(30))
+        x = x * np.uint64(0xBF58476D1CE4E5B9)
+        x = x ^ (x >> np.uint64(27))
+        x = x * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+    def random(self, rows, stream: int, draws=0) -> np.ndarray:
+        """
+        Uniform floats in [0, 1)
+        :param rows: array of row indexes
+        :param stream: kind of draw (label, patterns, noise...), so the draws of a kind don't depend on the others
+        :param draws: index of the draw inside the stream of the row (int or array of the size of rows)
+        :return: float array of the size of rows
+        """
+        rows = np.asarray(rows, dtype=np.uint64)
+        draws = np.asarray(draws, dtype=np.uint64) + np.uint64(stream << 48)
+        with np.errstate(over='ignore'):  # arithmetic modulo 2**64
+            x = self._mix(self.key + (rows + np.uint64(1)) * self.GOLDEN)
+            x = self._mix(x + (draws + np.uint64(1)) * self.GOLDEN)
+        return (x >> np.uint64(11)).astype(np.float64) * 2. ** -53
+
+    def integers(self, rows, stream: int, n, draws=0) -> np.ndarray:
+        """
+        Integers in [0, n), see random
+        """
+        return np.minimum(self.random(rows, stream, draws) * n, np.asarray(n) - 1).astype(np.int64)
+
+    def sample(self, rows, n, k, stream: int) -> tuple:
+        """
+        Draw, for each row, k[r] distinct integers in [0, n[r]) (see sample_without_replacement_by_row). Rows drawing
+        most of their population keep the k smallest keys of the population, the others keep the k first distinct
+        values of their stream of draws
+        :param rows: array of row indexes
+        :param n: array of int, size of the population of each row
+        :param k: array of int, number of values to draw for each row (each one <= n[r])
+        :return: (rows, values) flat arrays, rows are positions inside the rows given, values are grouped by row
+        """
+        rows = np.asarray(rows, dtype=np.uint64)
+        n = np.broadcast_to(np.asarray(n, dtype=np.int64), rows.shape)
+        k = np.broadcast_to(np.asarray(k, dtype=np.int64), rows.shape)
+        local = np.repeat(np.arange(len(k)), k)
+        values = np.empty(len(local), dtype=np.int64)
+        dense = n < 4 * k
+        in_dense = np.repeat(dense, k)
+
+        picked = np.flatnonzero(dense & (k > 0))
+        if len(picked):
+            width = int(n[picked].max())
+            step = max(1, DENSE_SAMPLING_LIMIT // width)
+            picks = []
+            for start in range(0, len(picked), step):
+                part = picked[start:start + step]
+                keys = self.random(np.repeat(rows[part], width), stream,
+                                   np.tile(np.arange(width), len(part))).reshape(len(part), width)
+                keys[np.arange(width) >= n[part][:, None]] = 2.  # outside the population, never picked
+                order = np.argsort(keys, axis=1)[:, :int(k[part].max())]
+                picks.append(order[np.arange(order.shape[1]) < k[part][:, None]])
+            values[in_dense] = np.concatenate(picks)
+
+        todo = np.flatnonzero(~dense & (k > 0))
+        if len(todo):
+            values[~in_dense] = self._sample_sparse(rows[todo], n[todo], k[todo], stream)
+        return local, values
+
+    def _sample_sparse(self, rows, n, k, stream: int) -> np.ndarray:
+        """
+        k[r] first distinct values of the draws in [0, n[r]) of each row. Rows lacking distinct values draw twice
+        as many again, and as draws only depend on their index, the values kept don't depend on the number drawn
+        :return: values, grouped by row
+        """
+        offsets = np.cumsum(k) - k
+        values = np.empty(int(k.sum()), dtype=np.int64)
+        nbr_of_draw = k + k // 2 + 2
+        stride = int(n.max())
+        todo = np.arange(len(k))
+        while len(todo):
+            size = nbr_of_draw[todo]
+            starts = np.cumsum(size) - size
+            item = np.repeat(np.arange(len(todo)), size)
+            draws = np.arange(len(item)) - starts[item]
+            candidates = self.integers(rows[todo][item], stream, n[todo][item], draws)
+
+            # first draw of each value inside its row: keys sorted by (row, value, draw)
+            width = int(size.max())
+            keys = (item * stride + candidates) * width + draws
+            keys.sort()
+            values_keys = keys // width
+            first = np.ones(len(keys), dtype=bool)
+            first[1:] = values_keys[1:] != values_keys[:-1]
+            kept = np.zeros(len(item), dtype=bool)
+            kept[starts[values_keys[first] // stride] + keys[first] % width] = True
+
+            total = np.cumsum(kept)
+            rank = total - 1 - np.concatenate([[0], total])[starts][item]  # rank of a kept value inside its row
+            done = np.bincount(item[kept], minlength=len(todo)) >= k[todo]
+            take = kept & done[item] & (rank < k[todo][item])
+            values[offsets[todo[item[take]]] + rank[take]] = candidates[take]
+            todo = todo[~done]
+            nbr_of_draw[todo] *= 2
+        return values
+
+    def flips(self, rows, rate: float, n: int, stream: int) -> tuple:
+        """
+        Positions of the successes of n Bernoulli trials of probability rate for each row, reached by skipping the
+        gaps between them (geometric law), so the cost grows with the number of successes
+        :return: (rows, positions) flat arrays, rows are positions inside the rows given, positions are 0-based
+        """
+        rows = np.asarray(rows, dtype=np.uint64)
+        if rate == 0 or n == 0 or not len(rows):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        if rate == 1:
+            return np.repeat(np.arange(len(rows)), n), np.tile(np.arange(n, dtype=np.int64), len(rows))
+        log_q = math.log1p(-rate)
+        expected = n * rate
+        nbr_of_draw = np.full(len(rows), int(expected + 4 * math.sqrt(expected) + 16))
+        all_rows = []
+        all_positions = []
+        todo = np.arange(len(rows))
+        while len(todo):
+            size = nbr_of_draw[todo]
+            starts = np.cumsum(size) - size
+            item = np.repeat(np.arange(len(todo)), size)
+            draws = np.arange(len(item)) - starts[item]
+            gaps = 1 + np.floor(np.log1p(-self.random(rows[todo][item], stream, draws)) / log_q).astype(np.int64)
+            positions = np.cumsum(gaps)
+            positions -= np.concatenate([[0], positions])[starts][item] + 1
+            done = positions[starts + size - 1] >= n
+            kept = done[item] & (positions < n)
+            all_rows.append(todo[item[kept]])
+            all_positions.append(positions[kept])
+            todo = todo[~done]
+            nbr_of_draw[todo] *= 2
+        flip_rows = np.concatenate(all_rows)
+        order = np.argsort(flip_rows, kind='stable')
+        return flip_rows[order], np.concatenate(all_positions)[order]
+
+
+class CounterLineEngine:
+    """
+    Generate any row on its own: the label, patterns and noise of row i are drawn from a counter-based hash keyed by
+    the seed, the row index and the index of the draw (see CounterHash), so they don't depend on the rows before.
+    generate_rows(i, j) draws the whole range at once with numpy and costs O(rows asked), ranges of rows can be
+    generated in any order or in parallel with the same result. Rows follow the same distributions as
+    BatchLineEngine.
+    Patterns must not be limited in use (max_using_pattern 0), as the use of a pattern would depend on the rows before
+
+        patterns_manager : pattern manager to reach pattern
+        noise_model      : noise model drawing the noisy features of rows (see noise.py)
+        seed             : key of the generator
+        counter          : CounterHash keyed by the seed
+        row              : next row given by generate, so the engine can replace BatchLineEngine
+        truth            : GroundTruth counting the patterns of each row, None to not count them
+    """
+    rng = None  # no generator state to checkpoint, the row is enough
+    # streams of draws of a row
+    LABEL_STREAM = 0
+    CLASS_STREAM = 1
+    NBR_PATTERN_STREAM = 2
+    PATTERN_STREAM = 3
+    NOISE_STREAM = 4  # and the following ones, see the sample_rows method of the noise models
+
+    def __init__(self,
+                 patterns_manager: object,
+                 nbr_of_feature: int,
+                 max_pat_by_line: int,
+                 noise_model: object,
+                 split: int,
+                 seed: int,
+                 truth=None,
+                 first_row: int = 0):
+        """
+        :param first_row: first row given by generate (e.g. first row of a shard)
+        """
+        if patterns_manager.max_using_pattern:
+            raise ValueError("Arguments can't be followed: rows can't be generated on their own when patterns are "
+                             "limited in use, use max_using_pattern 0")
+        self.patterns_manager = patterns_manager
+        self.nbr_of_feature = nbr_of_feature
+        self.max_pat_by_line = int(max_pat_by_line)
+        self.noise_model = noise_model
+        self.split = split
+        self.seed = seed
+        self.counter = CounterHash(seed)
+        self.truth = truth
+        self.row = first_row
+        self.nbr_of_flip = 0  # number of noisy features drawn so far
+
+    def generate_row(self, i: int) -> tuple:
+        """
+        Generate the row i
+        :return: (values, label), values are the sorted 1-based features of the row
+        """
+        _, indices, labels = self.generate_rows(i, i + 1)
+        return indices, int(labels[0])
+
+    def generate_rows(self, start: int, stop: int) -> tuple:
+        """
+        Generate the rows start to stop (excluded), and count the use of the patterns picked
+        :return: (indptr, indices, labels), lines as CSR arrays and their labels
+        """
+        counter = self.counter
+        rows = np.arange(start, max(start, stop), dtype=np.uint64)
+        classes = self.patterns_manager.classes
+        if classes is None:
+            labels = (counter.random(rows, self.LABEL_STREAM) > (self.split / 100)).astype(np.uint8)
+        else:
+            labels = classes.pick(counter.integers(rows, self.LABEL_STREAM, len(classes)),
+                                  counter.random(rows, self.CLASS_STREAM))
+        nbr_pattern = 1 + counter.integers(rows, self.NBR_PATTERN_STREAM, self.max_pat_by_line + 1)
+
+        class_ptr, class_ids = self.patterns_manager.get_class_index()
+        labels_index = labels.astype(np.int64)
+        sizes = class_ptr[labels_index + 1] - class_ptr[labels_index]
+        counts = np.minimum(nbr_pattern, sizes)
+        pat_rows, picks = counter.sample(rows, sizes, counts, self.PATTERN_STREAM)
+        ids = class_ids[class_ptr[labels_index[pat_rows]] + picks]
+        pool = self.patterns_manager.get_pool(0)
+        pool.use(ids)  # every pool counts the use inside the same table
+        if self.truth is not None:
+            self.truth.add_patterns_by_row(counts)
+        pat_rows, pat_values = pool.gather(pat_rows, ids)
+
+        noise_rows, noise_values = self.noise_model.sample_rows(counter, rows, self.NOISE_STREAM)
+        self.nbr_of_flip += len(noise_values)
+        indptr, indices = merge_noise_pat_batch(pat_rows, pat_values, noise_rows, noise_values,
+                                                len(rows), self.nbr_of_feature + 1)
+        return indptr, indices, labels
+
+    def generate(self, nbr_of_rows: int) -> tuple:
+        """
+        Generate the next rows, see BatchLineEngine.generate
+        """
+        batch = self.generate_rows(self.row, self.row + nbr_of_rows)
+        self.row += nbr_of_rows
+        return batch
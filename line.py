@@ -1,26 +1,116 @@
 import tqdm
+import time
 import random
 import os
+import json
 import logging
+import multiprocessing
+
+import numpy as np
+
+from binaps_data.engine import BatchLineEngine, CounterLineEngine, BATCH_SIZE
+from binaps_data.writer import BackgroundWriter, CsrWriter, WRITERS
+from binaps_data.noise import make_noise_model
+from binaps_data.compress import compressed_name
+from binaps_data.checkpoint import Checkpointer, random_state_from_json
+from binaps_data.rows import RowStore
+from binaps_data.truth import GroundTruth, PatternIndex, TRUTH_EXTENSION, ROW_PATTERNS_EXTENSION
+from binaps_data.utils.stats import Stats
 
 log = logging.getLogger('main')
 
+SAVE_CHUNK_SIZE = 10000  # number of lines formatted at once when saving
+
+_shard_patterns_manager = None  # pattern manager of a worker process, see compile_lines_sharded
+
+
+def _init_shard_worker(patterns_manager):
+    global _shard_patterns_manager
+    _shard_patterns_manager = patterns_manager
+
+
+def shard_bounds(nbr_of_rows: int, workers: int) -> list:
+    """
+    First row of each shard of compile_lines_sharded, then nbr_of_rows
+    """
+    return np.linspace(0, nbr_of_rows, workers + 1).astype(int).tolist()
+
+
+def split_use_limit(max_using_pattern: int, rows) -> list:
+    """
+    Split the use limit of the patterns between shards in proportion to their rows, the remainder going to the
+    shards with the largest fractional parts (the first ones on ties). A pattern is retired once used more than
+    max_using_pattern times, so a single process uses it up to max_using_pattern + 1 times: this budget of uses is
+    split, and the shards together don't use a pattern more than a single process would
+    :param rows: number of rows of each shard
+    :return: list, use limit of each shard
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    total = max(int(rows.sum()), 1)
+    budget = max_using_pattern + 1
+    shares = budget * rows // total
+    order = np.argsort(-(budget * rows % total), kind='stable')
+    shares[order[:budget - int(shares.sum())]] += 1
+    if np.any((rows > 0) & (shares < 2)):
+        raise ValueError(f"Arguments can't be followed: max_using_pattern {max_using_pattern} can't be split between "
+                         f"{len(rows)} workers, use a max_using_pattern of at least {2 * len(rows) - 1} or fewer "
+                         f"workers")
+    return np.maximum(shares - 1, 0).tolist()
+
+
+def _compile_shard(task):
+    """
+    Generate the rows of one shard inside a worker process
+    :param task: (line manager class, seed of the shard, use limit of the patterns inside the shard, keyword
+        arguments for compile_lines)
+    :return: (output file(s) of the shard, number of one inside the shard, stats of the shard as a dict, ground truth
+        of the shard as a dict or None)
+    """
+    line_manager_class, seed, max_using_pattern, kwargs = task
+    random.seed(seed)
+    _shard_patterns_manager.reset_use(max_using_pattern)  # a process may generate more than one shard
+    line_manager = line_manager_class()
+    files = line_manager.compile_lines(patterns_manager=_shard_patterns_manager, **kwargs)
+    truth = line_manager.truth.get_state() if line_manager.truth is not None else None
+    return files, line_manager.nbr_of_one, line_manager.stats.to_dict(), truth
+
 
 class LineManager:
     """
     Manage lines for the synthetic DB
         nbr_of_one : count the number of one put inside the DB to calculate sparsity later
-        lines      : hold created lines
-        labels     : hold associated labels if needed
+        rows       : RowStore holding the created lines and their labels (not written yet)
+        lines      : rows, as a sequence of lists
+        labels     : labels of rows, as a numpy array
+        stats      : stage timers and counters of the generation
+        truth      : GroundTruth counted along the generation, None if not asked
+        row_patterns_file : row->pattern sidecar listing the patterns fully present inside each row, None if not asked
     """
-    nbr_of_one = 0
-    lines = []
-    labels = []
 
     def __init__(self):
-        self.nbr_of_one = 0
-        self.lines = []
-        self.labels = []
+        self.rows = RowStore()
+        self._nbr_of_one_written = 0  # number of one of the lines written and removed from rows
+        self.stats = Stats()
+        self.truth = None
+        self.row_patterns_file = None
+        self._pattern_index = None  # PatternIndex of the patterns, while the sidecar is written
+        self._row_patterns = None  # writer of the sidecar
+
+    @property
+    def nbr_of_one(self) -> int:
+        return self._nbr_of_one_written + self.rows.nbr_of_one
+
+    @nbr_of_one.setter
+    def nbr_of_one(self, value: int):
+        self._nbr_of_one_written = value - self.rows.nbr_of_one
+
+    @property
+    def lines(self) -> RowStore:
+        return self.rows
+
+    @property
+    def labels(self) -> np.ndarray:
+        return self.rows.labels
 
     def compile_lines(self,
                       nbr_of_rows: int,
@@ -31,48 +121,443 @@ class LineManager:
                       split: int,
                       suffix: str,
                       output_dir,
-                      disable_tqdm: bool) -> str:
+                      disable_tqdm: bool,
+                      engine: str = 'python',
+                      chunk_size: int = 0,
+                      data_format: str = 'dat',
+                      noise_model: str = 'exact',
+                      noise_rates=None,
+                      compress: str = None,
+                      checkpoint_every: int = 0,
+                      checkpoint_file: str = None,
+                      resume: tuple = None,
+                      ground_truth: bool = False,
+                      row_patterns: bool = False,
+                      seed: int = None,
+                      first_row: int = 0) -> str:
         """
 
         :param nbr_of_rows: number of rows/lines to create
         :param patterns_manager: pattern manager to reach pattern
         :param max_pat_by_line: maximum number of pattern inside one line
         :param noise: noise to add to each line. Noise can be addition of one or switching one to zero
-        :param split: percentage(0-100) of the 0 categorty
+        :param split: percentage(0-100) of the 0 categorty, unused with many classes (see PatternManagerWithCat)
         :param suffix: suffixe for output's files
         :param output_dir: output directory
+        :param engine: 'python' to build lines one by one, 'numpy' to build them by batch, 'counter' to build each row
+            from its own counter-based generator (see CounterLineEngine, patterns can't be limited in use)
+        :param chunk_size: if positive, lines are written to disk by chunk of this number of rows while they are
+            created instead of being kept until the end (memory stays bounded)
+        :param data_format: 'dat' for text lines, 'csr' for binary CSR arrays, 'varint' for delta + varint rows,
+            'packed' for a memory-mappable bit matrix
+        :param compress: 'gzip', 'bz2' or 'xz' to compress the output files by blocks in parallel, None to not compress
+        :param noise_model: 'exact' for round(noise*nbr_of_feature) flips by line, 'bernoulli' to flip each feature
+            with probability noise, 'feature' to flip each feature with its own rate
+        :param noise_rates: rate of each feature for the 'feature' noise model (array or file, one rate by line)
+        :param checkpoint_every: if positive, save a checkpoint inside checkpoint_file every this number of rows
+            (lines are then streamed by chunk of this number of rows if chunk_size is not given)
+        :param checkpoint_file: checkpoint file, see Checkpointer
+        :param resume: (state, arrays) of a checkpoint given by load_checkpoint, to continue an interrupted run
+            called with the same arguments
+        :param ground_truth: count the ground truth of the lines inside truth, see save_truth
+        :param row_patterns: write the patterns fully present inside each row (inserted and not broken by the noise,
+            or made by accident) as a binary CSR sidecar of 1-based pattern ids (line of the pattern inside the
+            pattern file), see row_patterns_file
+        :param seed: key of the generator of the counter engine, drawn from the random module if not given
+        :param first_row: index of the first row for the counter engine (first row of a shard)
         :return: string or tuple of string, name(s) or output files
         """
-        log.info("Compile line")
-        for r in tqdm.trange(nbr_of_rows, disable=disable_tqdm):
-            label = 0 if random.random() <= (split / 100) else 1  # unused if unecessary.
+        log.info(f"Compile line with {engine} engine and {noise_model} noise")
+        noise_sampler = make_noise_model(noise_model, nbr_of_feature, noise, noise_rates)
+        self._set_label_dtype(patterns_manager)
+        if ground_truth:
+            self.truth = GroundTruth(nbr_of_feature, max_pat_by_line, patterns_manager.nbr_of_class)
+        resume_state = None
+        if resume:
+            resume_state, arrays = resume
+            patterns_manager.set_state(arrays)
+            if self.truth is not None:
+                self.truth.set_state(arrays)
+            random.setstate(random_state_from_json(resume_state["random_state"]))
+            self.nbr_of_one = resume_state["nbr_of_one"]
+        checkpointer = None
+        if checkpoint_every > 0:
+            checkpointer = Checkpointer(checkpoint_file, checkpoint_every, resume_state["row"] if resume else 0)
+            chunk_size = chunk_size if chunk_size > 0 else checkpoint_every
+        writer = None
+        if chunk_size > 0:
+            writer = self._open_writer(output_dir, suffix, data_format, compress,
+                                       resume_state["writer"] if resume else None, nbr_of_feature)
+            log.info(f"Streaming data to {writer.data_file} by chunk of {chunk_size} rows")
+        if row_patterns:
+            self._open_row_patterns(output_dir, suffix, patterns_manager, nbr_of_feature,
+                                    resume_state.get("row_patterns") if resume else None)
+
+        with self.stats.timer("lines"):
+            if engine in ('numpy', 'counter'):
+                batch_engine = None
+                if engine == 'counter':
+                    batch_engine = CounterLineEngine(patterns_manager, nbr_of_feature, max_pat_by_line, noise_sampler,
+                                                     split, random.getrandbits(64) if seed is None else seed,
+                                                     self.truth, first_row)
+                self._compile_lines_numpy(nbr_of_rows, nbr_of_feature, patterns_manager, max_pat_by_line,
+                                          noise_sampler, split, disable_tqdm, writer, chunk_size, checkpointer,
+                                          resume_state, batch_engine)
+            else:
+                self._compile_lines_python(nbr_of_rows, nbr_of_feature, patterns_manager, max_pat_by_line,
+                                           noise_sampler, split, disable_tqdm, writer, chunk_size, checkpointer,
+                                           resume_state)
+        self.stats.count("rows", nbr_of_rows)
+        self.stats.count("patterns_retired", patterns_manager.get_nbr_retired())
+        if self.truth is not None:
+            self.truth.pattern_used = patterns_manager.patterns.used.copy()
+
+        if writer is None:
+            files = self.save_data(output_dir, suffix, disable_tqdm, data_format, compress, nbr_of_feature)
+        else:
+            self._flush(writer)
+            with self.stats.timer("save_data"):
+                writer.close()  # wait for the writer thread
+            self.stats.count("bytes_written", writer.nbr_of_bytes)
+            log.info("Saving done")
+            files = self._output_files(writer.data_file, writer.label_file)
+        if self._row_patterns is not None:
+            self._row_patterns.close()
+            self._row_patterns = None
+            self._pattern_index = None
+            log.info(f"Patterns of each row saved to {self.row_patterns_file}")
+        return files
+
+    def compile_lines_sharded(self,
+                              nbr_of_rows: int,
+                              nbr_of_feature: int,
+                              patterns_manager: object,
+                              max_pat_by_line: int,
+                              noise: float,
+                              split: int,
+                              suffix: str,
+                              output_dir,
+                              disable_tqdm: bool,
+                              workers: int,
+                              seed: int,
+                              keep_shards: bool = False,
+                              engine: str = 'python',
+                              chunk_size: int = 0,
+                              data_format: str = 'dat',
+                              noise_model: str = 'exact',
+                              noise_rates=None,
+                              compress: str = None,
+                              ground_truth: bool = False,
+                              row_patterns: bool = False):
+        """
+        Compile lines with several processes. Rows are split in one shard by worker, each shard is generated with its
+        own seed derived from the master seed, so the same seed and number of workers give the same output.
+        If the patterns are limited in use (max_using_pattern), the limit is split between the shards in proportion
+        to their rows (see split_use_limit), each worker counting the use on its own copy.
+        :param workers: number of worker processes (and of shards)
+        :param seed: master seed
+        :param keep_shards: keep one file by shard and write a manifest instead of merging them
+        :return: string or tuple of string, name(s) of output files, or name of the manifest if keep_shards
+        """
+        log.info(f"Compile line with {workers} workers")
+        bounds = shard_bounds(nbr_of_rows, workers)
+        limits = [0] * workers
+        if patterns_manager.max_using_pattern:
+            limits = split_use_limit(patterns_manager.max_using_pattern, np.diff(bounds))
+            log.info(f"max_using_pattern split between the workers: {limits}")
+        seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(workers)]
+        tasks = [(type(self), seeds[i], limits[i], dict(nbr_of_rows=bounds[i + 1] - bounds[i],
+                                                         nbr_of_feature=nbr_of_feature,
+                                                         max_pat_by_line=max_pat_by_line,
+                                                         noise=noise,
+                                                         split=split,
+                                                         suffix=f"{suffix}_shard{i}",
+                                                         output_dir=output_dir,
+                                                         disable_tqdm=True,
+                                                         engine=engine,
+                                                         chunk_size=chunk_size,
+                                                         data_format=data_format,
+                                                         noise_model=noise_model,
+                                                         noise_rates=noise_rates,
+                                                         compress=compress,
+                                                         ground_truth=ground_truth,
+                                                         row_patterns=row_patterns,
+                                                         seed=seed,
+                                                         first_row=bounds[i]))
+                 for i in range(workers)]
+
+        with multiprocessing.Pool(workers, initializer=_init_shard_worker, initargs=(patterns_manager,)) as pool:
+            results = list(tqdm.tqdm(pool.imap(_compile_shard, tasks), total=workers, disable=disable_tqdm))
+        self.nbr_of_one += sum(nbr_of_one for _, nbr_of_one, _, _ in results)
+        for _, _, stats, _ in results:
+            self.stats.update(stats)  # timings are summed over the workers
+        if ground_truth:
+            self.truth = GroundTruth(nbr_of_feature, max_pat_by_line, patterns_manager.nbr_of_class)
+            for _, _, _, truth in results:
+                self.truth.update(truth)  # each worker counted the use of the patterns from 0
+        shard_files = [self._data_files(output_dir, task[3]["suffix"], data_format, compress) for task in tasks]
+        shard_row_patterns = [self._row_patterns_name(output_dir, task[3]["suffix"]) for task in tasks]
+
+        if keep_shards:
+            manifest_file = os.path.join(output_dir, f"synthetic_data_{suffix}.manifest.json")
+            manifest = {"seed": seed,
+                        "shards": [{"first_row": bounds[i],
+                                    "nbr_of_rows": bounds[i + 1] - bounds[i],
+                                    "seed": seeds[i],
+                                    "max_using_pattern": limits[i],
+                                    "files": [file for file in shard_files[i] if file],
+                                    "row_patterns_file": shard_row_patterns[i] if row_patterns else None,
+                                    "nbr_of_one": results[i][1]} for i in range(workers)]}
+            with open(manifest_file, 'w') as fd:
+                json.dump(manifest, fd, indent=1)
+            log.info(f"Shards listed in {manifest_file}")
+            return manifest_file
+
+        files = self._data_files(output_dir, suffix, data_format, compress)
+        log.info(f"Merging shards to {files[0]}")
+        WRITERS[data_format].merge(shard_files, *files)
+        if row_patterns:
+            self.row_patterns_file = self._row_patterns_name(output_dir, suffix)
+            CsrWriter.merge([(file, None) for file in shard_row_patterns], self.row_patterns_file)
+        log.info("Merging done")
+        return self._output_files(*files)
+
+    def iter_batches(self,
+                     nbr_of_feature: int,
+                     patterns_manager: object,
+                     max_pat_by_line: int,
+                     noise: float,
+                     split: int,
+                     batch_size: int,
+                     nbr_of_rows: int = None,
+                     engine: str = 'python',
+                     noise_model: str = 'exact',
+                     noise_rates=None,
+                     seed: int = None):
+        """
+        Generate lines by batch without writing them (see compile_lines for the parameters)
+        :param batch_size: number of rows by batch
+        :param nbr_of_rows: total number of rows, None for an endless stream
+        :param seed: key of the counter engine, which gives the same rows on each call
+        :return: generator of (indptr, indices, labels), lines as CSR arrays of 1-based features and their labels
+        """
+        noise_sampler = make_noise_model(noise_model, nbr_of_feature, noise, noise_rates)
+        self._set_label_dtype(patterns_manager)
+        batch_engine = None
+        if engine == 'numpy':
+            batch_engine = BatchLineEngine(patterns_manager, nbr_of_feature, max_pat_by_line, noise_sampler, split)
+        elif engine == 'counter':
+            batch_engine = CounterLineEngine(patterns_manager, nbr_of_feature, max_pat_by_line, noise_sampler, split,
+                                             random.getrandbits(64) if seed is None else seed)
+        done = 0
+        while nbr_of_rows is None or done < nbr_of_rows:
+            size = batch_size if nbr_of_rows is None else min(batch_size, nbr_of_rows - done)
+            if batch_engine is not None:
+                with self.stats.timer("generate_batch"):
+                    indptr, indices, labels = batch_engine.generate(size)
+                self.nbr_of_one += len(indices)
+            else:
+                with self.stats.timer("lines"):
+                    self._compile_lines_python(size, nbr_of_feature, patterns_manager, max_pat_by_line,
+                                               noise_sampler, split, True, None, 0)
+                indptr, indices, labels = self.rows.to_csr()
+                self._nbr_of_one_written += self.rows.nbr_of_one
+                self.rows.clear()  # the views given are kept as they are
+            done += size
+            self.stats.count("rows", size)
+            yield indptr, indices, labels
+
+    def _compile_lines_python(self, nbr_of_rows, nbr_of_feature, patterns_manager, max_pat_by_line, noise_sampler,
+                              split, disable_tqdm, writer, chunk_size, checkpointer=None, resume_state=None):
+        """
+        Compile lines one by one
+        """
+        clock = time.perf_counter
+        time_patterns = time_merge = 0.
+        nbr_of_flip = resume_state["noise_flips"] if resume_state else 0
+        first_row = resume_state["row"] if resume_state else 0
+        classes = patterns_manager.classes
+        for r in tqdm.trange(first_row, nbr_of_rows, disable=disable_tqdm):
+            if classes is None:
+                label = 0 if random.random() <= (split / 100) else 1  # unused if unecessary.
+            else:
+                label = classes.sample_one()
             nbr_pattern = random.randint(1, max_pat_by_line+1)
+            if self.truth is not None:
+                self.truth.patterns_by_row[min(nbr_pattern, patterns_manager.get_pool(label).count)] += 1
+            start = clock()
             patterns = patterns_manager.get_patterns(nbr_pattern, label)  # only the values
+            time_patterns += clock() - start
 
-            indice_noise = random.sample(range(1, nbr_of_feature+1), round(noise*nbr_of_feature))
+            indice_noise = noise_sampler.sample_row()
+            nbr_of_flip += len(indice_noise)
 
+            start = clock()
             line = self.merge_noise_pat(indice_noise, patterns)
-            self.nbr_of_one += len(line)
+            time_merge += clock() - start
 
-            self.lines.append(line)
-            self.labels.append(label)
-        return self.save_data(output_dir, suffix, disable_tqdm)
+            self.rows.append(line, label)
+            if writer and len(self.rows) >= chunk_size:
+                self._flush(writer)
+            if checkpointer and checkpointer.due(r + 1) and r + 1 < nbr_of_rows:
+                self._checkpoint(checkpointer, r + 1, writer, patterns_manager, nbr_of_flip)
+        self.stats.add_time("get_patterns", time_patterns)
+        self.stats.add_time("merge_noise_pat", time_merge)
+        self.stats.count("noise_flips", nbr_of_flip)
 
-    def save_data(self, output_dir: str, suffix: str, disable_tqdm: bool) -> str:
+    def _compile_lines_numpy(self, nbr_of_rows, nbr_of_feature, patterns_manager, max_pat_by_line, noise_sampler,
+                             split, disable_tqdm, writer, chunk_size, checkpointer=None, resume_state=None,
+                             batch_engine=None):
+        """
+        Compile lines by batch of rows with the numpy engine
+        :param batch_engine: engine with the interface of BatchLineEngine to use instead (CounterLineEngine)
+        """
+        rng = None
+        first_row = 0
+        if resume_state:
+            first_row = resume_state["row"]
+            if resume_state["numpy_state"] is not None:
+                rng = np.random.default_rng()
+                rng.bit_generator.state = resume_state["numpy_state"]
+        if batch_engine is None:
+            batch_engine = BatchLineEngine(patterns_manager, nbr_of_feature, max_pat_by_line, noise_sampler, split,
+                                           rng, self.truth)
+        else:
+            batch_engine.row += first_row
+        batch_engine.nbr_of_flip = resume_state["noise_flips"] if resume_state else 0
+        pbar = tqdm.tqdm(total=nbr_of_rows, initial=first_row, disable=disable_tqdm)
+        for start in range(first_row, nbr_of_rows, BATCH_SIZE):
+            with self.stats.timer("generate_batch"):
+                indptr, indices, labels = batch_engine.generate(min(BATCH_SIZE, nbr_of_rows - start))
+            self.rows.extend_csr(indptr, indices, labels)
+            if writer and len(self.rows) >= chunk_size:
+                self._flush(writer)
+            pbar.update(len(labels))
+            done = start + len(labels)
+            if checkpointer and checkpointer.due(done) and done < nbr_of_rows:
+                self._checkpoint(checkpointer, done, writer, patterns_manager, batch_engine.nbr_of_flip,
+                                 batch_engine.rng)
+        pbar.close()
+        self.stats.count("noise_flips", batch_engine.nbr_of_flip)
+
+    def save_data(self, output_dir: str, suffix: str, disable_tqdm: bool, data_format: str = 'dat',
+                  compress: str = None, nbr_of_feature: int = 0) -> str:
         """
         Save lines inside a file
         :param output_dir: path to output directory
         :param suffix: suffix to add to output files
+        :param data_format: 'dat' for text lines, 'csr' for binary CSR arrays, 'varint' for delta + varint rows
+        :param compress: 'gzip', 'bz2' or 'xz' to compress the output files, None to not compress
+        :param nbr_of_feature: number of features, needed by the packed format
         :return: name of output file
         """
-        data_file = os.path.join(output_dir, f"synthetic_data_{suffix}.dat")
-        log.info(f"Saving data to {data_file}")
-        data_descriptor = open(data_file, 'w')
-        for line in tqdm.tqdm(self.lines, disable=disable_tqdm):
-            data_descriptor.write(' '.join(list(map(str, line))) + '\n')
-
-        data_descriptor.close()
+        writer = self._open_writer(output_dir, suffix, data_format, compress, nbr_of_feature=nbr_of_feature)
+        log.info(f"Saving data to {writer.data_file}")
+        with self.stats.timer("save_data"):
+            for start in tqdm.trange(0, len(self.rows), SAVE_CHUNK_SIZE, disable=disable_tqdm):
+                self._write(writer, *self.rows.to_csr(start, start + SAVE_CHUNK_SIZE))
+            writer.close()
+        self.stats.count("bytes_written", writer.nbr_of_bytes)
         log.info("Saving done")
+        return self._output_files(writer.data_file, writer.label_file)
+
+    def _set_label_dtype(self, patterns_manager):
+        """
+        Hold the labels with the dtype of the classes of the pattern manager (wider than uint8 with many classes)
+        """
+        if self.rows.label_dtype != patterns_manager.label_dtype:
+            self.rows = RowStore(patterns_manager.label_dtype)
+
+    def _checkpoint(self, checkpointer, row, writer, patterns_manager, nbr_of_flip, rng=None):
+        """
+        Write the pending lines and save a checkpoint
+        :param row: number of rows generated so far
+        :param nbr_of_flip: number of noise flips so far
+        :param rng: numpy Generator of the numpy engine, None for the python engine
+        """
+        self._flush(writer)
+        with self.stats.timer("checkpoint"):
+            state = {"nbr_of_one": self.nbr_of_one,
+                     "noise_flips": nbr_of_flip,
+                     "writer": writer.checkpoint(),
+                     "numpy_state": rng.bit_generator.state if rng is not None else None,
+                     "row_patterns": self._row_patterns.checkpoint() if self._row_patterns is not None else None}
+            arrays = patterns_manager.get_state()
+            if self.truth is not None:
+                arrays.update(self.truth.get_state())
+            checkpointer.save(row, state, arrays)
+
+    def _flush(self, writer):
+        """
+        Write the pending lines and forget them
+        :param writer: writer of the output files
+        """
+        with self.stats.timer("save_data"):
+            self._write(writer, *self.rows.to_csr())
+        self._nbr_of_one_written += self.rows.nbr_of_one
+        self.rows.clear()
+
+    def _write(self, writer, indptr, indices, labels):
+        """
+        Write a chunk of lines given as CSR arrays (see RowStore.to_csr), counting their ground truth if asked
+        """
+        if self.truth is not None:
+            with self.stats.timer("ground_truth"):
+                self.truth.add_lines(indices, labels)
+        if self._row_patterns is not None:
+            with self.stats.timer("row_patterns"):
+                row_ptr, pattern_ids = self._pattern_index.annotate(indptr, indices)
+                self._row_patterns.write_csr(row_ptr, pattern_ids + 1, [])
+        writer.write_csr(indptr, indices, labels)
+
+    def save_truth(self, output_dir: str, suffix: str, patterns_manager) -> str:
+        """
+        Save the ground truth counted by compile_lines (ground_truth=True) next to the data
+        :param patterns_manager: pattern manager holding the patterns the lines were made from
+        :return: name of the sidecar file
+        """
+        truth_file = os.path.join(output_dir, f"synthetic_data_{suffix}{TRUTH_EXTENSION}")
+        return self.truth.save(truth_file, patterns_manager.patterns.labels)
+
+    def _open_row_patterns(self, output_dir: str, suffix: str, patterns_manager, nbr_of_feature: int,
+                           resume: dict = None):
+        """
+        Index the patterns and open the row->pattern sidecar, written by _write along with the lines
+        :param resume: state of the sidecar writer saved inside a checkpoint
+        """
+        self._pattern_index = PatternIndex.from_table(patterns_manager.patterns, nbr_of_feature)
+        self.row_patterns_file = self._row_patterns_name(output_dir, suffix)
+        self._row_patterns = BackgroundWriter(CsrWriter(self.row_patterns_file, resume=resume))
+
+    @staticmethod
+    def _row_patterns_name(output_dir: str, suffix: str) -> str:
+        return os.path.join(output_dir, f"synthetic_data_{suffix}{ROW_PATTERNS_EXTENSION}")
+
+    def _open_writer(self, output_dir: str, suffix: str, data_format: str = 'dat', compress: str = None,
+                     resume: dict = None, nbr_of_feature: int = 0) -> BackgroundWriter:
+        """
+        Open the output files
+        :param output_dir: path to output directory
+        :param suffix: suffix to add to output files
+        :param data_format: key of the writer inside WRITERS
+        :param compress: key of COMPRESSIONS, None to not compress
+        :param resume: state of the writer saved inside a checkpoint, to continue writing the files
+        :param nbr_of_feature: number of features, needed by the packed format
+        :return: writer of the output files, writing on a background thread
+        """
+        return BackgroundWriter(WRITERS[data_format](*self._data_files(output_dir, suffix, data_format, compress),
+                                                     compress=compress, resume=resume, nbr_of_feature=nbr_of_feature,
+                                                     label_dtype=self.rows.label_dtype))
+
+    def _data_files(self, output_dir: str, suffix: str, data_format: str = 'dat', compress: str = None) -> tuple:
+        """
+        Name of the output files
+        :return: (data file, label file or None if labels are not saved)
+        """
+        return compressed_name(os.path.join(output_dir, f"synthetic_data_{suffix}{WRITERS[data_format].extension}"),
+                               compress), None
+
+    def _output_files(self, data_file, label_file):
         return data_file
 
     @staticmethod
@@ -94,17 +579,11 @@ class LineManagerWithCat(LineManager):
     """
     Son of LineManager, created to manage categories for supervised learning
     """
-    def save_data(self, output_dir: str, suffix: str, disable_tqdm: bool) -> tuple:
-        data_file = os.path.join(output_dir, f"synthetic_data_{suffix}.dat")
-        data_label_file = os.path.join(output_dir, f"synthetic_data_{suffix}.label")
-
-        log.info(f"Saving data to {data_file} and {data_label_file}")
-        data_descriptor = open(data_file, 'w')
-        data_label_descriptor = open(data_label_file, 'w')
-        for i in tqdm.trange(len(self.lines), disable=disable_tqdm):
-            data_descriptor.write(' '.join(list(map(str, self.lines[i]))) + '\n')
-            data_label_descriptor.write(str(self.labels[i]) + '\n')
-
-        data_descriptor.close()
-        log.info("Saving done")
-        return data_file, data_label_file
+    def _data_files(self, output_dir: str, suffix: str, data_format: str = 'dat', compress: str = None) -> tuple:
+        writer_class = WRITERS[data_format]
+        return (compressed_name(os.path.join(output_dir, f"synthetic_data_{suffix}{writer_class.extension}"), compress),
+                compressed_name(os.path.join(output_dir, f"synthetic_data_{suffix}{writer_class.label_extension}"),
+                                compress))
+
+    def _output_files(self, data_file, label_file):
+        return data_file, label_file
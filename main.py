@@ -4,10 +4,10 @@ import datetime
 import os
 import logging
 import gc
+import random
 
 from binaps_data.utils.logs import set_logger
-from binaps_data.pattern import PatternManager, PatternManagerWithCat
-from binaps_data.line import LineManager, LineManagerWithCat
+from binaps_data.utils.stats import Stats, PROFILES, start_profile, stop_profile
 
 log = logging.getLogger('main')
 
@@ -42,6 +42,13 @@ def argument_parser(cp_args=None) -> argparse.Namespace:
     parser.add_argument('--split', type=int, default="50",
                         help="Split between both categories, in percent. "
                              "The value given will be for the first category. The other will be 100-split")
+    parser.add_argument('--nbr_of_class', type=int, default="2",
+                        help="Number of classes of the rows. With more than 2 (or with --class_proportions), rows "
+                             "and patterns are labeled 0 to nbr_of_class-1 following --class_proportions instead of "
+                             "--split, labels of binary files are then uint16 past 256 classes")
+    parser.add_argument('--class_proportions', type=str, default=None,
+                        help="Weight of each class, comma-separated or a file with one weight by line. Defaults to "
+                             "classes of the same size")
     parser.add_argument('--disable_tqdm', action="store_true", default=False,
                         help="Disable tqdm")
 
@@ -50,10 +57,62 @@ def argument_parser(cp_args=None) -> argparse.Namespace:
                         help="Number of row wanted")
     parser.add_argument('--noise', type=float, default="0.001",
                         help="Noise applied to the data (additive and destructive")
+    parser.add_argument('--noise_model', type=str, default="exact", choices=["exact", "bernoulli", "feature"],
+                        help="'exact' flips round(noise*nbr_of_feature) features on each line, 'bernoulli' flips each "
+                             "feature with probability noise, 'feature' flips each feature with its own rate "
+                             "(see --noise_rates)")
+    parser.add_argument('--noise_rates', type=str, default=None,
+                        help="File with the noise rate of each feature, one by line, for the 'feature' noise model")
     parser.add_argument('--max_using_pattern', type=int, default="0",
                         help="If greater than 0, maximum number of time a pattern will be used to generate data")
     parser.add_argument('--max_pattern_on_a_line', type=int, default="10",
                         help="If positive, maximum number of pattern used to generate one line")
+    parser.add_argument('--engine', type=str, default="python", choices=["python", "numpy", "counter"],
+                        help="Engine used to generate lines, 'numpy' generate them by batch of rows, 'counter' "
+                             "draws each row from a generator keyed by the seed and the row index, so any row can be "
+                             "generated again on its own and the output doesn't depend on --workers (needs "
+                             "--max_using_pattern 0)")
+    parser.add_argument('--chunk_size', type=int, default="0",
+                        help="If positive, lines are written to disk by chunk of this number of rows while they are "
+                             "generated, so memory stays bounded whatever the number of rows")
+    parser.add_argument('--format', dest='data_format', type=str, default="dat",
+                        choices=["dat", "csr", "varint", "packed"],
+                        help="Format of the data: 'dat' for text lines of column indices, 'csr' for binary "
+                             "indptr/indices/labels arrays with a JSON header (np.memmap ready), 'varint' for "
+                             "delta + varint encoded binary rows, 'packed' for a dense matrix of one bit by cell "
+                             "with a JSON header (np.memmap ready)")
+    parser.add_argument('--compress', type=str, default=None, choices=["gzip", "bz2", "xz"],
+                        help="Compress data and pattern files by blocks in a thread pool (multi-member streams, "
+                             "readable by the usual tools). Not available with the csr and packed formats")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="Master seed of the run. If not given a random one is drawn and saved in the config")
+    parser.add_argument('--workers', type=int, default="1",
+                        help="Number of processes generating lines, each one generate its own range of rows")
+    parser.add_argument('--keep_shards', action='store_true', default=False,
+                        help="With several workers, keep one file by worker and write a manifest instead of merging")
+    parser.add_argument('--checkpoint_every', type=int, default="0",
+                        help="If positive, save a checkpoint every this number of rows (RNG states, rows written, "
+                             "file offsets and pattern use), lines are then streamed to disk")
+    parser.add_argument('--resume', type=str, default=None,
+                        help="config_*.json of an interrupted run saved with --checkpoint_every, to continue it. "
+                             "Other arguments are taken from this config")
+    parser.add_argument('--profile', type=str, default=None, choices=PROFILES,
+                        help="Profile the run with cProfile ('cpu') or tracemalloc ('mem') and save the report next "
+                             "to the outputs")
+    parser.add_argument('--ground_truth', action='store_true', default=False,
+                        help="Count the ground truth while generating (rows holding each feature, rows of each "
+                             "label, rows each pattern was inserted into by label, number of patterns by row) and "
+                             "save it as a .truth.npz sidecar next to the data")
+    parser.add_argument('--row_patterns', action='store_true', default=False,
+                        help="Find the patterns fully present inside each generated row (inserted and not broken by "
+                             "the noise, or made by accident) with an inverted feature->pattern index and save them "
+                             "as a .patterns.csr.json sidecar of 1-based pattern ids (see csr.load_csr)")
+    parser.add_argument('--pattern_cache', type=str, default=None,
+                        help="Directory caching the pattern tables by parameters and seed, a run with the same "
+                             "pattern parameters and seed loads them instead of drawing them again")
+    parser.add_argument('--pattern_cache_size', type=int, default="64",
+                        help="Maximum number of pattern tables kept inside --pattern_cache, the least recently used "
+                             "are removed (0 for no limit)")
     parser.add_argument('--fill_with_noise', action='store_true', default=False,
                         help="If there is a maximum of use by pattern, this feature allow to fill line only with noise")
 
@@ -66,60 +125,165 @@ def argument_parser(cp_args=None) -> argparse.Namespace:
     # TODO : To add this feature, we adivce to use the no_intersect mode and then add pattern from other
 
     args = parser.parse_args(cp_args)
+    if args.compress and args.data_format in ("csr", "packed"):
+        parser.error(f"--compress is not available with the {args.data_format} format, its arrays are memory-mapped")
+    if args.categories_off and (args.nbr_of_class != 2 or args.class_proportions):
+        parser.error("--nbr_of_class and --class_proportions need the categories, remove --categories_off")
+    if args.engine == "counter" and args.max_using_pattern:
+        parser.error("--engine counter needs --max_using_pattern 0, the use of a pattern depends on the rows before")
+    if args.checkpoint_every and args.workers > 1:
+        parser.error("--checkpoint_every is not available with several workers")
+    if args.max_using_pattern and args.workers > 1:
+        from binaps_data.line import shard_bounds, split_use_limit
+        try:
+            bounds = shard_bounds(args.nbr_of_rows, args.workers)
+            split_use_limit(args.max_using_pattern, [stop - start for start, stop in zip(bounds[:-1], bounds[1:])])
+        except ValueError:
+            parser.error(f"--max_using_pattern {args.max_using_pattern} can't be split between {args.workers} "
+                         f"workers, use at least {2 * args.workers - 1} or fewer workers")
+    if args.resume:
+        with open(args.resume) as fd:
+            if json.load(fd).get("checkpoint_file") is None:  # removed once the run is complete
+                parser.error(f"run of {args.resume} already complete, nothing to resume")
     log.info("Argument parsed")
     log.debug(f"Arguments: {args}")
 
     return args
 
 
-def main(cp_args=None):
+def main(cp_args=None) -> dict:
+    """
+    Generate one dataset
+    :param cp_args: list of arguments, the command line ones if None
+    :return: config of the run, as saved inside config_*.json
+    """
     # ND indice for column start with 1
     log.debug("main")
     today = datetime.datetime.now().strftime("%Y-%m-%dT%Hh%Mm%Ss")
     args = argument_parser(cp_args)
+    # imported once the arguments are parsed, so --help and argument errors don't pay for numpy and tqdm
+    from binaps_data.checkpoint import load_checkpoint
+    from binaps_data.cache import get_cache
+    from binaps_data.engine import class_proportions
+    from binaps_data.pattern import PatternManager, PatternManagerWithCat
+    from binaps_data.line import LineManager, LineManagerWithCat
+    resume = None
+    if args.resume:
+        # continue the run with its own arguments, date and checkpoint
+        with open(args.resume) as fd:
+            saved_config = json.load(fd)
+        vars(args).update({k: v for k, v in saved_config.items() if k in vars(args) and k != "resume"})
+        today = os.path.basename(args.resume)[len("config_"):-len(".json")]
+        if os.path.exists(saved_config["checkpoint_file"]):
+            resume = load_checkpoint(saved_config["checkpoint_file"])
+        else:
+            log.warning("No checkpoint saved yet, the run starts again")
+    if args.seed is None:
+        args.seed = random.randrange(2 ** 32)
+    log.info(f"Seed {args.seed}")
+    random.seed(args.seed)
+    stats = Stats()
+    profiler = start_profile(args.profile)
+    try:  # the profiler is stopped even if the run fails, so it doesn't stay active in a batch or service process
+        # Two mode actuel to create data, with ou withour two categories for supervised learning
+        if args.categories_off:
+            pattern_manager = PatternManager(max_using_pattern=args.max_using_pattern)
+            line_manager = LineManager()
+            max_pat_line = args.max_pattern_on_a_line if args.max_pattern_on_a_line < args.nbr_pattern else args.nbr_pattern
+        else:
+            pattern_manager = PatternManagerWithCat(max_using_pattern=args.max_using_pattern,
+                                                    class_proportions=class_proportions(args.nbr_of_class,
+                                                                                        args.class_proportions))
+            line_manager = LineManagerWithCat()
+            max_pat_line = args.max_pattern_on_a_line if args.max_pattern_on_a_line < (args.nbr_pattern/2) else args.nbr_pattern/2
+
+        if args.no_intersections:
+            no_inter = "NO_INTER"
+        else:
+            no_inter = "INTER"
+
+        #  Create all patterns
+        if resume:
+            # patterns and their use are restored from the checkpoint by compile_lines
+            pattern_files = saved_config["pattern_file"]
+            pattern_manager.nbr_attempt = saved_config["pattern_attempt"]
+            pattern_manager.nbr_rejection = saved_config["pattern_rejection"]
+        else:
+            cache = get_cache(args.pattern_cache, args.pattern_cache_size) if args.pattern_cache else None
+            with stats.timer("compile_pattern"):
+                pattern_files = pattern_manager.compile_pattern(nbr_of_feature=args.nbr_of_feature,
+                                                                nbr_pattern=args.nbr_pattern,
+                                                                min_size=args.min_size,
+                                                                max_size=args.max_size,
+                                                                split=args.split,
+                                                                output_dir=args.output_dir,
+                                                                no_intersections=args.no_intersections,
+                                                                today=today,
+                                                                disable_tqdm=args.disable_tqdm,
+                                                                compress=args.compress,
+                                                                cache=cache,
+                                                                seed=args.seed)
+
+        config = args.__dict__.copy()
+        config["pattern_file"] = pattern_files
+        config["pattern_attempt"] = pattern_manager.nbr_attempt
+        config["pattern_rejection"] = pattern_manager.nbr_rejection
+        checkpoint_file = None
+        if args.checkpoint_every:
+            checkpoint_file = os.path.join(args.output_dir, f"checkpoint_{today}.npz")
+            config["checkpoint_file"] = checkpoint_file
+            with open(os.path.join(args.output_dir, f'config_{today}.json'), 'w') as fd:
+                json.dump(config, fd)  # saved now so the run can be resumed
+
+        #  Compile lines based on patterns. The .dat format is used to speed up process (kind of meta way for binary DB,
+        #  we only specified indice of 1. Many place is won because of sparsity)
+        line_args = dict(nbr_of_rows=args.nbr_of_rows,
+                         nbr_of_feature=args.nbr_of_feature,
+                         patterns_manager=pattern_manager,
+                         max_pat_by_line=max_pat_line,
+                         noise=args.noise,
+                         split=args.split,
+                         suffix=f"{args.nbr_of_rows}_{args.nbr_of_feature}_{args.nbr_pattern}_{args.noise}_{no_inter}_{today}",
+                         output_dir=args.output_dir,
+                         disable_tqdm=args.disable_tqdm,
+                         engine=args.engine,
+                         chunk_size=args.chunk_size,
+                         data_format=args.data_format,
+                         noise_model=args.noise_model,
+                         noise_rates=args.noise_rates,
+                         compress=args.compress,
+                         ground_truth=args.ground_truth,
+                         row_patterns=args.row_patterns)
+        if args.checkpoint_every:
+            line_args.update(checkpoint_every=args.checkpoint_every, checkpoint_file=checkpoint_file, resume=resume)
+        with stats.timer("compile_lines"):
+            if args.workers > 1:
+                data_files = line_manager.compile_lines_sharded(workers=args.workers,
+                                                                seed=args.seed,
+                                                                keep_shards=args.keep_shards,
+                                                                **line_args)
+            else:
+                data_files = line_manager.compile_lines(seed=args.seed, **line_args)
+        stats.update(line_manager.stats.to_dict())
+        if args.ground_truth:
+            config["truth_file"] = line_manager.save_truth(args.output_dir, line_args["suffix"], pattern_manager)
+        if args.row_patterns:
+            config["row_patterns_file"] = line_manager.row_patterns_file
+    finally:
+        profile_files = stop_profile(args.profile, profiler,
+                                     os.path.join(args.output_dir, f"profile_{args.profile}_{today}"))
 
-    # Two mode actuel to create data, with ou withour two categories for supervised learning
-    if args.categories_off:
-        pattern_manager = PatternManager(max_using_pattern=args.max_using_pattern)
-        line_manager = LineManager()
-        max_pat_line = args.max_pattern_on_a_line if args.max_pattern_on_a_line < args.nbr_pattern else args.nbr_pattern
-    else:
-        pattern_manager = PatternManagerWithCat(max_using_pattern=args.max_using_pattern)
-        line_manager = LineManagerWithCat()
-        max_pat_line = args.max_pattern_on_a_line if args.max_pattern_on_a_line < (args.nbr_pattern/2) else args.nbr_pattern/2
-
-    if args.no_intersections:
-        no_inter = "NO_INTER"
-    else:
-        no_inter = "INTER"
-
-    #  Create all patterns
-    pattern_files = pattern_manager.compile_pattern(nbr_of_feature=args.nbr_of_feature,
-                                                    nbr_pattern=args.nbr_pattern,
-                                                    min_size=args.min_size,
-                                                    max_size=args.max_size,
-                                                    split=args.split,
-                                                    output_dir=args.output_dir,
-                                                    no_intersections=args.no_intersections,
-                                                    today=today,
-                                                    disable_tqdm=args.disable_tqdm)
-
-    #  Compile lines based on patterns. The .dat format is used to speed up process (kind of meta way for binary DB,
-    #  we only specified indice of 1. Many place is won because of sparsity)
-    data_files = line_manager.compile_lines(nbr_of_rows=args.nbr_of_rows,
-                                            nbr_of_feature=args.nbr_of_feature,
-                                            patterns_manager=pattern_manager,
-                                            max_pat_by_line=max_pat_line,
-                                            noise=args.noise,
-                                            split=args.split,
-                                            suffix=f"{args.nbr_of_rows}_{args.nbr_of_feature}_{args.nbr_pattern}_{args.noise}_{no_inter}_{today}",
-                                            output_dir=args.output_dir,
-                                            disable_tqdm=args.disable_tqdm)
-
-    config = args.__dict__.copy()
-    config["pattern_file"] = pattern_files
+    if checkpoint_file:
+        if os.path.exists(checkpoint_file):  # not written if the run ended before its first checkpoint
+            os.remove(checkpoint_file)
+        config["checkpoint_file"] = None  # the run is complete
     config["data_file"] = data_files
     config["density"] = line_manager.nbr_of_one / (args.nbr_of_feature * args.nbr_of_rows)
+    config["timings"] = stats.timings
+    config["counters"] = stats.counters
+    if profile_files:
+        config["profile_file"] = profile_files
+    log.info(f"Timings: {stats.timings}")
     with open(os.path.join(args.output_dir, f'config_{today}.json'), 'w') as fd:
         json.dump(config, fd)
 
@@ -127,6 +291,7 @@ def main(cp_args=None):
     del pattern_manager
     del line_manager
     gc.collect()
+    return config
 
 if __name__ == "__main__":
     log = set_logger()
@@ -0,0 +1,167 @@
+import math
+import random
+import logging
+
+import numpy as np
+
+from binaps_data.engine import sample_without_replacement
+
+log = logging.getLogger('main')
+
+
+class ExactCountNoise:
+    """
+    Flip exactly round(noise*nbr_of_feature) distinct features on each row (historical model)
+
+        nbr_of_feature : number of features
+        nbr_noise      : number of features flipped on each row
+    """
+
+    def __init__(self, nbr_of_feature: int, noise: float):
+        self.nbr_of_feature = nbr_of_feature
+        self.nbr_noise = round(noise * nbr_of_feature)
+
+    def sample_row(self) -> list:
+        """
+        Draw the noise of one row with the random module
+        :return: list of 1-based features to flip
+        """
+        return random.sample(range(1, self.nbr_of_feature + 1), self.nbr_noise)
+
+    def sample_batch(self, rng, nbr_of_rows: int) -> tuple:
+        """
+        Draw the noise of a batch of rows
+        :param rng: numpy Generator
+        :param nbr_of_rows: number of rows inside the batch
+        :return: (rows, values) flat arrays, values are 1-based features to flip
+        """
+        rows, values = sample_without_replacement(rng, self.nbr_of_feature, np.full(nbr_of_rows, self.nbr_noise))
+        return rows, values + 1
+
+    def sample_rows(self, counter, rows, stream: int) -> tuple:
+        """
+        Draw the noise of rows with a counter-based hash, so the noise of a row doesn't depend on the others
+        :param counter: CounterHash
+        :param rows: array of row indexes
+        :param stream: first stream of draws the model can use
+        :return: (rows, values) flat arrays, rows are positions inside the rows given, values are 1-based features
+        """
+        rows, values = counter.sample(rows, self.nbr_of_feature, self.nbr_noise, stream)
+        return rows, values + 1
+
+
+class BernoulliNoise:
+    """
+    Flip each feature of each row independently with probability noise. Flipped features are reached by skipping
+    the gaps between them (geometric law), so the cost grows with the number of flips, not of features
+
+        nbr_of_feature : number of features
+        rate           : probability for a feature to be flipped
+    """
+
+    def __init__(self, nbr_of_feature: int, noise: float):
+        if not 0 <= noise <= 1:
+            raise ValueError(f"Arguments can't be followed: noise rate {noise} is not a probability")
+        self.nbr_of_feature = nbr_of_feature
+        self.rate = noise
+
+    def sample_row(self) -> list:
+        if self.rate == 0:
+            return []
+        if self.rate == 1:
+            return list(range(1, self.nbr_of_feature + 1))
+        log_q = math.log1p(-self.rate)
+        ret = []
+        position = -1
+        while True:
+            position += 1 + int(math.log(1. - random.random()) / log_q)  # gap to the next flip
+            if position >= self.nbr_of_feature:
+                return ret
+            ret.append(position + 1)
+
+    def sample_batch(self, rng, nbr_of_rows: int) -> tuple:
+        # rows are laid end to end, flips are the positions reached by geometric gaps inside this long stream
+        total = nbr_of_rows * self.nbr_of_feature
+        if self.rate == 0 or total == 0:
+            positions = np.empty(0, dtype=np.int64)
+        elif self.rate == 1:
+            positions = np.arange(total, dtype=np.int64)
+        else:
+            parts = []
+            last = -1
+            while last < total:
+                expected = (total - last) * self.rate
+                gaps = rng.geometric(self.rate, int(expected + 4 * math.sqrt(expected) + 16))
+                part = last + np.cumsum(gaps)
+                last = int(part[-1])
+                parts.append(part)
+            positions = np.concatenate(parts)
+            positions = positions[:np.searchsorted(positions, total)]
+        rows = positions // self.nbr_of_feature
+        return rows, positions - rows * self.nbr_of_feature + 1
+
+    def sample_rows(self, counter, rows, stream: int) -> tuple:
+        rows, positions = counter.flips(rows, self.rate, self.nbr_of_feature, stream)
+        return rows, positions + 1
+
+
+class FeatureRateNoise:
+    """
+    Flip the j-th feature of each row independently with its own probability rates[j]
+
+        nbr_of_feature : number of features
+        rates          : float array, flip probability of each feature
+    """
+
+    def __init__(self, nbr_of_feature: int, rates):
+        rates = np.asarray(rates, dtype=np.float64)
+        if rates.shape != (nbr_of_feature,):
+            raise ValueError(f"Arguments can't be followed: {len(rates)} noise rates given for {nbr_of_feature} "
+                             f"features")
+        if np.any((rates < 0) | (rates > 1)):
+            raise ValueError("Arguments can't be followed: noise rates must be probabilities")
+        self.nbr_of_feature = nbr_of_feature
+        self.rates = rates
+        # one row is drawn with the highest rate then thinned, so only O(max rate * nbr_of_feature) work by row
+        self._upper = BernoulliNoise(nbr_of_feature, float(rates.max()) if len(rates) else 0.)
+        self._accept = (rates / self._upper.rate).tolist() if self._upper.rate else []
+
+    def sample_row(self) -> list:
+        return [i for i in self._upper.sample_row() if random.random() < self._accept[i - 1]]
+
+    def sample_batch(self, rng, nbr_of_rows: int) -> tuple:
+        # flips at the highest rate, each one kept with the probability rates[j] / highest rate
+        rows, values = self._upper.sample_batch(rng, nbr_of_rows)
+        kept = rng.random(len(values)) * self._upper.rate < self.rates[values - 1]
+        return rows[kept], values[kept]
+
+    def sample_rows(self, counter, rows, stream: int) -> tuple:
+        # flips at the highest rate thinned by a second stream of draws, indexed by feature
+        rows = np.asarray(rows, dtype=np.uint64)
+        flip_rows, positions = counter.flips(rows, self._upper.rate, self.nbr_of_feature, stream)
+        kept = counter.random(rows[flip_rows], stream + 1, positions) * self._upper.rate < self.rates[positions]
+        return flip_rows[kept], positions[kept] + 1
+
+
+NOISE_MODELS = {
+    "exact": ExactCountNoise,
+    "bernoulli": BernoulliNoise,
+    "feature": FeatureRateNoise
+}
+
+
+def make_noise_model(noise_model: str, nbr_of_feature: int, noise: float, noise_rates=None):
+    """
+    Create a noise model
+    :param noise_model: key of the model inside NOISE_MODELS
+    :param noise: noise rate of the 'exact' and 'bernoulli' models
+    :param noise_rates: per feature rates of the 'feature' model (array or file with one rate by line)
+    :return: noise model
+    """
+    if noise_model == "feature":
+        if noise_rates is None:
+            raise ValueError("Arguments can't be followed: the 'feature' noise model needs noise rates")
+        if isinstance(noise_rates, str):
+            noise_rates = np.loadtxt(noise_rates, dtype=np.float64, ndmin=1)
+        return FeatureRateNoise(nbr_of_feature, noise_rates)
+    return NOISE_MODELS[noise_model](nbr_of_feature, noise)
@@ -1,17 +1,34 @@
 import enum
+import math
 import random
+import itertools
 import tqdm
 import os
 import logging
 
+import numpy as np
+
+from binaps_data.engine import new_rng, sample_without_replacement, ClassSampler
+from binaps_data.compress import open_output, compressed_name
+from binaps_data.checkpoint import random_state_to_json, random_state_from_json
+
 log = logging.getLogger('main')
 
+WRITE_CHUNK_SIZE = 100000  # number of patterns formatted at once when saving
+
 
 class Category(enum.IntEnum):
     CAT0 = 0
     CAT1 = 1
 
 
+def to_category(label: int):
+    """
+    Category of a label, the plain int for the classes beyond the two categories (multi-class mode)
+    """
+    return Category(label) if label < len(Category) else int(label)
+
+
 class Pattern(object):
     """
     Pattern object, compose of
@@ -23,13 +40,13 @@ class Pattern(object):
     label = None
     used = 0
 
-    def __init__(self, values: list = [], label=None):
+    def __init__(self, values: list = None, label=None):
         """
         Args:
             values (list): list of INT representing the pattern
             label: if existing, the label associated to this pattern
         """
-        self.values = values
+        self.values = values if values is not None else []
         self.label = label
 
     def __hash__(self):
@@ -38,7 +55,7 @@ class Pattern(object):
 
     def __eq__(self, other):
         #  define equal for comparison purpose
-        if not isinstance(other, type(self)):
+        if not isinstance(other, (Pattern, PatternView)):
             return NotImplemented
         return self.values == other.values and self.label == other.label
 
@@ -52,10 +69,10 @@ class Pattern(object):
         return ' '.join(list(map(str, self.values)))
 
     def to_write_label(self):
-        return str(self.label.value)
+        return str(int(self.label))
 
     def set_label(self, label_int: int):
-        self.label = Category(label_int)
+        self.label = to_category(label_int)
 
     def update_use(self, limit=0):
         """
@@ -69,41 +86,191 @@ class Pattern(object):
             return False
 
 
+NO_LABEL = 255  # label of a pattern inside a PatternTable when there is no category
+
+
+class PatternTable:
+    """
+    All the patterns kept as a struct of arrays instead of one Pattern object each
+        - values  : concatenated values of all the patterns, values of the i-th pattern are values[offsets[i]:offsets[i+1]]
+        - offsets : offset of each pattern inside values
+        - labels  : label of each pattern as uint8 (or a wider unsigned dtype with many classes), NO_LABEL without
+                    category
+        - used    : number of time each pattern has been used to generate lines
+    Indexing the table gives a PatternView, compatible with the Pattern API
+    """
+    __slots__ = ('values', 'offsets', 'labels', 'used')
+
+    def __init__(self, values, offsets, labels=None, used=None):
+        self.values = np.asarray(values, dtype=np.uint32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        nbr_pattern = len(self.offsets) - 1
+        if labels is None:
+            self.labels = np.full(nbr_pattern, NO_LABEL, dtype=np.uint8)
+        else:
+            labels = np.asarray(labels)
+            self.labels = labels if labels.dtype.kind == 'u' else labels.astype(np.uint8)
+        self.used = np.zeros(nbr_pattern, dtype=np.int64) if used is None else np.asarray(used, dtype=np.int64)
+
+    @classmethod
+    def from_patterns(cls, patterns: list):
+        """
+        Build a table from a list of Pattern
+        """
+        offsets = np.zeros(len(patterns) + 1, dtype=np.int64)
+        np.cumsum([len(p.values) for p in patterns], out=offsets[1:])
+        values = np.fromiter((v for p in patterns for v in p.values), dtype=np.uint32, count=offsets[-1])
+        labels = [NO_LABEL if p.label is None else int(p.label) for p in patterns]
+        return cls(values, offsets, labels, [p.used for p in patterns])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"Pattern {i} out of range for {len(self)} patterns")
+        return PatternView(self, i)
+
+    def __iter__(self):
+        return (PatternView(self, i) for i in range(len(self)))
+
+    def get_values(self, i: int) -> np.ndarray:
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def select(self, ids):
+        """
+        Get a new table holding only some patterns
+        :param ids: ids of the patterns to keep, in the wanted order
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        sizes = self.offsets[ids + 1] - self.offsets[ids]
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        starts = np.repeat(self.offsets[ids] - offsets[:-1], sizes)
+        return PatternTable(self.values[starts + np.arange(offsets[-1])], offsets, self.labels[ids], self.used[ids])
+
+    def to_write_values(self) -> list:
+        """
+        Values of each pattern as they are written in the pattern file
+        """
+        flat = list(map(str, self.values.tolist()))
+        bounds = self.offsets.tolist()
+        return [' '.join(flat[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def to_write_labels(self) -> list:
+        """
+        Label of each pattern as they are written in the label file
+        """
+        return list(map(str, self.labels.tolist()))
+
+
+class PatternView:
+    """
+    Thin view on one pattern of a PatternTable, compatible with the Pattern API
+    """
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table: PatternTable, index: int):
+        self.table = table
+        self.index = index
+
+    @property
+    def values(self) -> list:
+        return self.table.get_values(self.index).tolist()
+
+    @property
+    def label(self):
+        label = int(self.table.labels[self.index])
+        return None if label == NO_LABEL else to_category(label)
+
+    @property
+    def used(self) -> int:
+        return int(self.table.used[self.index])
+
+    @used.setter
+    def used(self, value: int):
+        self.table.used[self.index] = value
+
+    def __hash__(self):
+        return hash((tuple(self.values), self.label))
+
+    def __eq__(self, other):
+        if not isinstance(other, (Pattern, PatternView)):
+            return NotImplemented
+        return self.values == other.values and self.label == other.label
+
+    def __repr__(self):
+        return f"PATTERN.cat-{self.label}.{self.values}"
+
+    def __str__(self):
+        return f"PATTERN.cat-{self.label}.{self.values}"
+
+    def to_write_values(self):
+        return ' '.join(map(str, self.values))
+
+    def to_write_label(self):
+        return str(int(self.label))
+
+    def set_label(self, label_int: int):
+        self.table.labels[self.index] = int(label_int)
+
+    def update_use(self, limit=0):
+        """
+        Update a counter about the use of this pattern. If a limit is specified and the used is over it return true to alert.
+        :limit: limit to delete this pattern
+        """
+        self.table.used[self.index] += 1
+        return bool(limit and self.table.used[self.index] > limit)
+
+
 class PatternWriter:
     """
     Write patterns to files
     """
 
     @staticmethod
-    def write_patterns_and_labels(pattern_list: list, pattern_file: str, label_file: str, disable_tqdm: bool):
+    def _to_table(pattern_list) -> PatternTable:
+        return pattern_list if isinstance(pattern_list, PatternTable) else PatternTable.from_patterns(pattern_list)
+
+    @staticmethod
+    def write_patterns_and_labels(pattern_list: list, pattern_file: str, label_file: str, disable_tqdm: bool,
+                                  compress: str = None):
         """
         Write patterns and it's label to two separate files
-        :param pattern_list: list containing patterns
+        :param pattern_list: PatternTable or list containing patterns
         :param pattern_file: output file for pattern values
         :param label_file: output file for label
+        :param compress: 'gzip', 'bz2' or 'xz' to compress the files (names must already have the extension)
         """
         log.info(f"Saving pattern to {pattern_file} and label to {label_file}")
-        pattern_descriptor = open(pattern_file, 'w')
-        label_descriptor = open(label_file, 'w')
-        for pat in tqdm.tqdm(pattern_list, disable=disable_tqdm):
-            pattern_descriptor.write(pat.to_write_values() + '\n')
-            label_descriptor.write(pat.to_write_label() + '\n')
+        table = PatternWriter._to_table(pattern_list)
+        pattern_descriptor = open_output(pattern_file, 'w', compress)
+        label_descriptor = open_output(label_file, 'w', compress)
+        for start in tqdm.trange(0, len(table), WRITE_CHUNK_SIZE, disable=disable_tqdm):
+            chunk = table.select(np.arange(start, min(start + WRITE_CHUNK_SIZE, len(table))))
+            pattern_descriptor.write(''.join(line + '\n' for line in chunk.to_write_values()))
+            label_descriptor.write(''.join(line + '\n' for line in chunk.to_write_labels()))
 
         pattern_descriptor.close()
         label_descriptor.close()
         log.info("Saving done")
 
     @staticmethod
-    def write_patterns_only(pattern_list: list, pattern_file: str, disable_tqdm: bool):
+    def write_patterns_only(pattern_list: list, pattern_file: str, disable_tqdm: bool, compress: str = None):
         """
         Write pattern to a file
-        :param pattern_list: list of pattern
+        :param pattern_list: PatternTable or list of pattern
         :param pattern_file: output file
+        :param compress: 'gzip', 'bz2' or 'xz' to compress the file (name must already have the extension)
         """
         log.info(f"Saving pattern only to {pattern_file}")
-        pattern_descriptor = open(pattern_file, 'w')
-        for pat in tqdm.tqdm(pattern_list, disable=disable_tqdm):
-            pattern_descriptor.write(pat.to_write_values() + '\n')
+        table = PatternWriter._to_table(pattern_list)
+        pattern_descriptor = open_output(pattern_file, 'w', compress)
+        for start in tqdm.trange(0, len(table), WRITE_CHUNK_SIZE, disable=disable_tqdm):
+            chunk = table.select(np.arange(start, min(start + WRITE_CHUNK_SIZE, len(table))))
+            pattern_descriptor.write(''.join(line + '\n' for line in chunk.to_write_values()))
 
         pattern_descriptor.close()
         log.info("Saving done")
@@ -132,10 +299,13 @@ class PatternValueDealer:
     Dealer of value for patterns
 
         nbr_feature : number of feature the synthetic DB will have
-        val         : possible value for the pattern to pick inside
+        val         : possible value for the pattern to pick inside. In no_intersections mode, the values still
+                      available are val[:remaining], the consumed ones are moved after
+        remaining   : number of values still available (no_intersections mode)
     """
     nbr_feature = 0
     val = None
+    remaining = 0
 
     def __init__(self, nbr_feature: int, no_intersections: bool = False):
         log.debug(f"Init pattern dealer with {nbr_feature} features and 'no_intersection' at {no_intersections}")
@@ -144,10 +314,13 @@ class PatternValueDealer:
         self.val = None
 
         if no_intersections:
-            self.val = [n for n in range(nbr_feature + 1)]
+            self.val = np.arange(1, nbr_feature + 1, dtype=np.int64)
+            self.remaining = nbr_feature
             self.get_val = self.no_intersect
+            self.get_val_batch = self.no_intersect_batch
         else:
             self.get_val = self.all
+            self.get_val_batch = self.all_batch
 
     def all(self, size):
         """
@@ -156,35 +329,300 @@ class PatternValueDealer:
         ret = sorted(random.sample(range(1, self.nbr_feature+1), size), reverse=False)
         return ret
 
+    def all_batch(self, sizes):
+        """
+        Get one list of values by size given, see all
+        """
+        return [self.all(size) for size in sizes]
+
     def no_intersect(self, size):
         """
         Get randomly with uniforme probability "size" number between 1 and "nbr_feature" with consumming the value
         """
-        indices = random.sample(range(1, len(self.val)), size)
-        ret = []
-        for i in sorted(indices, reverse=True):  # remove from the list with pop so we take indice in descending order
-            ret.append(self.val.pop(i))
+        return self.no_intersect_batch([size])[0]
 
-        ret = sorted(ret, reverse=False)
-        return ret
+    def no_intersect_batch(self, sizes):
+        """
+        Get one list of values by size given, all lists being disjoint. Each value picked is swapped with the last
+        available one (partial Fisher-Yates shuffle on the tail), so the cost only depends on the number of values
+        picked. The positions of the swaps are drawn at once with numpy
+        :param sizes: size of each list
+        :return: list of sorted list of int
+        """
+        total = sum(sizes)
+        if total > self.remaining:
+            raise ValueError(f"{total} values asked but only {self.remaining} are still available")
+
+        val = self.val
+        lasts = self.remaining - 1 - np.arange(total)
+        picks = new_rng().integers(0, lasts + 1).tolist()  # the i-th pick is in [0, remaining - i)
+        for i, last in zip(picks, lasts.tolist()):
+            val[i], val[last] = val[last], val[i]
+        self.remaining -= total
+
+        picked = val[self.remaining:self.remaining + total][::-1]  # in the order they were picked
+        bounds = np.cumsum([0, *sizes])
+        return [np.sort(picked[a:b]).tolist() for a, b in zip(bounds[:-1], bounds[1:])]
 
     def get_val(self):
         pass
 
 
+def fit_disjoint_sizes(sizes, nbr_of_feature: int, min_size: int, rng):
+    """
+    Make sure disjoint patterns of these sizes fit inside the features, by shrinking random patterns if needed
+    :param sizes: array of the size of each pattern
+    :param nbr_of_feature: number of feature to share between patterns
+    :param min_size: a pattern is never shrunk below this size
+    :param rng: numpy Generator
+    :return: array of sizes, their sum is at most nbr_of_feature
+    """
+    if len(sizes) * min_size > nbr_of_feature:
+        raise ValueError(f"Arguments can't be followed: {len(sizes)} disjoint patterns of at least {min_size} "
+                         f"values can't fit inside {nbr_of_feature} features")
+    excess = int(sizes.sum()) - nbr_of_feature
+    if excess > 0:
+        log.warning(f"Patterns drawn are {excess} values too large to be disjoint, random patterns are shrunk")
+        units = np.repeat(np.arange(len(sizes)), sizes - min_size)  # one unit for each value above min_size
+        sizes = sizes - np.bincount(rng.choice(units, excess, replace=False), minlength=len(sizes))
+    return sizes
+
+
+def fit_sizes_to_capacity(sizes, nbr_of_feature: int, min_size: int, max_size: int, rng):
+    """
+    Make sure there is enough distinct patterns for each size, by moving patterns from a full size to other sizes
+    :param sizes: array of the size of each pattern
+    :param nbr_of_feature: number of feature to pick values inside
+    :param min_size: minimum size of a pattern
+    :param max_size: maximum size of a pattern
+    :param rng: numpy Generator
+    :return: array of sizes
+    """
+    capacity = np.array([min(math.comb(nbr_of_feature, s), len(sizes)) for s in range(min_size, max_size + 1)])
+    if len(sizes) > capacity.sum():
+        total = sum(math.comb(nbr_of_feature, s) for s in range(min_size, max_size + 1))
+        raise ValueError(f"Arguments can't be followed: {len(sizes)} distinct patterns of size {min_size} to "
+                         f"{max_size} asked but only {total} exist with {nbr_of_feature} features")
+    sizes = sizes.copy()
+    while True:
+        counts = np.bincount(sizes - min_size, minlength=len(capacity))
+        over = counts > capacity
+        if not over.any():
+            return sizes
+        # patterns over the capacity of their size get a new size among the sizes with room left
+        moved = np.concatenate([np.flatnonzero(sizes == s + min_size)[capacity[s]:] for s in np.flatnonzero(over)])
+        room = np.flatnonzero(counts < capacity)
+        sizes[moved] = rng.choice(room, len(moved)) + min_size
+
+
+def draw_distinct_patterns(rng, nbr_of_feature: int, size: int, nbr_pattern: int) -> tuple:
+    """
+    Draw distinct patterns of the same size. Candidates are drawn by batch and duplicates are rejected by hashing
+    whole rows at once. When the patterns asked are close to all the possible ones, they are drawn among all of
+    them instead, so the number of attempts stays bounded
+    :param rng: numpy Generator
+    :param nbr_of_feature: values are picked inside [1, nbr_of_feature]
+    :param size: size of each pattern
+    :param nbr_pattern: number of pattern wanted, at most comb(nbr_of_feature, size)
+    :return: (array of shape (nbr_pattern, size) of sorted values, number of attempts, number of rejections)
+    """
+    capacity = math.comb(nbr_of_feature, size)
+    if nbr_pattern * 2 > capacity:
+        every = np.array(list(itertools.combinations(range(1, nbr_of_feature + 1), size)), dtype=np.int64)
+        return every[rng.choice(capacity, nbr_pattern, replace=False)].reshape(nbr_pattern, size), nbr_pattern, 0
+
+    found = np.empty((0, size), dtype=np.int64)
+    attempts = 0
+    rejections = 0
+    while len(found) < nbr_pattern:
+        missing = nbr_pattern - len(found)
+        _, candidates = sample_without_replacement(rng, nbr_of_feature, np.full(missing, size))
+        candidates = np.sort(candidates.reshape(missing, size), axis=1) + 1
+        attempts += missing
+
+        both = np.ascontiguousarray(np.concatenate([found, candidates]))
+        _, first = np.unique(both.view(np.dtype((np.void, both.dtype.itemsize * size))), return_index=True)
+        rejections += len(both) - len(first)
+        found = both[np.sort(first)]  # keep the first occurrence, known patterns come first
+    return found, attempts, rejections
+
+
+def label_groups(labels, nbr_of_label: int = None) -> list:
+    """
+    Group ids by label with one sort instead of one scan by label
+    :param labels: label of each id
+    :param nbr_of_label: if given, one group by label from 0 to nbr_of_label-1 (empty for the missing labels),
+        else one group by label present
+    :return: list of int arrays, ids of each label in increasing order
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    order = np.argsort(labels, kind='stable')
+    if nbr_of_label is None:
+        return np.split(order, np.flatnonzero(np.diff(labels[order])) + 1) if len(order) else []
+    return np.split(order, np.searchsorted(labels[order], np.arange(1, nbr_of_label)))
+
+
+class PatternPool:
+    """
+    Patterns a line can use, kept as arrays so sampling, usage accounting and gathering of values work for one row
+    or a whole batch of rows. Ids are the index of the patterns inside the table
+
+        table    : PatternTable holding values and use counts of the patterns
+        live     : ids of the patterns still usable are live[:count]
+        position : position of each pattern inside live
+        count    : number of patterns still usable
+        limit    : if positive, a pattern is retired once used more than limit times
+    """
+
+    def __init__(self, table: PatternTable, ids=None, limit: int = 0, position=None):
+        """
+        :param position: position array shared by pools holding distinct patterns, so many pools don't each need
+            an array as long as the table
+        """
+        self.table = table
+        self.limit = limit
+        self.live = np.arange(len(table), dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        self.position = np.zeros(len(table), dtype=np.int64) if position is None else position
+        self.position[self.live] = np.arange(len(self.live))
+        self.count = len(self.live)
+
+    @property
+    def values(self):
+        return self.table.values
+
+    @property
+    def offsets(self):
+        return self.table.offsets
+
+    @property
+    def used(self):
+        return self.table.used
+
+    def use(self, ids):
+        """
+        Count one use of each pattern given (ids may repeat), and retire the patterns used more than the limit
+        :param ids: array of pattern ids
+        """
+        np.add.at(self.used, ids, 1)
+        if self.limit:
+            for pattern_id in np.unique(ids[self.used[ids] > self.limit]).tolist():
+                self._retire(pattern_id)
+
+    def _retire(self, pattern_id: int):
+        """
+        Remove a pattern from the live ones by swapping it with the last live pattern
+        """
+        i = self.position[pattern_id]
+        last = self.live[self.count - 1]
+        self.live[i], self.live[self.count - 1] = last, pattern_id
+        self.position[last], self.position[pattern_id] = i, self.count - 1
+        self.count -= 1
+
+    def gather(self, rows, ids) -> tuple:
+        """
+        Gather values of the patterns picked
+        :param rows: row of each pattern picked
+        :param ids: id of each pattern picked
+        :return: (rows, values) flat arrays
+        """
+        sizes = self.offsets[ids + 1] - self.offsets[ids]
+        starts = np.repeat(self.offsets[ids] - np.cumsum(sizes) + sizes, sizes)
+        return np.repeat(rows, sizes), self.values[starts + np.arange(sizes.sum())]
+
+    def get_patterns(self, nbr_of_pattern: int) -> list:
+        """
+        Pick patterns for one row with the random module and use them
+        :param nbr_of_pattern: number of pattern wanted, limited by the number of live patterns
+        :return: list of the values of the patterns (union)
+        """
+        picks = random.sample(range(self.count), min(nbr_of_pattern, self.count))
+        ids = self.live[picks].tolist()
+        ret = set()
+        for i in ids:
+            ret.update(self.table.get_values(i).tolist())
+        self.used[ids] += 1  # patterns of a row are distinct
+        for i in ids:
+            if self.limit and self.used[i] > self.limit:
+                self._retire(i)
+        return [*ret]
+
+    def sample_batch(self, rng, nbr_pattern) -> tuple:
+        """
+        Pick patterns for a batch of rows with a numpy Generator and use them. When patterns are limited in use, rows
+        are accepted up to the first one retiring a pattern, then the next rows are drawn again among the patterns
+        left, so each row is drawn among the live patterns as if rows were made one by one
+        :param rng: numpy Generator
+        :param nbr_pattern: array of the number of pattern wanted by each row, limited by the number of live patterns
+        :return: (rows, ids) flat arrays, row and id of each pattern picked
+        """
+        nbr_of_rows = len(nbr_pattern)
+        all_rows = []
+        all_ids = []
+        done = 0
+        step = nbr_of_rows
+        while done < nbr_of_rows and self.count:
+            todo = np.minimum(nbr_pattern[done:done + step], self.count)
+            rows, picks = sample_without_replacement(rng, self.count, todo)
+            ids = self.live[picks]
+            accepted = len(todo)
+            if self.limit:
+                # running use of each pick in row order, the first one going over the limit ends the accepted rows
+                order = np.argsort(ids, kind='stable')
+                sorted_ids = ids[order]
+                group_start = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+                rank = np.empty(len(ids), dtype=np.int64)
+                rank[order] = np.arange(len(ids)) - np.repeat(group_start, np.diff(np.r_[group_start, len(ids)]))
+                over = np.flatnonzero(self.used[ids] + rank + 1 > self.limit)
+                if len(over):
+                    accepted = int(rows[over[0]]) + 1
+                    ids = ids[rows < accepted]
+                    rows = rows[rows < accepted]
+                    step = max(64, 2 * accepted)
+            self.use(ids)
+            all_rows.append(rows + done)
+            all_ids.append(ids)
+            done += accepted
+
+        if not all_rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(all_rows), np.concatenate(all_ids)
+
+
 class PatternManager:
     """
     Manage pattern
 
-        patterns          : hold the current patterns
+        patterns          : PatternTable holding the current patterns
+        pools             : pool of patterns usable by a line of each label, indexed by the label
+        classes           : ClassSampler drawing the label of lines among many classes, None for the two categories
         max_using_pattern : if a pattern should be use in a limited way
+        nbr_attempt       : number of candidate patterns drawn to create the patterns
+        nbr_rejection     : number of candidate patterns rejected as duplicates
     """
-    patterns = set()
+    patterns = None
+    classes = None
     max_using_pattern = 0
+    nbr_attempt = 0
+    nbr_rejection = 0
 
     def __init__(self, max_using_pattern):
         self.max_using_pattern = max_using_pattern
-        self.patterns = set()
+        self.nbr_attempt = 0  # number of candidate patterns drawn by compile_pattern
+        self.nbr_rejection = 0  # number of candidate patterns rejected because they were duplicates
+        self.patterns = PatternTable([], [0])
+        self.pools = []
+        self._class_index = None
+
+    @property
+    def nbr_of_class(self) -> int:
+        return 2 if self.classes is None else len(self.classes)
+
+    @property
+    def label_dtype(self) -> np.dtype:
+        """
+        dtype of the labels of the lines
+        """
+        return np.dtype(np.uint8) if self.classes is None else self.classes.dtype
 
     def compile_pattern(self,
                         nbr_of_feature: int,
@@ -195,7 +633,10 @@ class PatternManager:
                         output_dir: str,
                         no_intersections: bool,
                         today: str,
-                        disable_tqdm: bool) -> str:
+                        disable_tqdm: bool,
+                        compress: str = None,
+                        cache=None,
+                        seed: int = None) -> str:
         """
         Create all pattern
         :param nbr_of_feature: number of feature from the data to extract pattern
@@ -206,70 +647,112 @@ class PatternManager:
         :param output_dir: output directory to hold all result
         :param no_intersections: specify if all pattern shouldn't have any intersections between themselfs
         :param today: moment of execution
+        :param compress: 'gzip', 'bz2' or 'xz' to compress the pattern files
+        :param cache: PatternCache, the patterns are loaded from it if they were already created with the same
+                      parameters and seed, else they are added to it (only used with a seed)
+        :param seed: seed given to the random module just before, part of the cache key
         :return: saving file name for the pattern
         """
-        cpt_pat = 0  # counter of pattern
-
-        pattern_value_dealer = PatternValueDealer(nbr_of_feature, no_intersections=no_intersections)
-
-        pbar = tqdm.tqdm(nbr_pattern, disable=disable_tqdm)  # progress bar
-        while cpt_pat < nbr_pattern:
-            pattern = Pattern()
-            size = random.randint(min_size, max_size)  # define the size of the pattern
-
-            pattern = self._set_label(pattern, split)
+        self.create_patterns(nbr_of_feature, nbr_pattern, min_size, max_size, split, no_intersections, disable_tqdm,
+                             cache, seed)
 
-            try:
-                pattern.values = pattern_value_dealer.get_val(size)  # assign values to the pattern from the dealer
-            except ValueError:
-                log.error(
-                    f"Arguments can't be followed. {nbr_pattern} patterns has been asked but in with the number "
-                    f"of feature, the size of patterns and the no_intersection modes it can't be done. "
-                    f"The running has been stopped here")
-                break
-
-            self._add_self_pattern(pattern)  # save the pattern inside the manager
-
-            if cpt_pat >= self._get_pattern_count(
-                    -1):  # test if the pattern is a duplicate (we use set so if the size has not grow,
-                # it means this pattern was already saved somewhere
-                continue
-
-            cpt_pat += 1
-            pbar.update(1)
-
-        log.info(f"{self._get_pattern_count(-1)} patterns created")
-
-        self._convert_self_pattern_to_list()  # to simplify the folowing code, we convert patterns to a list instead of a set
-            
         if no_intersections:
             no_inter = "NO_INTER"
         else:
             no_inter = "INTER"
-        files = self._save_patterns(output_dir, today, disable_tqdm, no_inter)
+        files = self._save_patterns(output_dir, today, disable_tqdm, no_inter, compress)
 
         return files
 
-    # Multiple function to override when we are using categories
-    def _convert_self_pattern_to_list(self):
-        self.patterns = [*self.patterns]
+    def create_patterns(self,
+                        nbr_of_feature: int,
+                        nbr_pattern: int,
+                        min_size: int,
+                        max_size: int,
+                        split: int,
+                        no_intersections: bool,
+                        disable_tqdm: bool = True,
+                        cache=None,
+                        seed: int = None):
+        """
+        Create all pattern and the pools of each label, without saving them (see compile_pattern for the parameters)
+        """
+        key = None
+        if cache is not None and seed is not None:
+            key = cache.key(manager=type(self).__name__, nbr_of_feature=nbr_of_feature, nbr_pattern=nbr_pattern,
+                            min_size=min_size, max_size=max_size, split=split, no_intersections=no_intersections,
+                            seed=seed, classes=None if self.classes is None else self.classes.proportions.tolist())
+        entry = cache.get(key) if key else None
+        if entry:
+            state, arrays = entry
+            self.patterns = PatternTable(arrays["values"], arrays["offsets"], arrays["labels"])
+            self.nbr_attempt, self.nbr_rejection = state["nbr_attempt"], state["nbr_rejection"]
+            random.setstate(random_state_from_json(state["random_state"]))  # as if the patterns were drawn
+        else:
+            self._generate_patterns(nbr_of_feature, nbr_pattern, min_size, max_size, split, no_intersections,
+                                    disable_tqdm)
+            if key:
+                cache.put(key,
+                          {"nbr_attempt": self.nbr_attempt, "nbr_rejection": self.nbr_rejection,
+                           "random_state": random_state_to_json(random.getstate())},
+                          {"values": self.patterns.values, "offsets": self.patterns.offsets,
+                           "labels": self.patterns.labels})
+        log.info(f"{self._get_pattern_count(-1)} patterns created in {self.nbr_attempt} attempts, "
+                 f"{self.nbr_rejection} duplicates rejected")
+        self._build_pools()
+
+    def _generate_patterns(self, nbr_of_feature, nbr_pattern, min_size, max_size, split, no_intersections,
+                           disable_tqdm):
+        """
+        Draw the patterns and their labels, see compile_pattern
+        """
+        rng = new_rng()
+        labels = self._draw_labels(nbr_pattern, split)
+        sizes = rng.integers(min_size, max_size + 1, nbr_pattern)  # define the size of each pattern
+
+        if no_intersections:
+            sizes = fit_disjoint_sizes(sizes, nbr_of_feature, min_size, rng)
+            pattern_value_dealer = PatternValueDealer(nbr_of_feature, no_intersections=no_intersections)
+            dealt = pattern_value_dealer.get_val_batch(sizes.tolist())
+            offsets = np.concatenate([[0], np.cumsum(sizes)])
+            values = np.fromiter(itertools.chain.from_iterable(dealt), dtype=np.uint32, count=offsets[-1])
+            self.nbr_attempt, self.nbr_rejection = nbr_pattern, 0
+        else:
+            # patterns can only be duplicates of patterns with the same label and the same size
+            self.nbr_attempt, self.nbr_rejection = 0, 0
+            groups = label_groups(labels)
+            for group in groups:
+                sizes[group] = fit_sizes_to_capacity(sizes[group], nbr_of_feature, min_size, max_size, rng)
+            offsets = np.concatenate([[0], np.cumsum(sizes)])
+            values = np.empty(offsets[-1], dtype=np.uint32)
+            for group in groups:
+                for size in tqdm.tqdm(np.unique(sizes[group]), disable=disable_tqdm):
+                    members = group[sizes[group] == size]
+                    group_values, attempts, rejections = draw_distinct_patterns(rng, nbr_of_feature, int(size),
+                                                                                len(members))
+                    values[offsets[members][:, None] + np.arange(size)] = group_values
+                    self.nbr_attempt += attempts
+                    self.nbr_rejection += rejections
+
+        self.patterns = PatternTable(values, offsets, labels)  # save the patterns inside the manager
 
-    def _set_label(self, pattern, split):
+    # Multiple function to override when we are using categories
+    def _build_pools(self):
         """
-        Set the label of a pattern
-        :param pattern:
-        :param split: percentage of category
-        :return: pattern with its label
+        Build the pool of patterns of each label, lines of both labels share the same pool without categories
         """
-        return pattern
+        pool = PatternPool(self.patterns, limit=self.max_using_pattern)
+        self.pools = [pool, pool]
+        self._class_index = None
 
-    def _add_self_pattern(self, pattern: Pattern):
+    def _draw_labels(self, nbr_pattern, split):
         """
-        Add the pattern to the manager
-        :param pattern:
-        :return:
+        Draw the label of each pattern
+        :param nbr_pattern: number of patterns
+        :param split: percentage of category
+        :return: uint8 array of labels
         """
-        self.patterns.add(pattern)
+        return np.full(nbr_pattern, NO_LABEL, dtype=np.uint8)
 
     def _get_pattern_count(self, label):
         return len(self.patterns)
@@ -277,105 +760,128 @@ class PatternManager:
     def _get_all_patterns(self):
         return self.patterns
 
-    def _get_pat(self, indice, label):
+    def _save_patterns(self, output_dir, today, disable_tqdm, no_intersections, compress=None):
+        pattern_file = compressed_name(os.path.join(output_dir, f"pattern_{no_intersections}_{today}.txt"), compress)
+        PatternWriter.write_patterns_only(self._get_all_patterns(), pattern_file, disable_tqdm, compress)
+        return pattern_file
+
+    def get_pool(self, label) -> PatternPool:
         """
-        Get pattern by indice and label
-        :param indice:
+        Get the pool of patterns a line of this label can use
         :param label:
         :return:
         """
-        return self.patterns[indice]
-
-    def _save_patterns(self, output_dir, today, disable_tqdm, no_intersections):
-        pattern_file = os.path.join(output_dir, f"pattern_{no_intersections}_{today}.txt")
-        PatternWriter.write_patterns_only(self._get_all_patterns(), pattern_file, disable_tqdm)
-        return pattern_file
-
-    def _pop_pattern(self, indice, label):
-        self.patterns.pop(indice)
+        return self.pools[label]
 
     def get_patterns(self, nbr_of_pattern, label):
-        pats = []
-        nbr_of_pattern = nbr_of_pattern if nbr_of_pattern < self._get_pattern_count(
-            label) else self._get_pattern_count(label)
-        indice = random.sample(range(0, self._get_pattern_count(label)),
-                               nbr_of_pattern)  # get indice of pattern for this line
-        for i in sorted(indice, reverse=True):  # for each indice in decreased order for the pop
-            over_limit = self._get_pat(i, label).update_use(self.max_using_pattern)  # update the use of each pattern
-            pats.append(self._get_pat(i, label).values)
-            if over_limit:  # if a pattern is over the limit of use
-                self._pop_pattern(i, label)
+        return self.get_pool(label).get_patterns(nbr_of_pattern)  # only the values
 
-        ret = set()
-        for p in pats:
-            ret.update(set(p))
+    def get_class_index(self) -> tuple:
+        """
+        Live patterns of every label as CSR arrays, built once as pools only change when patterns are limited in use
+        :return: (class_ptr, ids), the live patterns of the label c are ids[class_ptr[c]:class_ptr[c+1]]
+        """
+        if self._class_index is None:
+            counts = np.array([pool.count for pool in self.pools], dtype=np.int64)
+            class_ptr = np.zeros(len(self.pools) + 1, dtype=np.int64)
+            np.cumsum(counts, out=class_ptr[1:])
+            ids = np.concatenate([pool.live[:pool.count] for pool in self.pools]) if self.pools \
+                else np.empty(0, dtype=np.int64)
+            self._class_index = class_ptr, ids
+        return self._class_index
+
+    def get_state(self) -> dict:
+        """
+        State of the patterns and of their use, to checkpoint a run
+        :return: dict of numpy arrays
+        """
+        state = {"values": self.patterns.values, "offsets": self.patterns.offsets, "labels": self.patterns.labels,
+                 "used": self.patterns.used}
+        for i, pool in enumerate(self._distinct_pools()):
+            state[f"pool{i}_live"] = pool.live[:pool.count]
+            state[f"pool{i}_retired"] = pool.live[pool.count:]
+        return state
+
+    def set_state(self, state: dict):
+        """
+        Restore the patterns and their use saved by get_state
+        """
+        self.patterns = PatternTable(state["values"], state["offsets"], state["labels"], state["used"])
+        self._build_pools()
+        for i, pool in enumerate(self._distinct_pools()):
+            pool.live = np.concatenate([state[f"pool{i}_live"], state[f"pool{i}_retired"]]).astype(np.int64)
+            pool.position[pool.live] = np.arange(len(pool.live))
+            pool.count = len(state[f"pool{i}_live"])
+
+    def reset_use(self, max_using_pattern: int = None):
+        """
+        Forget the use of the patterns and make them all usable again
+        :param max_using_pattern: new use limit, None to keep it
+        """
+        if max_using_pattern is not None:
+            self.max_using_pattern = max_using_pattern
+        self.patterns.used[:] = 0
+        self._build_pools()
 
-        return [*ret]
+    def _distinct_pools(self) -> list:
+        return list({id(pool): pool for pool in self.pools}.values())  # in label order
+
+    def get_nbr_retired(self) -> int:
+        """
+        Number of patterns used more than max_using_pattern, so not usable anymore
+        """
+        if not self.max_using_pattern:
+            return 0
+        return int(np.count_nonzero(self.patterns.used > self.max_using_pattern))
 
 
 class PatternManagerWithCat(PatternManager):
     """
-    Son of PatternManager to add the categories for supervised learning
+    Son of PatternManager to add the categories for supervised learning: two categories split by the split, or any
+    number of classes following a proportion vector
     """
-    patterns = {
-        Category.CAT0: set(),
-        Category.CAT1: set()
-    }
 
-    def __init__(self, max_using_pattern):
+    def __init__(self, max_using_pattern, class_proportions=None):
+        """
+        :param class_proportions: probability of each class (see engine.class_proportions), None for the two
+            categories
+        """
         super().__init__(max_using_pattern)
-        self.patterns = {
-            Category.CAT0: set(),
-            Category.CAT1: set()
-        }
-        log.info("Pattern with category")
-
-    def _convert_self_pattern_to_list(self):
-        self.patterns[Category.CAT0] = [*self.patterns[Category.CAT0]]
-        self.patterns[Category.CAT1] = [*self.patterns[Category.CAT1]]
-
-    def _set_label(self, pattern, split):
-        label = 0 if random.random() <= (split / 100) else 1
-        pattern.set_label(label)
-        return pattern
-
-    def _add_self_pattern(self, pattern: Pattern):
-        if pattern.label == Category.CAT0:
-            self.patterns[Category.CAT0].add(pattern)
-        elif pattern.label == Category.CAT1:
-            self.patterns[Category.CAT1].add(pattern)
-        else:
-            log.critical(f"Problem with category for this pattern {pattern}")
+        self.classes = ClassSampler(class_proportions) if class_proportions is not None else None
+        log.info("Pattern with category" if self.classes is None else f"Pattern with {len(self.classes)} classes")
+
+    def _build_pools(self):
+        # one pool by label, each holding its own patterns, with one position array for all of them
+        position = np.zeros(len(self.patterns), dtype=np.int64)
+        groups = label_groups(self.patterns.labels, self.nbr_of_class)
+        self.pools = [PatternPool(self.patterns, group, self.max_using_pattern, position) for group in groups]
+        self._class_index = None
+
+    def _draw_labels(self, nbr_pattern, split):
+        if self.classes is None:
+            return np.array([0 if random.random() <= (split / 100) else 1 for _ in range(nbr_pattern)],
+                            dtype=np.uint8)
+        # patterns follow the class proportions, but every class gets one when there are enough patterns
+        rng = new_rng()
+        labels = self.classes.sample(rng, nbr_pattern)
+        if nbr_pattern >= len(self.classes):
+            labels[:len(self.classes)] = np.arange(len(self.classes))
+            rng.shuffle(labels)
+        return labels
 
     def _get_pattern_count(self, label):
-        if label == Category.CAT0:
-            return len(self.patterns[Category.CAT0])
-        elif label == Category.CAT1:
-            return len(self.patterns[Category.CAT1])
+        if 0 <= label < len(self.pools):
+            return self.pools[label].count
         else:
-            return len(self.patterns[Category.CAT0]) + len(self.patterns[Category.CAT1])
-
-    def _get_pat(self, indice, label):
-        if label == Category.CAT0:
-            return self.patterns[Category.CAT0][indice]
-        elif label == Category.CAT1:
-            return self.patterns[Category.CAT1][indice]
+            return len(self.patterns)
 
-    def _get_all_patterns(self):
-        return self.patterns[Category.CAT0] + self.patterns[Category.CAT1]
-
-    def _save_patterns(self, output_dir, today, disable_tqdm, no_inter):
-        pattern_file = os.path.join(output_dir, f"pattern_{no_inter}_{today}.txt")
-        label_file = os.path.join(output_dir, f"pattern_label_{today}.txt")
-        PatternWriter.write_patterns_and_labels(self._get_all_patterns(), pattern_file, label_file, disable_tqdm)
+    def _save_patterns(self, output_dir, today, disable_tqdm, no_inter, compress=None):
+        pattern_file = compressed_name(os.path.join(output_dir, f"pattern_{no_inter}_{today}.txt"), compress)
+        label_file = compressed_name(os.path.join(output_dir, f"pattern_label_{today}.txt"), compress)
+        PatternWriter.write_patterns_and_labels(self._get_all_patterns(), pattern_file, label_file, disable_tqdm,
+                                                compress)
         return pattern_file, label_file
 
-    def _pop_pattern(self, indice, label):
-        if label == Category.CAT0:
-            return self.patterns[Category.CAT0].pop(indice)
-        elif label == Category.CAT1:
-            return self.patterns[Category.CAT1].pop(indice)
-
 
 if __name__ == '__main__':
     p = PatternValueDealer(100000)
@@ -0,0 +1,225 @@
+import os
+import bz2
+import gzip
+import lzma
+import mmap
+import json
+import glob
+import logging
+
+import numpy as np
+
+log = logging.getLogger('main')
+
+INDEX_EXTENSION = ".idx.npy"  # sidecar file holding the offset of each line
+SCAN_SIZE = 1 << 26  # number of bytes scanned at once to find the lines
+CHUNK_SIZE = 100000  # default number of lines by chunk when iterating
+
+
+def parse_lines(buffer) -> tuple:
+    """
+    Parse lines of integers separated by one space (the .dat layout) without a Python loop
+    :param buffer: bytes made of complete lines
+    :return: (indptr, indices) CSR arrays, the i-th line is indices[indptr[i]:indptr[i+1]]
+    """
+    buf = np.frombuffer(buffer, dtype=np.uint8)
+    line_ends = np.flatnonzero(buf == ord('\n'))
+    if len(buf) and buf[-1] != ord('\n'):  # last line without newline
+        line_ends = np.append(line_ends, len(buf))
+    line_starts = np.concatenate([[0], line_ends[:-1] + 1])
+
+    # a line holds one more number than spaces, unless it is empty
+    spaces = np.flatnonzero(buf == ord(' '))
+    counts = np.searchsorted(spaces, line_ends) - np.searchsorted(spaces, line_starts) + (line_ends > line_starts)
+    indptr = np.zeros(len(line_ends) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+
+    indices = np.fromstring(buffer, dtype=np.int64, sep=' ') if len(buf) else np.empty(0, dtype=np.int64)
+    return indptr, indices
+
+
+def parse_varint_rows(buffer) -> tuple:
+    """
+    Decode rows written by VarintWriter (delta + varint, each row ended by a 0) without a Python loop
+    :param buffer: bytes made of complete rows
+    :return: (indptr, indices) CSR arrays, the i-th line is indices[indptr[i]:indptr[i+1]]
+    """
+    buf = np.frombuffer(buffer, dtype=np.uint8)
+    if not len(buf):
+        return np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64)
+    token_ends = np.flatnonzero(buf < 0x80)
+    token_starts = np.concatenate([[0], token_ends[:-1] + 1])
+    byte_rank = np.arange(len(buf)) - np.repeat(token_starts, token_ends - token_starts + 1)
+    tokens = np.add.reduceat((buf & 0x7f).astype(np.int64) << (7 * byte_rank), token_starts)
+
+    row_end = tokens == 0
+    deltas = tokens[~row_end]
+    counts = np.diff(np.concatenate([[-1], np.flatnonzero(row_end)])) - 1
+    indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    # indices are the running sum of the deltas, restarted on each row
+    total = np.cumsum(deltas)
+    before = np.concatenate([[0], total])[indptr[:-1]]
+    return indptr, total - np.repeat(before, counts)
+
+
+def read_varint(data_file: str) -> tuple:
+    """
+    Read a whole file written by VarintWriter, compressed or not (.gz, .bz2, .xz)
+    :return: (indptr, indices) CSR arrays
+    """
+    with open_input(data_file) as fd:
+        return parse_varint_rows(fd.read())
+
+
+def open_input(file: str, mode: str = 'rb'):
+    """
+    Open a file to read, decompressing it if its extension is .gz, .bz2 or .xz
+    :param mode: 'rb' for bytes, 'rt' for text
+    """
+    opener = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}.get(os.path.splitext(file)[1], open)
+    return opener(file, mode)
+
+
+def find_config(data_file: str):
+    """
+    Find the config of the run that wrote a data file: config_<date>.json where <date> ends the name of the file
+    :return: name of the config file, None if it can't be found
+    """
+    directory = os.path.dirname(data_file)
+    today = os.path.basename(data_file).rsplit('_', 1)[-1].split('.', 1)[0]
+    candidates = glob.glob(os.path.join(directory, f"config_{glob.escape(today)}.json"))
+    return candidates[0] if candidates else None
+
+
+def build_index(data) -> np.ndarray:
+    """
+    Find the offset of every line of a memory-mapped file
+    :param data: bytes-like object (mmap)
+    :return: uint64 array of length nbr_of_rows + 1, the i-th line is data[offsets[i]:offsets[i+1]]
+    """
+    offsets = [np.zeros(1, dtype=np.uint64)]
+    for start in range(0, len(data), SCAN_SIZE):
+        chunk = np.frombuffer(data[start:start + SCAN_SIZE], dtype=np.uint8)
+        offsets.append((np.flatnonzero(chunk == ord('\n')) + start + 1).astype(np.uint64))
+    offsets = np.concatenate(offsets)
+    if offsets[-1] != len(data):  # last line without newline
+        offsets = np.append(offsets, np.uint64(len(data)))
+    return offsets
+
+
+class DatReader:
+    """
+    Read a synthetic_data_*.dat file through a memory map. The offset of each line is computed on first open and
+    cached inside a sidecar file (<data_file>.idx.npy), so any row can be reached in O(1)
+
+        data_file  : .dat file to read
+        label_file : .label file of the lines, None if there is none
+        config     : config dumped by main for this run, None if it can't be found
+        offsets    : offset of each line inside the .dat file
+    """
+
+    def __init__(self, data_file: str, label_file: str = None, config_file: str = None):
+        self.data_file = data_file
+        prefix = data_file[:-len(".dat")] if data_file.endswith(".dat") else data_file
+        if label_file is None and os.path.exists(prefix + ".label"):
+            label_file = prefix + ".label"
+        self.label_file = label_file
+        self.config = self._load_config(config_file)
+        self._labels = None
+
+        self._descriptor = open(data_file, 'rb')
+        size = os.fstat(self._descriptor.fileno()).st_size
+        self.data = mmap.mmap(self._descriptor.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.offsets = self._load_index()
+
+    def _load_index(self) -> np.ndarray:
+        """
+        Load the line offsets from the sidecar file, or build and save them if it is missing or outdated
+        """
+        index_file = self.data_file + INDEX_EXTENSION
+        if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(self.data_file):
+            offsets = np.load(index_file, mmap_mode='r')
+            if len(offsets) and offsets[-1] == len(self.data):
+                return offsets
+
+        log.info(f"Indexing {self.data_file}")
+        offsets = build_index(self.data)
+        try:
+            np.save(index_file, offsets)
+        except OSError:
+            log.warning(f"Can't save index to {index_file}")
+        return offsets
+
+    def _load_config(self, config_file):
+        """
+        Load the config of the run, by default config_<date>.json where <date> ends the name of the .dat file
+        """
+        if config_file is None:
+            config_file = find_config(self.data_file)
+            if config_file is None:
+                return None
+        with open(config_file) as fd:
+            return json.load(fd)
+
+    @property
+    def labels(self):
+        """
+        Labels of all the lines, None if there is no label file
+        """
+        if self._labels is None and self.label_file:
+            with open(self.label_file, 'rb') as fd:
+                self._labels = parse_lines(fd.read())[1]
+        return self._labels
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        """
+        Get one line
+        :param i: row number (negative numbers count from the end)
+        :return: array of the column indices of the line
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"Row {i} out of range for {len(self)} rows")
+        return parse_lines(self.data[int(self.offsets[i]):int(self.offsets[i + 1])])[1]
+
+    def to_csr(self, start: int = 0, stop: int = None) -> tuple:
+        """
+        Convert a range of lines to CSR arrays
+        :param start: first row
+        :param stop: row after the last one, by default the end of the file
+        :return: (indptr, indices, labels), labels is None if there is no label file
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        indptr, indices = parse_lines(self.data[int(self.offsets[start]):int(self.offsets[stop])])
+        labels = self.labels[start:stop] if self.label_file else None
+        return indptr, indices, labels
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE):
+        """
+        Iterate over the lines by chunk
+        :param chunk_size: number of lines by chunk
+        :return: generator of (indptr, indices, labels)
+        """
+        for start in range(0, len(self), chunk_size):
+            yield self.to_csr(start, start + chunk_size)
+
+    def __iter__(self):
+        for indptr, indices, _ in self.iter_chunks():
+            for a, b in zip(indptr[:-1], indptr[1:]):
+                yield indices[a:b]
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self._descriptor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
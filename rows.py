@@ -0,0 +1,132 @@
+import numpy as np
+
+ROW_STORE_CAPACITY = 1024  # number of rows a RowStore holds before growing its buffers for the first time
+
+
+class RowStore:
+    """
+    Append-only store of rows kept as CSR numpy buffers instead of lists of Python ints (about 8 to 10 times
+    smaller). Buffers double when they are full, so appending costs O(1) amortized by value.
+    Indexing gives a row as a list of int, slicing gives a new RowStore, iterating gives the rows as lists.
+    indices, offsets and labels are numpy views of the filled part of the buffers: they are exported without copy
+    (np.asarray, memoryview, the buffer protocol) and stay valid after later appends or a clear
+
+        indices     : 1-based features of all the rows, uint32
+        offsets     : int64, the row i is indices[offsets[i]:offsets[i+1]]
+        labels      : label of each row
+        nbr_of_rows : number of rows held
+        nbr_of_one  : number of features held (sum of the length of the rows)
+    """
+
+    def __init__(self, label_dtype=np.uint8, capacity: int = ROW_STORE_CAPACITY):
+        """
+        :param label_dtype: dtype of the labels
+        :param capacity: number of rows held before growing the buffers
+        """
+        self.label_dtype = np.dtype(label_dtype)
+        self.capacity = max(int(capacity), 1)
+        self.nbr_of_rows = 0
+        self.nbr_of_one = 0
+        self._allocate()
+
+    def _allocate(self):
+        self._indices = np.empty(self.capacity * 8, dtype=np.uint32)  # room for 8 features by row
+        self._offsets = np.zeros(self.capacity + 1, dtype=np.int64)
+        self._labels = np.empty(self.capacity, dtype=self.label_dtype)
+
+    def _reserve(self, nbr_of_rows: int, nbr_of_one: int):
+        """
+        Grow the buffers (doubling them) so they can hold nbr_of_rows and nbr_of_one more
+        """
+        rows = self.nbr_of_rows + nbr_of_rows
+        if rows > len(self._labels):
+            size = max(rows, 2 * len(self._labels))
+            self._labels = np.resize(self._labels, size)
+            self._offsets = np.resize(self._offsets, size + 1)
+        ones = self.nbr_of_one + nbr_of_one
+        if ones > len(self._indices):
+            self._indices = np.resize(self._indices, max(ones, 2 * len(self._indices)))
+
+    @property
+    def indices(self) -> np.ndarray:
+        return self._indices[:self.nbr_of_one]
+
+    @property
+    def offsets(self) -> np.ndarray:
+        return self._offsets[:self.nbr_of_rows + 1]
+
+    @property
+    def labels(self) -> np.ndarray:
+        return self._labels[:self.nbr_of_rows]
+
+    def append(self, row: list, label: int = 0):
+        """
+        Add a row
+        :param row: sorted 1-based features
+        """
+        self._reserve(1, len(row))
+        end = self.nbr_of_one + len(row)
+        self._indices[self.nbr_of_one:end] = row
+        self._labels[self.nbr_of_rows] = label
+        self.nbr_of_rows += 1
+        self._offsets[self.nbr_of_rows] = end
+        self.nbr_of_one = end
+
+    def extend_csr(self, indptr, indices, labels):
+        """
+        Add rows given as CSR arrays
+        :param indptr: lines[i] is indices[indptr[i]:indptr[i+1]]
+        :param indices: 1-based features, sorted inside each line
+        :param labels: label of each line
+        """
+        indptr = np.asarray(indptr, dtype=np.int64)
+        indices = np.asarray(indices)
+        nbr_of_rows = len(indptr) - 1
+        nbr_of_one = int(indptr[-1] - indptr[0])
+        self._reserve(nbr_of_rows, nbr_of_one)
+        self._indices[self.nbr_of_one:self.nbr_of_one + nbr_of_one] = indices[indptr[0]:indptr[-1]]
+        self._offsets[self.nbr_of_rows + 1:self.nbr_of_rows + nbr_of_rows + 1] = \
+            indptr[1:] - indptr[0] + self.nbr_of_one
+        self._labels[self.nbr_of_rows:self.nbr_of_rows + nbr_of_rows] = labels
+        self.nbr_of_rows += nbr_of_rows
+        self.nbr_of_one += nbr_of_one
+
+    def clear(self):
+        """
+        Forget the rows. New buffers are allocated, so the views given before are not overwritten
+        """
+        self.nbr_of_rows = 0
+        self.nbr_of_one = 0
+        self._allocate()
+
+    def to_csr(self, start: int = 0, stop: int = None) -> tuple:
+        """
+        Rows start to stop (excluded) as CSR arrays, indices and labels are views of the buffers
+        :return: (indptr, indices, labels), indptr starts at 0
+        """
+        start, stop, _ = slice(start, stop).indices(self.nbr_of_rows)
+        stop = max(start, stop)
+        indptr = self._offsets[start:stop + 1] - self._offsets[start]
+        return (indptr, self._indices[self._offsets[start]:self._offsets[stop]],
+                self._labels[start:stop])
+
+    def __len__(self):
+        return self.nbr_of_rows
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            if i.step not in (None, 1):
+                raise ValueError("Rows can only be sliced with a step of 1")
+            rows = RowStore(self.label_dtype)
+            rows.extend_csr(*self.to_csr(i.start or 0, i.stop))
+            return rows
+        if i < 0:
+            i += self.nbr_of_rows
+        if not 0 <= i < self.nbr_of_rows:
+            raise IndexError(f"Row {i} out of range for {self.nbr_of_rows} rows")
+        return self._indices[self._offsets[i]:self._offsets[i + 1]].tolist()
+
+    def __iter__(self):
+        flat = self.indices.tolist()
+        bounds = self.offsets.tolist()
+        return (flat[a:b] for a, b in zip(bounds[:-1], bounds[1:]))
@@ -0,0 +1,184 @@
+import os
+import sys
+import json
+import argparse
+import logging
+import threading
+import socketserver
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+
+from binaps_data.utils.logs import set_logger
+from binaps_data.batch import job_args
+from binaps_data.main import main
+
+log = logging.getLogger('main')
+
+# entries of the config sent back as the job files
+RESULT_FILES = ("pattern_file", "data_file", "truth_file", "row_patterns_file", "profile_file")
+
+
+def argument_parser(cp_args=None) -> argparse.Namespace:
+    """
+    Get argument from command line
+    :param cp_args: possible way to pass arguments to the parser
+    :return: [argparse.Namespace]
+    """
+    parser = argparse.ArgumentParser(description='Long-lived binaps data generator: read one JSON job by line '
+                                                 '(the arguments of main, as a dict or a string, with an optional '
+                                                 '"id") and answer one JSON line by job with its files and config')
+    parser.add_argument('--socket', type=str, default=None,
+                        help="Unix socket to listen on, jobs are read from stdin if not given")
+    parser.add_argument('-o', '--output_dir', type=str, default=".",
+                        help="Output directory, each job not giving its own output_dir is saved inside job_<id>")
+    parser.add_argument('--workers', type=int, default="1",
+                        help="Number of jobs done at the same time, each one inside a worker process. With 1, jobs "
+                             "are done one after the other inside the service process")
+    parser.add_argument('--pattern_cache', type=str, default=None,
+                        help="Directory caching the pattern tables, shared by the jobs. Defaults to "
+                             "<output_dir>/pattern_cache, 'none' to disable it")
+    parser.add_argument('--pattern_cache_size', type=int, default="64",
+                        help="Maximum number of pattern tables kept inside the cache")
+    return parser.parse_args(cp_args)
+
+
+def run_job(job_id, args: list) -> dict:
+    """
+    Run one job through main
+    :param job_id: id given back with the answer
+    :param args: arguments of main, see batch.job_args
+    :return: answer of the job: {"id", "files", "config"} or {"id", "error"}
+    """
+    try:
+        config = main(args)
+    except SystemExit as e:  # argparse refused the arguments, its message is logged on stderr
+        return {"id": job_id, "error": f"invalid arguments (exit code {e.code})"}
+    except Exception as e:
+        log.exception(f"Job {job_id} failed")
+        return {"id": job_id, "error": repr(e)}
+    return {"id": job_id, "files": {name: config[name] for name in RESULT_FILES if config.get(name)}, "config": config}
+
+
+class JobRunner:
+    """
+    Run jobs inside this process, one at a time, or inside a pool of worker processes kept alive between jobs.
+    Either way imports, logger and pattern cache (see cache.get_cache) are set up once
+
+        output_dir         : directory of the jobs not giving their own output_dir
+        workers            : number of worker processes, 1 to run the jobs inside this process
+        pattern_cache      : pattern cache directory, None for no cache
+        pattern_cache_size : maximum number of pattern tables kept inside the cache
+    """
+
+    def __init__(self, output_dir: str = ".", workers: int = 1, pattern_cache: str = None,
+                 pattern_cache_size: int = 64):
+        self.output_dir = output_dir
+        self.workers = workers
+        self.pattern_cache = pattern_cache
+        self.pattern_cache_size = pattern_cache_size
+        self._executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        self._lock = threading.Lock()  # main uses the global random module, so jobs of this process are serialized
+        self._count = 0
+
+    def submit(self, job) -> Future:
+        """
+        Start a job
+        :param job: dict of main arguments with an optional "id", or string of command line arguments
+        :return: future of the answer, see run_job
+        """
+        with self._lock:
+            self._count += 1
+            job_id = self._count
+        if isinstance(job, dict):
+            job = dict(job)
+            job_id = job.pop("id", job_id)
+        args = job_args(job, os.path.join(self.output_dir, f"job_{job_id}"), self.pattern_cache,
+                        self.pattern_cache_size)
+        if self._executor is not None:
+            return self._executor.submit(run_job, job_id, args)
+        future = Future()
+        with self._lock:
+            future.set_result(run_job(job_id, args))
+        return future
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
+def serve_stream(runner: JobRunner, reader, writer):
+    """
+    Read jobs by line and write each answer on its own line as soon as the job is done (in completion order)
+    :param reader: iterable of lines (str or bytes)
+    :param writer: function writing one answer line
+    """
+    write_lock = threading.Lock()
+    futures = []
+
+    def answer(result: dict):
+        with write_lock:
+            writer(json.dumps(result) + "\n")
+
+    for line in reader:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            answer({"id": None, "error": f"invalid job: {e}"})
+            continue
+        future = runner.submit(job)
+        future.add_done_callback(lambda f: answer(f.result()))
+        futures.append(future)
+    wait(futures)
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        def write(text: str):
+            self.wfile.write(text.encode())
+            self.wfile.flush()
+
+        serve_stream(self.server.runner, self.rfile, write)
+
+
+class _JobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_socket(runner: JobRunner, socket_file: str):
+    """
+    Serve jobs on a Unix socket, each connection sends jobs by line and receives their answers
+    """
+    if os.path.exists(socket_file):
+        os.remove(socket_file)
+    with _JobServer(socket_file, _JobHandler) as server:
+        server.runner = runner
+        log.info(f"Listening on {socket_file}")
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_file)
+
+
+if __name__ == '__main__':
+    log = set_logger()
+    args = argument_parser()
+    pattern_cache = args.pattern_cache or os.path.join(args.output_dir, "pattern_cache")
+    if pattern_cache.lower() == "none":
+        pattern_cache = None
+    runner = JobRunner(args.output_dir, args.workers, pattern_cache, args.pattern_cache_size)
+    try:
+        if args.socket:
+            serve_socket(runner, args.socket)
+        else:
+            def write_stdout(text: str):
+                sys.stdout.write(text)
+                sys.stdout.flush()
+
+            serve_stream(runner, sys.stdin, write_stdout)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.close()
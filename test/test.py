@@ -1,46 +1,274 @@
-import logging
-import tqdm
-import gc
+import os
+import sys
+import json
 import time
+import random
+import shutil
+import logging
+import argparse
+import resource
+import platform
+import itertools
+import tempfile
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
-from binaps_data.main import main
-from binaps_data.utils.logs import set_logger
-# nbr_rows, nbr_feature, nbr_pattern, noise, split
-runs = [
-    #[1000, 1000, 10, 0.001, 50, " --no_intersections"],
-    # [10000, 1000, 10, 0.001, 50, " --no_intersections"],
-    # [100000, 1000, 10, 0.001, 50, " --no_intersections"],
-    # [10000, 10000, 10, 0.001, 50, " --no_intersections"],
-    # [100000, 10000, 10, 0.001, 50, " --no_intersections"],
-    # [100000, 100000, 10, 0.001, 50, " --no_intersections"],
-    # [1000, 1000, 10, 0.001, 50, " --no_intersections"],
-    # [100000, 100000, 500, 0.001, 50, " --no_intersections"],
-    # [1000, 1000, 10, 0.05, 50, " --no_intersections"],
-    # [100000, 100000, 500, 0.05, 50, " --no_intersections"],
-    # [1000, 1000, 10, 0.001, 75, " --no_intersections"],
-    # [100000, 100000, 500, 0.001, 75, " --no_intersections"],
-    [1000, 1000, 10, 0.001, 50, ""],
-    # [10000, 1000, 10, 0.001, 50, ""],
-    #[100000, 1000, 10, 0.001, 50, ""],
-    # [10000, 10000, 10, 0.001, 50, ""],
-    # [100000, 10000, 10, 0.001, 50, ""],
-    # [100000, 100000, 10, 0.001, 50, ""],
-    # [1000, 1000, 10, 0.001, 50, ""],
-    # [100000, 100000, 500, 0.001, 50, ""],
-    # [1000, 1000, 10, 0.05, 50, ""],
-    # [100000, 100000, 500, 0.05, 50, ""],
-    # [1000, 1000, 10, 0.001, 75, ""],
-    # [100000, 100000, 500, 0.001, 75, ""]
-]
+from binaps_data.pattern import PatternManager, PatternManagerWithCat
+from binaps_data.line import LineManager, LineManagerWithCat
 
+log = logging.getLogger('main')
 
-if __name__ == '__main__':
-    set_logger('./binaps_data/output/last_run.log', logging.DEBUG)
-    log = logging.getLogger('main')
-    for r in tqdm.tqdm(runs):
-        argument = f"-o ./binaps_data/output --nbr_of_rows {r[0]} --nbr_of_feature {r[1]} --nbr_pattern {r[2]} --noise {r[3]} " \
-                   f"--split {r[4]}{r[5]} --disable_tqdm"
-        main(argument.split())
-        time.sleep(1)
+STAGES = ("pattern", "lines", "save")
+MIN_WALL = 0.01  # stages faster than this (in seconds) are too noisy to be compared
+
+# default sweep: engine, data format, nbr_of_rows, nbr_of_feature, nbr_pattern, noise, split, no_intersections
+ENGINES = ["python", "numpy", "counter"]
+DATA_FORMATS = ["dat", "csr", "varint", "packed"]
+
+SWEEP = {
+    "engine": ENGINES,
+    "data_format": DATA_FORMATS,
+    "nbr_of_rows": [1000, 10000, 100000],
+    "nbr_of_feature": [1000, 10000],
+    "nbr_pattern": [10, 500],
+    "noise": [0.001, 0.05],
+    "split": [50, 75],
+    "no_intersections": [False, True],
+}
+
+QUICK_SWEEP = {
+    "engine": ENGINES,
+    "data_format": ["dat", "packed"],
+    "nbr_of_rows": [1000, 10000],
+    "nbr_of_feature": [1000],
+    "nbr_pattern": [10],
+    "noise": [0.001],
+    "split": [50],
+    "no_intersections": [False, True],
+}
+
+
+def _peak_rss() -> int:
+    """
+    Peak resident set size of the current process, in bytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # kilobytes on Linux
+
+
+def _files_size(files) -> int:
+    """
+    Total size of the output file(s) returned by a manager
+    """
+    if files is None:
+        return 0
+    if isinstance(files, str):
+        files = [files]
+    total = 0
+    for file in files:
+        total += os.path.getsize(file)
+        if file.endswith(".csr.json"):  # arrays of a CSR matrix are next to its header
+            prefix = file[:-len(".csr.json")]
+            total += sum(os.path.getsize(prefix + ext) for ext in (".indptr.bin", ".indices.bin"))
+    return total
+
+
+def run_config(config: dict, output_dir: str) -> dict:
+    """
+    Run the generation of one configuration stage by stage, the way main does, and measure each stage.
+    Meant to run inside a fresh process so the peak RSS only belongs to this configuration
+    :param config: one point of the sweep, see SWEEP, plus seed, max_size and categories_off
+    :param output_dir: directory for the generated files
+    :return: dict stage -> {wall, rows_per_s, bytes, bytes_per_s, peak_rss}
+    """
+    random.seed(config["seed"])
+    if config["categories_off"]:
+        pattern_manager = PatternManager(max_using_pattern=0)
+        line_manager = LineManager()
+        max_pat_line = min(config["max_pattern_on_a_line"], config["nbr_pattern"])
+    else:
+        pattern_manager = PatternManagerWithCat(max_using_pattern=0)
+        line_manager = LineManagerWithCat()
+        max_pat_line = min(config["max_pattern_on_a_line"], config["nbr_pattern"] / 2)
+
+    results = {}
+
+    start = time.perf_counter()
+    pattern_files = pattern_manager.compile_pattern(nbr_of_feature=config["nbr_of_feature"],
+                                                    nbr_pattern=config["nbr_pattern"],
+                                                    min_size=config["min_size"],
+                                                    max_size=config["max_size"],
+                                                    split=config["split"],
+                                                    output_dir=output_dir,
+                                                    no_intersections=config["no_intersections"],
+                                                    today="bench",
+                                                    disable_tqdm=True)
+    results["pattern"] = {"wall": time.perf_counter() - start, "rows": 0, "bytes": _files_size(pattern_files),
+                          "peak_rss": _peak_rss()}
+
+    # save_data is wrapped to split the time of the row loop and the time of the writing
+    save_data = line_manager.save_data
+    save = {}
+
+    def timed_save_data(*args, **kwargs):
+        save["peak_rss"] = _peak_rss()  # peak of the line generation, before writing starts
+        save_start = time.perf_counter()
+        files = save_data(*args, **kwargs)
+        save["wall"] = time.perf_counter() - save_start
+        return files
+
+    line_manager.save_data = timed_save_data
+    start = time.perf_counter()
+    data_files = line_manager.compile_lines(nbr_of_rows=config["nbr_of_rows"],
+                                            nbr_of_feature=config["nbr_of_feature"],
+                                            patterns_manager=pattern_manager,
+                                            max_pat_by_line=max_pat_line,
+                                            noise=config["noise"],
+                                            split=config["split"],
+                                            suffix="bench",
+                                            output_dir=output_dir,
+                                            disable_tqdm=True,
+                                            engine=config["engine"],
+                                            data_format=config["data_format"])
+    total = time.perf_counter() - start
+    results["lines"] = {"wall": total - save["wall"], "rows": config["nbr_of_rows"], "bytes": 0,
+                        "peak_rss": save["peak_rss"]}
+    results["save"] = {"wall": save["wall"], "rows": config["nbr_of_rows"], "bytes": _files_size(data_files),
+                       "peak_rss": _peak_rss()}
 
+    for stage in results.values():
+        stage["rows_per_s"] = stage["rows"] / stage["wall"] if stage["wall"] else 0.
+        stage["bytes_per_s"] = stage["bytes"] / stage["wall"] if stage["wall"] else 0.
+    results["density"] = line_manager.nbr_of_one / (config["nbr_of_feature"] * config["nbr_of_rows"])
+    return results
 
+
+def config_key(config: dict) -> str:
+    """
+    Name of a configuration, used to match runs between two result files
+    """
+    inter = "NO_INTER" if config["no_intersections"] else "INTER"
+    return f"{config['engine']}_{config['data_format']}_{config['nbr_of_rows']}_{config['nbr_of_feature']}_" \
+           f"{config['nbr_pattern']}_{config['noise']}_{config['split']}_{inter}"
+
+
+def run(args) -> dict:
+    """
+    Run every configuration of the sweep, each repetition in its own process
+    :return: results as saved in the JSON file
+    """
+    sweep = dict(QUICK_SWEEP if args.quick else SWEEP)
+    for name in sweep:
+        if getattr(args, name) is not None:
+            sweep[name] = getattr(args, name)
+
+    configs = [dict(zip(sweep, values)) for values in itertools.product(*sweep.values())]
+    configs = [dict(config, seed=args.seed, min_size=2, max_size=args.max_size, max_pattern_on_a_line=10,
+                    categories_off=args.categories_off) for config in configs]
+
+    report = {"date": datetime.datetime.now().isoformat(timespec='seconds'),
+              "python": platform.python_version(),
+              "machine": platform.machine(),
+              "repeat": args.repeat,
+              "runs": {}}
+    context = multiprocessing.get_context("spawn")
+    for i, config in enumerate(configs):
+        key = config_key(config)
+        repeats = []
+        for _ in range(args.repeat):
+            output_dir = tempfile.mkdtemp(prefix="binaps_bench_", dir=args.output_dir)
+            try:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    repeats.append(executor.submit(run_config, config, output_dir).result())
+            finally:
+                shutil.rmtree(output_dir, ignore_errors=True)
+        # keep the fastest repetition of each stage, the least disturbed by the machine
+        best = {stage: min((r[stage] for r in repeats), key=lambda s: s["wall"]) for stage in STAGES}
+        report["runs"][key] = {"config": config, "stages": best, "density": repeats[0]["density"]}
+        print(f"[{i + 1}/{len(configs)}] {key}: " +
+              ", ".join(f"{stage} {best[stage]['wall']:.3f}s" for stage in STAGES), flush=True)
+
+    with open(args.result, 'w') as fd:
+        json.dump(report, fd, indent=1)
+    print(f"Results saved to {args.result}")
+    return report
+
+
+def compare(args) -> int:
+    """
+    Compare a result file to a baseline and flag the stages that got slower (or heavier) than the threshold
+    :return: number of regressions found
+    """
+    with open(args.baseline) as fd:
+        baseline = json.load(fd)["runs"]
+    with open(args.result) as fd:
+        current = json.load(fd)["runs"]
+
+    regressions = 0
+    for key in sorted(set(baseline) & set(current)):
+        for stage in STAGES:
+            old, new = baseline[key]["stages"][stage], current[key]["stages"][stage]
+            for metric in ("wall", "peak_rss"):
+                if metric == "wall" and old[metric] < MIN_WALL and new[metric] < MIN_WALL:
+                    continue
+                ratio = new[metric] / old[metric] if old[metric] else float('inf')
+                flag = ""
+                if ratio > 1 + args.threshold:
+                    flag = "  REGRESSION"
+                    regressions += 1
+                elif ratio < 1 - args.threshold:
+                    flag = "  improvement"
+                if flag or args.verbose:
+                    print(f"{key} {stage} {metric}: {old[metric]:.4g} -> {new[metric]:.4g} ({ratio:.2f}x){flag}")
+    for key in sorted(set(baseline) ^ set(current)):
+        print(f"{key}: only inside {'the baseline' if key in baseline else 'the results'}")
+    print(f"{regressions} regression(s) over {args.threshold:.0%}")
+    return regressions
+
+
+def argument_parser(cp_args=None) -> argparse.Namespace:
+    """
+    Get argument from command line
+    :param cp_args: possible way to pass arguments to the parser
+    :return: [argparse.Namespace]
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the generation of synthetic data')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = sub.add_parser('run', help="Sweep configurations and save the measures to JSON")
+    run_parser.add_argument('--result', type=str, default="benchmark.json", help="Output JSON file")
+    run_parser.add_argument('-o', '--output_dir', type=str, default=None,
+                            help="Directory for the temporary generated files (system temp by default)")
+    run_parser.add_argument('--quick', action='store_true', default=False, help="Use a small sweep")
+    run_parser.add_argument('--repeat', type=int, default=3, help="Repetitions of each configuration, the fastest "
+                                                                  "one is kept")
+    run_parser.add_argument('--seed', type=int, default=0, help="Seed of every run")
+    run_parser.add_argument('--engine', type=str, nargs='+', default=None, choices=ENGINES)
+    run_parser.add_argument('--format', dest='data_format', type=str, nargs='+', default=None, choices=DATA_FORMATS)
+    run_parser.add_argument('--max_size', type=int, default=10, help="maximum pattern size")
+    run_parser.add_argument('--categories_off', action='store_true', default=False)
+    run_parser.add_argument('--nbr_of_rows', type=int, nargs='+', default=None)
+    run_parser.add_argument('--nbr_of_feature', type=int, nargs='+', default=None)
+    run_parser.add_argument('--nbr_pattern', type=int, nargs='+', default=None)
+    run_parser.add_argument('--noise', type=float, nargs='+', default=None)
+    run_parser.add_argument('--split', type=int, nargs='+', default=None)
+    run_parser.add_argument('--no_intersections', type=lambda s: s.lower() in ("1", "true", "yes"), nargs='+',
+                            default=None, help="Intersection modes to sweep, e.g. --no_intersections false true")
+
+    compare_parser = sub.add_parser('compare', help="Compare results to a baseline and flag regressions")
+    compare_parser.add_argument('baseline', type=str, help="Baseline JSON file")
+    compare_parser.add_argument('result', type=str, help="JSON file to check")
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help="Relative slowdown flagged as a regression (0.1 = 10%%)")
+    compare_parser.add_argument('--verbose', action='store_true', default=False, help="Print every measure")
+
+    return parser.parse_args(cp_args)
+
+
+if __name__ == '__main__':
+    args = argument_parser()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(1 if compare(args) else 0)
@@ -0,0 +1,12 @@
+from binaps_data.batch import run_batch
+
+
+def test_malformed_config_among_valid_ones(tmp_path):
+    configs = [{"nbr_of_rows": 100, "seed": 1, "disable_tqdm": True},
+               {"nbr_of_rows": "many", "disable_tqdm": True},
+               "--nbr_of_rows 100 --seed 2 --disable_tqdm"]
+    for workers in (1, 2):
+        results = run_batch(configs, str(tmp_path / f"workers_{workers}"), workers)
+        assert len(results) == 3
+        assert "error" not in results[0] and "error" not in results[2]
+        assert results[1] == {"error": "invalid arguments (exit code 2)"}
@@ -0,0 +1,42 @@
+import random
+
+import numpy as np
+
+from binaps_data.main import main
+from binaps_data.engine import CounterLineEngine, class_proportions
+from binaps_data.noise import make_noise_model
+from binaps_data.pattern import PatternManagerWithCat
+
+
+def _read_rows(file_name: str) -> list:
+    with open(file_name) as fd:
+        return [set(map(int, line.split())) for line in fd]
+
+
+def test_counter_truth_pattern_used(tmp_path):
+    # disjoint patterns without noise: a pattern is fully present inside a row only if it was inserted into it
+    config = main(['-o', str(tmp_path), '--engine', 'counter', '--ground_truth', '--noise', '0', '--no_intersections',
+                   '--nbr_of_rows', '2000', '--nbr_pattern', '20', '--seed', '3', '--disable_tqdm'])
+    patterns = _read_rows(config["pattern_file"][0])
+    rows = _read_rows(config["data_file"][0])
+    expected = [sum(pattern <= row for row in rows) for pattern in patterns]
+    truth = np.load(config["truth_file"])
+    assert truth["pattern_used"].tolist() == expected
+    assert truth["pattern_used_by_label"].sum() == sum(expected) > 0
+
+
+def test_counter_rows_on_their_own():
+    random.seed(5)
+    for noise_model, nbr_of_class in (("exact", 2), ("bernoulli", 2), ("feature", 2), ("exact", 5)):
+        manager = PatternManagerWithCat(0, class_proportions(nbr_of_class))
+        manager.create_patterns(500, 40, 2, 8, 50, False, True)
+        noise = make_noise_model(noise_model, 500, 0.02, np.linspace(0, 0.05, 500))
+        engine = CounterLineEngine(manager, 500, 5, noise, 50, 12345)
+        indptr, indices, labels = engine.generate_rows(0, 200)
+        for i in (0, 17, 199):
+            values, label = engine.generate_row(i)
+            assert values.tolist() == indices[indptr[i]:indptr[i + 1]].tolist()
+            assert label == labels[i]
+        tail = engine.generate_rows(120, 200)
+        assert tail[1].tolist() == indices[indptr[120]:].tolist()
+        assert tail[2].tolist() == labels[120:].tolist()
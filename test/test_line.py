@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from binaps_data.main import main
+
+
+def test_use_limit_split_between_workers(tmp_path):
+    config = main(['-o', str(tmp_path), '--engine', 'numpy', '--ground_truth', '--nbr_of_rows', '20000',
+                   '--nbr_pattern', '20', '--max_using_pattern', '100', '--workers', '4', '--seed', '1',
+                   '--disable_tqdm'])
+    assert np.load(config["truth_file"])["pattern_used"].max() == 101  # as a single process
+
+
+def test_use_limit_too_small_for_the_workers(tmp_path, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        main(['-o', str(tmp_path), '--max_using_pattern', '1', '--workers', '2'])
+    assert exit_info.value.code == 2
+    assert "can't be split between 2 workers" in capsys.readouterr().err
@@ -0,0 +1,30 @@
+import glob
+import os
+import tracemalloc
+
+import pytest
+
+from binaps_data.main import main
+
+
+def test_resume_complete_run(tmp_path, capsys):
+    # the second run ends before its first checkpoint is written
+    for nbr_of_rows, checkpoint_every in ((1000, 300), (200, 1000)):
+        output_dir = str(tmp_path / f"rows_{nbr_of_rows}")
+        os.makedirs(output_dir)
+        main(['-o', output_dir, '--nbr_of_rows', str(nbr_of_rows), '--checkpoint_every', str(checkpoint_every),
+              '--seed', '1', '--disable_tqdm'])
+        config_file, = glob.glob(os.path.join(output_dir, "config_*.json"))
+        with pytest.raises(SystemExit) as exit_info:
+            main(['--resume', config_file])
+        assert exit_info.value.code == 2
+        assert "already complete, nothing to resume" in capsys.readouterr().err
+
+
+def test_profile_stopped_when_the_run_fails(tmp_path):
+    # the 'feature' noise model fails without noise rates, once the profile is started
+    with pytest.raises(ValueError):
+        main(['-o', str(tmp_path), '--nbr_of_rows', '100', '--noise_model', 'feature', '--profile', 'mem',
+              '--disable_tqdm'])
+    assert not tracemalloc.is_tracing()
+    assert glob.glob(os.path.join(str(tmp_path), "profile_mem_*.txt"))
@@ -0,0 +1,65 @@
+import random
+
+import numpy as np
+
+from binaps_data.engine import class_proportions
+from binaps_data.pattern import Category, Pattern, PatternManagerWithCat, PatternPool, PatternTable, PatternValueDealer
+
+
+def test_patterns_of_many_classes():
+    random.seed(2)
+    manager = PatternManagerWithCat(0, class_proportions(4))
+    manager.create_patterns(200, 40, 2, 6, 50, False, True)
+    labels = set()
+    for pattern in manager.patterns:
+        assert repr(pattern) == f"PATTERN.cat-{pattern.label}.{pattern.values}"
+        assert pattern == Pattern(pattern.values, pattern.label)
+        assert pattern.to_write_label() == str(int(pattern.label))
+        labels.add(pattern.label)
+    assert labels == {Category.CAT0, Category.CAT1, 2, 3}
+    assert manager.patterns[0] == manager.patterns[0]
+    assert manager.patterns[0] != Pattern(manager.patterns[0].values, 3 if manager.patterns[0].label != 3 else 2)
+
+
+def test_disjoint_values_cover_the_features_once():
+    random.seed(3)
+    dealer = PatternValueDealer(1000, no_intersections=True)
+    values = []
+    for sizes in ([3, 7], [1], [], [0, 40], [949]):
+        for part, size in zip(dealer.get_val_batch(sizes), sizes):
+            assert len(part) == size
+            values += part
+    assert dealer.remaining == 0
+    assert sorted(values) == list(range(1, 1001))
+    assert sorted(dealer.val.tolist()) == list(range(1, 1001))
+
+
+def test_disjoint_values_touch_only_the_values_picked():
+    random.seed(4)
+    dealer = PatternValueDealer(100000, no_intersections=True)
+    for sizes in ([5], [2, 8], [30]):
+        before = dealer.val.copy()
+        dealer.get_val_batch(sizes)
+        assert np.count_nonzero(dealer.val != before) <= 2 * sum(sizes)  # each pick swaps two positions
+
+
+def test_limited_pool_sample_batch():
+    # 12 patterns of 2 values, each one retired once used more than once
+    table = PatternTable(np.arange(1, 25), np.arange(0, 25, 2))
+    pool = PatternPool(table, limit=1)
+    rng = np.random.default_rng(7)
+    nbr_pattern = rng.integers(1, 5, 40)
+    rows, ids = pool.sample_batch(rng, nbr_pattern)
+
+    assert np.all(np.diff(rows) >= 0)
+    used = np.zeros(len(table), dtype=np.int64)
+    for row in range(len(nbr_pattern)):
+        picked = ids[rows == row]
+        assert len(np.unique(picked)) == len(picked)
+        assert len(picked) == min(nbr_pattern[row], np.count_nonzero(used <= pool.limit))
+        assert np.all(used[picked] <= pool.limit)  # a retired pattern is never drawn again
+        used[picked] += 1
+    assert used.max() <= pool.limit + 1
+    assert table.used.tolist() == used.tolist() == np.bincount(ids, minlength=len(table)).tolist()
+    assert sorted(pool.live[:pool.count].tolist()) == np.flatnonzero(used <= pool.limit).tolist()
+    assert pool.count == 0  # 40 rows use up the 24 uses of the pool
@@ -0,0 +1,64 @@
+import bz2
+import gzip
+import lzma
+
+import numpy as np
+import pytest
+
+from binaps_data import compress
+from binaps_data.compress import compressed_name, open_output
+from binaps_data.reader import open_input, parse_varint_rows, read_varint
+from binaps_data.writer import VarintWriter, encode_varint_rows, lines_to_csr
+
+MEMBER_MAGIC = {"gzip": b'\x1f\x8b\x08', "bz2": b'BZh', "xz": b'\xfd7zXZ\x00'}
+
+# empty rows at the start, inside and at the end, deltas of one to several varint bytes
+LINES = [[], [1, 2, 3], [], [5, 5 + 2 ** 14, 5 + 2 ** 14 + 2 ** 21], [2 ** 14], [127, 128, 16511, 16512], [2 ** 40],
+         []]
+
+
+def test_varint_round_trip():
+    indptr, indices = lines_to_csr(LINES, np.int64)
+    data = encode_varint_rows(indptr, indices)
+    assert len(encode_varint_rows(*lines_to_csr([[2 ** 14]], np.int64))) == 3 + 1  # 3 bytes then the end of row
+    decoded_indptr, decoded_indices = parse_varint_rows(data)
+    assert decoded_indptr.tolist() == np.asarray(indptr).tolist()
+    assert decoded_indices.tolist() == np.asarray(indices).tolist()
+    assert parse_varint_rows(encode_varint_rows(*lines_to_csr([[], []], np.int64)))[0].tolist() == [0, 0, 0]
+
+
+@pytest.mark.parametrize("method", ["gzip", "bz2", "xz"])
+def test_compressed_file_of_several_members(tmp_path, monkeypatch, method):
+    monkeypatch.setattr(compress, "COMPRESS_BLOCK_SIZE", 64)  # one member every 64 bytes
+    file = compressed_name(str(tmp_path / "data.txt"), method)
+    text = ''.join(f"{i} {i * 7} {i * 13}\n" for i in range(500))
+    descriptor = open_output(file, 'w', method)
+    for start in range(0, len(text), 50):
+        descriptor.write(text[start:start + 50])
+    descriptor.close()
+    with open(file, 'rb') as fd:
+        assert fd.read().count(MEMBER_MAGIC[method]) > 10
+    with open_input(file, 'rt') as fd:
+        assert fd.read() == text
+    opener = {"gzip": gzip.open, "bz2": bz2.open, "xz": lzma.open}[method]
+    with opener(file, 'rt') as fd:
+        assert fd.read() == text
+
+
+@pytest.mark.parametrize("method", ["gzip", None])
+def test_varint_file_appended_after_resume(tmp_path, method):
+    data_file = compressed_name(str(tmp_path / "data.vint"), method)
+    label_file = compressed_name(str(tmp_path / "data.label.bin"), method)
+    writer = VarintWriter(data_file, label_file, compress=method)
+    writer.write(LINES[:4], [0, 1, 0, 1])
+    state = writer.checkpoint()
+    writer.write([[9, 10]] * 3, [1] * 3)  # written after the checkpoint, lost by the interruption
+    writer.close()
+
+    writer = VarintWriter(data_file, label_file, compress=method, resume=state)
+    writer.write(LINES[4:], [1, 0, 1, 0])
+    writer.close()
+    indptr, indices = read_varint(data_file)
+    assert [indices[a:b].tolist() for a, b in zip(indptr[:-1], indptr[1:])] == LINES
+    with open_input(label_file) as fd:
+        assert np.frombuffer(fd.read(), dtype=np.uint8).tolist() == [0, 1, 0, 1, 1, 0, 1, 0]
@@ -0,0 +1,157 @@
+import logging
+
+import numpy as np
+
+log = logging.getLogger('main')
+
+TRUTH_EXTENSION = ".truth.npz"
+ROW_PATTERNS_EXTENSION = ".patterns.csr.json"
+TRUTH_ARRAYS = ("feature_count", "label_rows", "patterns_by_row", "pattern_used")
+
+
+class GroundTruth:
+    """
+    Ground truth of a dataset counted while its lines are generated, so the data doesn't have to be read again to
+    evaluate pattern mining. Counters are numpy arrays updated by chunk of lines
+
+        feature_count   : number of rows holding each feature, feature_count[j] for the feature j (0 is unused)
+        label_rows      : number of rows of each label
+        patterns_by_row : patterns_by_row[k] is the number of rows made from k patterns
+        pattern_used    : number of rows each pattern was inserted into, set once the lines are generated
+    """
+
+    def __init__(self, nbr_of_feature: int, max_pat_by_line: int, nbr_of_class: int = 2):
+        self.feature_count = np.zeros(nbr_of_feature + 1, dtype=np.int64)
+        self.label_rows = np.zeros(nbr_of_class, dtype=np.int64)
+        self.patterns_by_row = np.zeros(int(max_pat_by_line) + 2, dtype=np.int64)
+        self.pattern_used = np.zeros(0, dtype=np.int64)
+
+    def add_lines(self, indices, labels):
+        """
+        Count a chunk of lines
+        :param indices: 1-based features of all the lines (CSR indices)
+        :param labels: label of each line
+        """
+        self.feature_count += np.bincount(np.asarray(indices, dtype=np.int64), minlength=len(self.feature_count))
+        self.label_rows += np.bincount(np.asarray(labels, dtype=np.int64), minlength=len(self.label_rows))
+
+    def add_patterns_by_row(self, counts):
+        """
+        Count the number of patterns of a batch of rows
+        :param counts: number of patterns inserted into each row
+        """
+        self.patterns_by_row += np.bincount(counts, minlength=len(self.patterns_by_row))
+
+    def get_state(self) -> dict:
+        """
+        :return: dict of the counters, to checkpoint a run or send them from a worker process
+        """
+        return {f"truth_{name}": getattr(self, name) for name in TRUTH_ARRAYS}
+
+    def set_state(self, state: dict):
+        for name in TRUTH_ARRAYS:
+            setattr(self, name, np.array(state[f"truth_{name}"], dtype=np.int64))
+
+    def update(self, state: dict):
+        """
+        Sum the counters of another GroundTruth, given by get_state (e.g. a shard generated by a worker)
+        """
+        for name in TRUTH_ARRAYS:
+            other = state[f"truth_{name}"]
+            mine = getattr(self, name)
+            if len(mine) < len(other):
+                mine = np.concatenate([mine, np.zeros(len(other) - len(mine), dtype=np.int64)])
+            mine[:len(other)] += other
+            setattr(self, name, mine)
+
+    def save(self, truth_file: str, pattern_labels) -> str:
+        """
+        Save the counters as a .npz sidecar, with the rows each pattern was inserted into split by label: a pattern
+        is only used by the rows of its own label (all rows without categories, kept in the first column). This
+        (patterns x labels) matrix is left out with more than two classes, pattern_used and pattern_labels give it
+        :param truth_file: output file
+        :param pattern_labels: label of each pattern (PatternTable.labels)
+        :return: output file
+        """
+        pattern_labels = np.asarray(pattern_labels)
+        arrays = {name: getattr(self, name) for name in TRUTH_ARRAYS}
+        if len(self.label_rows) <= 2:
+            columns = np.where(pattern_labels < len(self.label_rows), pattern_labels, 0).astype(np.int64)
+            pattern_used_by_label = np.zeros((len(pattern_labels), len(self.label_rows)), dtype=np.int64)
+            pattern_used_by_label[np.arange(len(pattern_labels)), columns] = self.pattern_used[:len(pattern_labels)]
+            arrays["pattern_used_by_label"] = pattern_used_by_label
+        arrays["pattern_labels"] = pattern_labels
+        with open(truth_file, 'wb') as fd:
+            np.savez(fd, **arrays)
+        log.info(f"Ground truth saved to {truth_file}")
+        return truth_file
+
+
+class PatternIndex:
+    """
+    Inverted index of the patterns, from each feature to the patterns holding it, built once from the pattern table.
+    It finds the patterns fully present inside rows without testing every pattern against every row: each feature of
+    a row votes for its patterns and a pattern is present when all its features voted, so the cost follows the
+    length of the rows (times the number of patterns by feature) instead of the number of patterns
+
+        indptr      : the patterns holding the feature j are pattern_ids[indptr[j]:indptr[j+1]]
+        pattern_ids : pattern ids sorted by feature
+        sizes       : number of features of each pattern
+    """
+
+    def __init__(self, values, offsets, nbr_of_feature: int):
+        """
+        :param values: concatenated 1-based features of the patterns (PatternTable.values)
+        :param offsets: features of the pattern i are values[offsets[i]:offsets[i+1]]
+        """
+        values = np.asarray(values, dtype=np.int64)
+        self.nbr_of_feature = nbr_of_feature
+        self.sizes = np.diff(np.asarray(offsets, dtype=np.int64))
+        ids = np.repeat(np.arange(len(self.sizes)), self.sizes)
+        self.pattern_ids = ids[np.argsort(values, kind='stable')]
+        self.indptr = np.zeros(nbr_of_feature + 2, dtype=np.int64)
+        np.cumsum(np.bincount(np.clip(values, 0, nbr_of_feature + 1), minlength=nbr_of_feature + 2)[:-1],
+                  out=self.indptr[1:])
+
+    @classmethod
+    def from_table(cls, table, nbr_of_feature: int):
+        """
+        Build the index of a PatternTable
+        """
+        return cls(table.values, table.offsets, nbr_of_feature)
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def find(self, indptr, indices) -> tuple:
+        """
+        Find the patterns fully present inside each row, whether they were inserted and survived the noise or were
+        made by accident by the noise and the other patterns
+        :param indptr: lines[i] is indices[indptr[i]:indptr[i+1]]
+        :param indices: 1-based features, distinct inside each line (features outside [1, nbr_of_feature] are
+            ignored)
+        :return: (rows, pattern ids) flat arrays, sorted by row then by pattern
+        """
+        indptr = np.asarray(indptr, dtype=np.int64)
+        indices = np.asarray(indices, dtype=np.int64)
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        in_range = (indices >= 1) & (indices <= self.nbr_of_feature)
+        features = indices[in_range]
+        counts = self.indptr[features + 1] - self.indptr[features]
+        starts = np.repeat(self.indptr[features] - np.cumsum(counts) + counts, counts)
+        pairs = np.repeat(rows[in_range], counts) * len(self) + self.pattern_ids[starts + np.arange(counts.sum())]
+        pairs, votes = np.unique(pairs, return_counts=True)
+        if len(self):
+            pairs = pairs[votes == self.sizes[pairs % len(self)]]
+        return pairs // max(len(self), 1), pairs % max(len(self), 1)
+
+    def annotate(self, indptr, indices) -> tuple:
+        """
+        Patterns fully present inside each row, as CSR arrays
+        :return: (indptr, pattern ids), the patterns of the row i are pattern_ids[indptr[i]:indptr[i+1]]
+        """
+        nbr_of_rows = len(indptr) - 1
+        rows, ids = self.find(indptr, indices)
+        row_ptr = np.zeros(nbr_of_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=nbr_of_rows), out=row_ptr[1:])
+        return row_ptr, ids
@@ -0,0 +1,98 @@
+import time
+import logging
+import contextlib
+
+log = logging.getLogger('main')
+
+PROFILES = ("cpu", "mem")
+TOP_ALLOCATIONS = 50  # number of allocation sites kept inside the memory report
+
+
+class Stats:
+    """
+    Stage timers and counters of a run, cheap enough to stay always on (one perf_counter call by timed section)
+        timings  : seconds spent inside each stage, summed over calls
+        counters : numbers counted along the run (rows generated, noise flips, ...)
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        """
+        Add the time spent inside the with block to the stage
+        :param name: name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float):
+        self.timings[name] = self.timings.get(name, 0.) + seconds
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def update(self, other: dict):
+        """
+        Sum the timings and counters of another Stats, given by to_dict (e.g. sent back by a worker process)
+        """
+        for name, seconds in other["timings"].items():
+            self.add_time(name, seconds)
+        for name, value in other["counters"].items():
+            self.count(name, value)
+
+    def to_dict(self) -> dict:
+        return {"timings": dict(self.timings), "counters": dict(self.counters)}
+
+
+def start_profile(profile: str):
+    """
+    Start profiling the run
+    :param profile: 'cpu' for cProfile, 'mem' for tracemalloc, None to not profile
+    :return: profiler to give to stop_profile
+    """
+    if profile == "cpu":
+        import cProfile  # profilers are only imported when asked, to keep the startup short
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    if profile == "mem":
+        import tracemalloc
+        tracemalloc.start()
+    return None
+
+
+def stop_profile(profile: str, profiler, output_file: str) -> list:
+    """
+    Stop profiling and save the reports
+    :param profile: 'cpu', 'mem' or None, as given to start_profile
+    :param profiler: profiler returned by start_profile
+    :param output_file: path of the reports without extension
+    :return: list of the report files
+    """
+    if profile == "cpu":
+        import pstats
+        profiler.disable()
+        profiler.dump_stats(output_file + ".prof")  # readable by pstats, snakeviz, ...
+        with open(output_file + ".txt", 'w') as fd:
+            pstats.Stats(profiler, stream=fd).sort_stats("cumulative").print_stats()
+        log.info(f"CPU profile saved to {output_file}.prof")
+        return [output_file + ".prof", output_file + ".txt"]
+    if profile == "mem":
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        with open(output_file + ".txt", 'w') as fd:
+            fd.write(f"Traced memory: current {current} bytes, peak {peak} bytes\n")
+            fd.write(f"Top {TOP_ALLOCATIONS} allocation sites:\n")
+            for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                fd.write(f"{stat}\n")
+        log.info(f"Memory profile saved to {output_file}.txt")
+        return [output_file + ".txt"]
+    return []
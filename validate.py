@@ -0,0 +1,235 @@
+import os
+import mmap
+import json
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from binaps_data.utils.logs import set_logger
+from binaps_data.reader import parse_lines, open_input, find_config, SCAN_SIZE
+from binaps_data.truth import PatternIndex
+
+log = logging.getLogger('main')
+
+_scan = {}  # memory maps and pattern index of a worker process, see _init_scan_worker
+
+
+def split_at_lines(data, chunk_bytes: int) -> list:
+    """
+    Split a memory-mapped file in chunks of about chunk_bytes ending on a newline
+    :param data: mmap (or bytes)
+    :return: list of (start, end) offsets
+    """
+    bounds = [0]
+    while bounds[-1] < len(data):
+        end = data.find(b'\n', bounds[-1] + chunk_bytes - 1)
+        bounds.append(len(data) if end < 0 else end + 1)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def read_patterns(pattern_file: str) -> list:
+    """
+    Read a pattern_*.txt file (compressed or not)
+    :return: list of int arrays, the features of each pattern
+    """
+    with open_input(pattern_file) as fd:
+        text = fd.read()
+    return [np.array(line.split(), dtype=np.int64) for line in text.splitlines()]
+
+
+def pattern_index(patterns: list, nbr_of_feature: int) -> PatternIndex:
+    """
+    Inverted index of the patterns, to find the patterns of each feature
+    :param patterns: features of each pattern, see read_patterns
+    """
+    offsets = np.zeros(len(patterns) + 1, dtype=np.int64)
+    np.cumsum([len(p) for p in patterns], out=offsets[1:])
+    values = np.concatenate(patterns) if patterns else np.empty(0, dtype=np.int64)
+    return PatternIndex(values, offsets, nbr_of_feature)
+
+
+def _init_scan_worker(data_file: str, label_file: str, nbr_of_feature: int, index: PatternIndex,
+                      nbr_of_class: int = 2):
+    for name, file in (("data", data_file), ("labels", label_file)):
+        if file and os.path.getsize(file):
+            with open(file, 'rb') as fd:
+                _scan[name] = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    _scan["nbr_of_feature"] = nbr_of_feature
+    _scan["nbr_of_class"] = nbr_of_class
+    _scan["index"] = index
+
+
+def _scan_data(bounds: tuple) -> dict:
+    """
+    Scan a chunk of lines
+    :param bounds: (start, end) offsets of the chunk inside the .dat file
+    :return: partial report, see merge_reports
+    """
+    start, end = bounds
+    nbr_of_feature = _scan["nbr_of_feature"]
+    indptr, indices = parse_lines(_scan["data"][start:end])
+    nbr_of_rows = len(indptr) - 1
+    rows = np.repeat(np.arange(nbr_of_rows), np.diff(indptr))
+    # a row is sorted if each index is greater than the previous one of the same row
+    unsorted = rows[1:][(np.diff(indices) <= 0) & (rows[1:] == rows[:-1])]
+    in_range = (indices >= 1) & (indices <= nbr_of_feature)
+
+    index = _scan["index"]
+    present = index.find(indptr, indices)[1]  # pattern of each (row, pattern) pair where the pattern is present
+
+    return {"nbr_of_rows": nbr_of_rows,
+            "nbr_of_one": len(indices),
+            "empty_rows": int(np.count_nonzero(np.diff(indptr) == 0)),
+            "unsorted_rows": len(np.unique(unsorted)),
+            "out_of_range": int(np.count_nonzero(~in_range)),
+            "min_index": int(indices.min()) if len(indices) else None,
+            "max_index": int(indices.max()) if len(indices) else None,
+            "feature_count": np.bincount(indices[in_range], minlength=nbr_of_feature + 1),
+            "pattern_rows": np.bincount(present, minlength=len(index))}
+
+
+def _scan_labels(bounds: tuple) -> dict:
+    """
+    Scan a chunk of labels
+    :param bounds: (start, end) offsets of the chunk inside the .label file
+    """
+    start, end = bounds
+    labels = parse_lines(_scan["labels"][start:end])[1]
+    valid = (labels >= 0) & (labels < _scan["nbr_of_class"])
+    return {"label_rows": np.bincount(labels[valid], minlength=_scan["nbr_of_class"]),
+            "invalid_labels": int(np.count_nonzero(~valid))}
+
+
+def merge_reports(reports: list) -> dict:
+    """
+    Merge the partial reports of the chunks: counts are summed, index bounds are reduced
+    """
+    merged = {}
+    for report in reports:
+        for name, value in report.items():
+            if value is None:
+                continue
+            if name not in merged or merged[name] is None:
+                merged[name] = value
+            elif name == "min_index":
+                merged[name] = min(merged[name], value)
+            elif name == "max_index":
+                merged[name] = max(merged[name], value)
+            else:
+                merged[name] = merged[name] + value
+    return merged
+
+
+def validate(data_file: str, label_file: str = None, config_file: str = None, pattern_file: str = None,
+             nbr_of_feature: int = None, workers: int = None, chunk_bytes: int = SCAN_SIZE) -> dict:
+    """
+    Scan a .dat file (and its .label file) in parallel and check it against the config of the run
+    :param data_file: .dat file, not compressed (it is memory-mapped)
+    :param label_file: .label file, by default the one next to the .dat file if it exists
+    :param config_file: config_*.json of the run, by default the one of the same date next to the .dat file
+    :param pattern_file: pattern_*.txt file, by default the one of the config
+    :param nbr_of_feature: number of features, by default the one of the config
+    :param workers: number of worker processes, by default the number of CPUs
+    :param chunk_bytes: size of the chunks of the file given to the workers
+    :return: report, with the list of failed checks inside "errors" and of suspicious values inside "warnings"
+    """
+    prefix = data_file[:-len(".dat")] if data_file.endswith(".dat") else data_file
+    if label_file is None and os.path.exists(prefix + ".label"):
+        label_file = prefix + ".label"
+    config_file = config_file or find_config(data_file)
+    config = None
+    if config_file:
+        with open(config_file) as fd:
+            config = json.load(fd)
+    if pattern_file is None and config:
+        pattern_file = config["pattern_file"] if isinstance(config["pattern_file"], str) else config["pattern_file"][0]
+    if nbr_of_feature is None:
+        if not config:
+            raise ValueError("Arguments can't be followed: the number of features is needed without config")
+        nbr_of_feature = config["nbr_of_feature"]
+    patterns = read_patterns(pattern_file) if pattern_file else []
+    nbr_of_class = config.get("nbr_of_class", 2) if config else 2
+    log.info(f"Validating {data_file} with {len(patterns)} patterns")
+
+    tasks = []
+    for file, scan in ((data_file, _scan_data), (label_file, _scan_labels)):
+        if file and os.path.getsize(file):
+            with open(file, 'rb') as fd, mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                tasks.extend((scan, bounds) for bounds in split_at_lines(data, chunk_bytes))
+    index = pattern_index(patterns, nbr_of_feature)
+    with ProcessPoolExecutor(workers, initializer=_init_scan_worker,
+                             initargs=(data_file, label_file, nbr_of_feature, index, nbr_of_class)) as executor:
+        futures = [executor.submit(scan, bounds) for scan, bounds in tasks]
+        report = merge_reports([future.result() for future in futures])
+
+    report = dict({"nbr_of_rows": 0, "nbr_of_one": 0, "empty_rows": 0, "unsorted_rows": 0, "out_of_range": 0,
+                   "min_index": None, "max_index": None}, **report)
+    report.update(data_file=data_file, label_file=label_file, config_file=config_file, pattern_file=pattern_file,
+                  nbr_of_feature=nbr_of_feature)
+    report["density"] = report["nbr_of_one"] / (nbr_of_feature * report["nbr_of_rows"]) if report["nbr_of_rows"] \
+        else 0.
+    feature_count = report.pop("feature_count", np.zeros(nbr_of_feature + 1, dtype=np.int64))
+    report["unused_features"] = int(np.count_nonzero(feature_count[1:] == 0))
+    pattern_rows = report.pop("pattern_rows", np.zeros(len(patterns), dtype=np.int64))
+    report["pattern_rows"] = pattern_rows.tolist()
+    report["absent_patterns"] = np.flatnonzero(pattern_rows == 0).tolist()
+    if "label_rows" in report:
+        report["label_rows"] = report["label_rows"].tolist()
+    _check(report, config)
+    return report
+
+
+def _check(report: dict, config: dict):
+    """
+    Fill the errors and warnings of a report
+    """
+    errors = []
+    warnings = []
+    if report["out_of_range"]:
+        errors.append(f"{report['out_of_range']} indices outside [1, {report['nbr_of_feature']}]")
+    if report["unsorted_rows"]:
+        errors.append(f"{report['unsorted_rows']} rows not strictly increasing")
+    if report.get("invalid_labels"):
+        errors.append(f"{report['invalid_labels']} labels outside [0, {len(report['label_rows']) - 1}]")
+    nbr_of_labels = sum(report.get("label_rows", [])) + report.get("invalid_labels", 0)
+    if "label_rows" in report and nbr_of_labels != report["nbr_of_rows"]:
+        errors.append(f"{nbr_of_labels} labels for {report['nbr_of_rows']} rows")
+    if report["absent_patterns"]:
+        warnings.append(f"{len(report['absent_patterns'])} patterns never fully present")
+    if config:
+        if report["nbr_of_rows"] != config["nbr_of_rows"]:
+            errors.append(f"{report['nbr_of_rows']} rows, the config asked for {config['nbr_of_rows']}")
+        if "density" in config and not np.isclose(report["density"], config["density"]):
+            errors.append(f"density {report['density']}, the config recorded {config['density']}")
+        if "label_rows" in report and report["nbr_of_rows"] and not config.get("class_proportions") \
+                and config.get("nbr_of_class", 2) == 2:
+            share = report["label_rows"][0] / report["nbr_of_rows"]
+            if abs(share - config["split"] / 100) > 4 * np.sqrt(0.25 / report["nbr_of_rows"]) + 0.01:
+                warnings.append(f"{share:.2%} of rows with label 0, the config asked for {config['split']}%")
+    report["errors"] = errors
+    report["warnings"] = warnings
+
+
+if __name__ == "__main__":
+    log = set_logger()
+    parser = argparse.ArgumentParser(description='Validate a synthetic .dat file and check it against its config')
+    parser.add_argument('data_file', type=str, help=".dat file")
+    parser.add_argument('--label', type=str, default=None, help=".label file, by default the one next to the data")
+    parser.add_argument('--config', type=str, default=None,
+                        help="config_*.json of the run, by default the one of the same date next to the data")
+    parser.add_argument('--patterns', type=str, default=None, help="pattern_*.txt file, by default the config one")
+    parser.add_argument('--nbr_of_feature', type=int, default=None,
+                        help="Number of features, by default the config one")
+    parser.add_argument('--workers', type=int, default=None, help="Number of processes, by default the number of CPUs")
+    parser.add_argument('--chunk_bytes', type=int, default=SCAN_SIZE, help="Size of the chunks scanned by a process")
+    parser.add_argument('--report', type=str, default=None, help="JSON file to save the report to")
+    args = parser.parse_args()
+    result = validate(args.data_file, args.label, args.config, args.patterns, args.nbr_of_feature, args.workers,
+                      args.chunk_bytes)
+    if args.report:
+        with open(args.report, 'w') as fd:
+            json.dump(result, fd, indent=1)
+    print(json.dumps({name: value for name, value in result.items() if name != "pattern_rows"}, indent=1))
+    raise SystemExit(1 if result["errors"] else 0)
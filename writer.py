@@ -0,0 +1,703 @@
+import os
+import json
+import queue
+import shutil
+import threading
+import logging
+import itertools
+
+import numpy as np
+
+from binaps_data.compress import open_output
+
+log = logging.getLogger('main')
+
+CSR_INDPTR_DTYPE = '<u8'
+CSR_INDICES_DTYPE = '<u4'
+CSR_LABEL_DTYPE = '<u1'
+WRITE_QUEUE_SIZE = 4  # number of formatted chunks waiting for the writer thread
+
+
+class DatWriter:
+    """
+    Write lines to a .dat file (and their labels to a .label file) chunk by chunk, so lines don't have to be kept
+    in memory until the end of the generation
+
+        data_file    : output file for the lines, one line of 1-based column indices separated by a space per row
+        label_file   : output file for the labels, None to not save labels
+        nbr_of_bytes : number of bytes written so far (before compression)
+    """
+    extension = ".dat"
+    label_extension = ".label"
+
+    def __init__(self, data_file: str, label_file: str = None, compress: str = None, resume: dict = None,
+                 nbr_of_feature: int = 0, label_dtype: str = CSR_LABEL_DTYPE):
+        """
+        :param resume: state given by checkpoint, to continue writing files of an interrupted run
+        :param nbr_of_feature: number of features, unused as lines are written as indices
+        :param label_dtype: unused as labels are written as text
+        """
+        self.data_file = data_file
+        self.label_file = label_file
+        offsets = resume["offsets"] if resume else [None, None]
+        self.data_descriptor = open_output(data_file, 'w', compress, offsets[0])
+        self.label_descriptor = open_output(label_file, 'w', compress, offsets[1]) if label_file else None
+        self.nbr_of_bytes = resume["nbr_of_bytes"] if resume else 0
+
+    def write(self, lines: list, labels: list):
+        """
+        Write a chunk of lines
+        :param lines: list of sorted list of int
+        :param labels: label of each line
+        """
+        self.write_formatted(self.format(lines, labels))
+
+    def write_csr(self, indptr, indices, labels):
+        """
+        Write a chunk of lines given as CSR arrays
+        :param indptr: lines[i] is indices[indptr[i]:indptr[i+1]] (indptr[0] is 0)
+        :param indices: 1-based column indices
+        :param labels: label of each line
+        """
+        self.write_formatted(self.format_csr(indptr, indices, labels))
+
+    def format(self, lines: list, labels: list) -> tuple:
+        """
+        Format a chunk of lines, without writing it (see BackgroundWriter)
+        :return: (text of the lines, text of the labels or None)
+        """
+        data = ''.join([' '.join(map(str, line)) + '\n' for line in lines])
+        label_data = ''.join([str(label) + '\n' for label in labels]) if self.label_descriptor else None
+        return data, label_data
+
+    def format_csr(self, indptr, indices, labels) -> tuple:
+        """
+        Format a chunk of lines given as CSR arrays, without writing it
+        """
+        flat = list(map(str, np.asarray(indices).tolist()))
+        bounds = np.asarray(indptr).tolist()
+        data = ''.join([' '.join(flat[a:b]) + '\n' for a, b in zip(bounds[:-1], bounds[1:])])
+        label_data = ''.join([label + '\n' for label in map(str, np.asarray(labels).tolist())]) \
+            if self.label_descriptor else None
+        return data, label_data
+
+    def write_formatted(self, chunk: tuple):
+        """
+        Write a chunk returned by format
+        """
+        data, label_data = chunk
+        self.data_descriptor.write(data)
+        self.nbr_of_bytes += len(data)  # only ASCII characters
+        if label_data is not None:
+            self.label_descriptor.write(label_data)
+            self.nbr_of_bytes += len(label_data)
+
+    def checkpoint(self) -> dict:
+        """
+        Write everything to disk
+        :return: state to give back to the constructor to continue writing the files from this point
+        """
+        return {"offsets": _flush_files([self.data_descriptor, self.label_descriptor],
+                                        [self.data_file, self.label_file]),
+                "nbr_of_bytes": self.nbr_of_bytes}
+
+    def close(self):
+        self.data_descriptor.close()
+        if self.label_descriptor:
+            self.label_descriptor.close()
+
+    @staticmethod
+    def merge(shard_files: list, data_file: str, label_file: str = None):
+        """
+        Merge files written by several writers, in order, and remove them
+        :param shard_files: list of (data file, label file) of each writer
+        :param data_file: merged data file
+        :param label_file: merged label file, None if labels are not saved
+        """
+        # compressed shards are multi-member streams, so they are merged by concatenation as well
+        for i, file in enumerate((data_file, label_file)):
+            if file is None:
+                continue
+            with open(file, 'wb') as fd:
+                for shard in shard_files:
+                    with open(shard[i], 'rb') as shard_fd:
+                        shutil.copyfileobj(shard_fd, fd)
+                    os.remove(shard[i])
+
+
+class CsrWriter:
+    """
+    Write lines as a binary CSR matrix chunk by chunk: raw little-endian arrays that can be np.memmap without parsing
+        - <prefix>.indptr.bin  : uint64, lines[i] is indices[indptr[i]:indptr[i+1]]
+        - <prefix>.indices.bin : uint32, 1-based column indices, sorted inside each line
+        - <prefix>.label.bin   : uint8 (wider with more than 256 classes), label of each line (only if labels are saved)
+    and a small JSON header <prefix>.csr.json giving shape, dtypes, index base and array files
+
+        data_file    : output header file
+        label_file   : output file for the labels, None to not save labels
+        nbr_of_bytes : number of bytes of arrays written so far
+    """
+    extension = ".csr.json"
+    label_extension = ".label.bin"
+
+    def __init__(self, data_file: str, label_file: str = None, compress: str = None, resume: dict = None,
+                 nbr_of_feature: int = 0, label_dtype: str = CSR_LABEL_DTYPE):
+        """
+        :param resume: state given by checkpoint, to continue writing files of an interrupted run
+        :param nbr_of_feature: number of features, unused as lines are written as indices
+        :param label_dtype: dtype of the labels, see label_dtype
+        """
+        if compress:
+            raise ValueError("Arguments can't be followed: csr arrays are memory-mapped and can't be compressed")
+        self.data_file = data_file
+        self.label_file = label_file
+        self.label_dtype = np.dtype(label_dtype).str
+        prefix = data_file[:-len(self.extension)]
+        self.indptr_file = prefix + ".indptr.bin"
+        self.indices_file = prefix + ".indices.bin"
+        resume = resume or {"offsets": [None, None, None], "nbr_of_rows": 0, "nbr_of_one": 0, "max_index": 0,
+                            "nbr_of_bytes": 0}
+        self.nbr_of_rows = resume["nbr_of_rows"]
+        self.nbr_of_one = resume["nbr_of_one"]
+        self.max_index = resume["max_index"]
+        self.nbr_of_bytes = resume["nbr_of_bytes"]
+
+        offsets = resume["offsets"]
+        self.indptr_descriptor = open_output(self.indptr_file, 'wb', offset=offsets[0])
+        self.indices_descriptor = open_output(self.indices_file, 'wb', offset=offsets[1])
+        self.label_descriptor = open_output(label_file, 'wb', offset=offsets[2]) if label_file else None
+        if offsets[0] is None:
+            self.indptr_descriptor.write(np.zeros(1, dtype=CSR_INDPTR_DTYPE).tobytes())
+
+    def write(self, lines: list, labels: list):
+        """
+        Write a chunk of lines
+        :param lines: list of sorted list of int
+        :param labels: label of each line
+        """
+        self.write_formatted(self.format(lines, labels))
+
+    def write_csr(self, indptr, indices, labels):
+        """
+        Write a chunk of lines given as CSR arrays
+        :param indptr: lines[i] is indices[indptr[i]:indptr[i+1]] (indptr[0] is 0)
+        :param indices: 1-based column indices
+        :param labels: label of each line
+        """
+        self.write_formatted(self.format_csr(indptr, indices, labels))
+
+    def format(self, lines: list, labels: list) -> tuple:
+        """
+        Convert a chunk of lines to bytes, without writing it (see BackgroundWriter)
+        """
+        return self.format_csr(*lines_to_csr(lines, CSR_INDICES_DTYPE), labels)
+
+    def format_csr(self, indptr, indices, labels) -> tuple:
+        """
+        Convert a chunk of lines given as CSR arrays to bytes, without writing it. Chunks must be written in the order
+        they are formatted, as the shape of the matrix is updated here
+        :return: (bytes of indptr, bytes of indices, bytes of labels or None)
+        """
+        indptr = np.asarray(indptr, dtype=np.int64)
+        indptr_bytes = (indptr[1:] + self.nbr_of_one).astype(CSR_INDPTR_DTYPE).tobytes()
+        indices_bytes = np.asarray(indices, dtype=CSR_INDICES_DTYPE).tobytes()
+        label_bytes = np.asarray(labels, dtype=self.label_dtype).tobytes() if self.label_descriptor else None
+        self.nbr_of_rows += len(indptr) - 1
+        self.nbr_of_one += int(indptr[-1])
+        if len(indices):
+            self.max_index = max(self.max_index, int(np.max(indices)))
+        return indptr_bytes, indices_bytes, label_bytes
+
+    def write_formatted(self, chunk: tuple):
+        """
+        Write a chunk returned by format or format_csr
+        """
+        indptr_bytes, indices_bytes, label_bytes = chunk
+        self.nbr_of_bytes += self.indptr_descriptor.write(indptr_bytes)
+        self.nbr_of_bytes += self.indices_descriptor.write(indices_bytes)
+        if label_bytes is not None:
+            self.nbr_of_bytes += self.label_descriptor.write(label_bytes)
+
+    def checkpoint(self) -> dict:
+        """
+        Write everything to disk
+        :return: state to give back to the constructor to continue writing the files from this point
+        """
+        return {"offsets": _flush_files([self.indptr_descriptor, self.indices_descriptor, self.label_descriptor],
+                                        [self.indptr_file, self.indices_file, self.label_file]),
+                "nbr_of_rows": self.nbr_of_rows,
+                "nbr_of_one": self.nbr_of_one,
+                "max_index": self.max_index,
+                "nbr_of_bytes": self.nbr_of_bytes}
+
+    def close(self):
+        self.indptr_descriptor.close()
+        self.indices_descriptor.close()
+        if self.label_descriptor:
+            self.label_descriptor.close()
+        write_csr_header(self.data_file, self.nbr_of_rows, self.nbr_of_one, self.max_index,
+                         self.indptr_file, self.indices_file, self.label_file, self.label_dtype)
+
+    @staticmethod
+    def merge(shard_files: list, data_file: str, label_file: str = None):
+        """
+        Merge CSR matrices written by several writers, in order, and remove them
+        :param shard_files: list of (header file, label file) of each writer
+        :param data_file: merged header file
+        :param label_file: merged label file, None if labels are not saved
+        """
+        headers = []
+        for header_file, _ in shard_files:
+            with open(header_file) as fd:
+                headers.append(json.load(fd))
+        writer = CsrWriter(data_file, label_file, label_dtype=_shard_label_dtype(headers))
+        for (header_file, shard_label_file), header in zip(shard_files, headers):
+            directory = os.path.dirname(header_file)
+            indptr_file = os.path.join(directory, header["indptr"]["file"])
+            indices_file = os.path.join(directory, header["indices"]["file"])
+            indptr = np.fromfile(indptr_file, dtype=CSR_INDPTR_DTYPE)
+            writer.indptr_descriptor.write((indptr[1:] + writer.nbr_of_one).tobytes())
+            with open(indices_file, 'rb') as shard_fd:
+                shutil.copyfileobj(shard_fd, writer.indices_descriptor)
+            if label_file:
+                with open(shard_label_file, 'rb') as shard_fd:
+                    shutil.copyfileobj(shard_fd, writer.label_descriptor)
+                os.remove(shard_label_file)
+            writer.nbr_of_rows += header["nbr_of_rows"]
+            writer.nbr_of_one += header["nbr_of_one"]
+            writer.max_index = max(writer.max_index, header["max_index"])
+            for file in (header_file, indptr_file, indices_file):
+                os.remove(file)
+        writer.close()
+
+
+class VarintWriter:
+    """
+    Write lines as a binary stream of delta + varint encoded rows, much smaller than text and compressing better:
+    each index is written as the difference with the previous index of the line (the first one as is), as a LEB128
+    varint (7 bits by byte, high bit set on every byte but the last), and each line ends with a 0 (deltas are never
+    0 as indices are sorted, distinct and 1-based). Labels are written as uint8 (wider with more than 256 classes),
+    like CsrWriter
+
+        data_file    : output file for the lines
+        label_file   : output file for the labels, None to not save labels
+        nbr_of_bytes : number of bytes written so far (before compression)
+    """
+    extension = ".vint"
+    label_extension = ".label.bin"
+
+    def __init__(self, data_file: str, label_file: str = None, compress: str = None, resume: dict = None,
+                 nbr_of_feature: int = 0, label_dtype: str = CSR_LABEL_DTYPE):
+        """
+        :param resume: state given by checkpoint, to continue writing files of an interrupted run
+        :param nbr_of_feature: number of features, unused as lines are written as indices
+        :param label_dtype: dtype of the labels, see label_dtype
+        """
+        self.data_file = data_file
+        self.label_file = label_file
+        self.label_dtype = np.dtype(label_dtype).str
+        offsets = resume["offsets"] if resume else [None, None]
+        self.data_descriptor = open_output(data_file, 'wb', compress, offsets[0])
+        self.label_descriptor = open_output(label_file, 'wb', compress, offsets[1]) if label_file else None
+        self.nbr_of_bytes = resume["nbr_of_bytes"] if resume else 0
+
+    def write(self, lines: list, labels: list):
+        """
+        Write a chunk of lines
+        :param lines: list of sorted list of int
+        :param labels: label of each line
+        """
+        self.write_formatted(self.format(lines, labels))
+
+    def write_csr(self, indptr, indices, labels):
+        """
+        Write a chunk of lines given as CSR arrays
+        :param indptr: lines[i] is indices[indptr[i]:indptr[i+1]] (indptr[0] is 0)
+        :param indices: 1-based column indices, sorted inside each line
+        :param labels: label of each line
+        """
+        self.write_formatted(self.format_csr(indptr, indices, labels))
+
+    def format(self, lines: list, labels: list) -> tuple:
+        """
+        Encode a chunk of lines, without writing it (see BackgroundWriter)
+        """
+        return self.format_csr(*lines_to_csr(lines, np.int64), labels)
+
+    def format_csr(self, indptr, indices, labels) -> tuple:
+        """
+        Encode a chunk of lines given as CSR arrays, without writing it
+        :return: (encoded rows, bytes of labels or None)
+        """
+        label_bytes = np.asarray(labels, dtype=self.label_dtype).tobytes() if self.label_descriptor else None
+        return encode_varint_rows(indptr, indices), label_bytes
+
+    def write_formatted(self, chunk: tuple):
+        """
+        Write a chunk returned by format or format_csr
+        """
+        data, label_bytes = chunk
+        self.nbr_of_bytes += self.data_descriptor.write(data)
+        if label_bytes is not None:
+            self.nbr_of_bytes += self.label_descriptor.write(label_bytes)
+
+    def close(self):
+        self.data_descriptor.close()
+        if self.label_descriptor:
+            self.label_descriptor.close()
+
+    checkpoint = DatWriter.checkpoint
+    merge = staticmethod(DatWriter.merge)  # rows are self-delimited, so files are merged by concatenation
+
+
+class PackedWriter:
+    """
+    Write lines as a dense bit matrix, one bit by cell (np.packbits layout: row-major, most significant bit first),
+    built from the indices of each line without a dense uint8 matrix. Every row takes ceil(nbr_of_feature / 8) bytes,
+    so the matrix can be memory-mapped with shape (nbr_of_rows, row_bytes) and rows sliced without decoding
+        - <prefix>.bits.bin  : uint8, bit j of a row (0-based) is the feature j+1
+        - <prefix>.label.bin : uint8 (wider with more than 256 classes), label of each line (only if labels are saved)
+    and a small JSON header <prefix>.packed.json giving shape, bit order, index base and array files
+
+        data_file      : output header file
+        label_file     : output file for the labels, None to not save labels
+        nbr_of_feature : number of columns of the matrix
+        row_bytes      : number of bytes of a row
+        nbr_of_bytes   : number of bytes of arrays written so far
+    """
+    extension = ".packed.json"
+    label_extension = ".label.bin"
+
+    def __init__(self, data_file: str, label_file: str = None, compress: str = None, resume: dict = None,
+                 nbr_of_feature: int = 0, label_dtype: str = CSR_LABEL_DTYPE):
+        """
+        :param resume: state given by checkpoint, to continue writing files of an interrupted run
+        :param nbr_of_feature: number of features, gives the width of the matrix
+        :param label_dtype: dtype of the labels, see label_dtype
+        """
+        if compress:
+            raise ValueError("Arguments can't be followed: packed matrices are memory-mapped and can't be compressed")
+        if nbr_of_feature <= 0:
+            raise ValueError("Arguments can't be followed: the packed format needs the number of features")
+        self.data_file = data_file
+        self.label_file = label_file
+        self.nbr_of_feature = nbr_of_feature
+        self.label_dtype = np.dtype(label_dtype).str
+        self.row_bytes = (nbr_of_feature + 7) // 8
+        self.bits_file = data_file[:-len(self.extension)] + ".bits.bin"
+        resume = resume or {"offsets": [None, None], "nbr_of_rows": 0, "nbr_of_one": 0, "nbr_of_bytes": 0}
+        self.nbr_of_rows = resume["nbr_of_rows"]
+        self.nbr_of_one = resume["nbr_of_one"]
+        self.nbr_of_bytes = resume["nbr_of_bytes"]
+
+        offsets = resume["offsets"]
+        self.bits_descriptor = open_output(self.bits_file, 'wb', offset=offsets[0])
+        self.label_descriptor = open_output(label_file, 'wb', offset=offsets[1]) if label_file else None
+
+    def write(self, lines: list, labels: list):
+        """
+        Write a chunk of lines
+        :param lines: list of sorted list of int
+        :param labels: label of each line
+        """
+        self.write_formatted(self.format(lines, labels))
+
+    def write_csr(self, indptr, indices, labels):
+        """
+        Write a chunk of lines given as CSR arrays
+        :param indptr: lines[i] is indices[indptr[i]:indptr[i+1]] (indptr[0] is 0)
+        :param indices: 1-based column indices, sorted inside each line
+        :param labels: label of each line
+        """
+        self.write_formatted(self.format_csr(indptr, indices, labels))
+
+    def format(self, lines: list, labels: list) -> tuple:
+        """
+        Pack a chunk of lines, without writing it (see BackgroundWriter)
+        """
+        return self.format_csr(*lines_to_csr(lines, np.int64), labels)
+
+    def format_csr(self, indptr, indices, labels) -> tuple:
+        """
+        Pack a chunk of lines given as CSR arrays, without writing it
+        :return: (bytes of the rows, bytes of labels or None)
+        """
+        label_bytes = np.asarray(labels, dtype=self.label_dtype).tobytes() if self.label_descriptor else None
+        bits = pack_rows(indptr, indices, self.nbr_of_feature)
+        self.nbr_of_rows += len(indptr) - 1
+        self.nbr_of_one += len(indices)
+        return bits.tobytes(), label_bytes
+
+    def write_formatted(self, chunk: tuple):
+        """
+        Write a chunk returned by format or format_csr
+        """
+        bits_bytes, label_bytes = chunk
+        self.nbr_of_bytes += self.bits_descriptor.write(bits_bytes)
+        if label_bytes is not None:
+            self.nbr_of_bytes += self.label_descriptor.write(label_bytes)
+
+    def checkpoint(self) -> dict:
+        """
+        Write everything to disk
+        :return: state to give back to the constructor to continue writing the files from this point
+        """
+        return {"offsets": _flush_files([self.bits_descriptor, self.label_descriptor],
+                                        [self.bits_file, self.label_file]),
+                "nbr_of_rows": self.nbr_of_rows,
+                "nbr_of_one": self.nbr_of_one,
+                "nbr_of_bytes": self.nbr_of_bytes}
+
+    def close(self):
+        self.bits_descriptor.close()
+        if self.label_descriptor:
+            self.label_descriptor.close()
+        write_packed_header(self.data_file, self.nbr_of_rows, self.nbr_of_feature, self.nbr_of_one, self.bits_file,
+                            self.label_file, self.label_dtype)
+
+    @staticmethod
+    def merge(shard_files: list, data_file: str, label_file: str = None):
+        """
+        Merge matrices written by several writers, in order, and remove them. Rows are byte-aligned, so the bits are
+        merged by concatenation
+        :param shard_files: list of (header file, label file) of each writer
+        :param data_file: merged header file
+        :param label_file: merged label file, None if labels are not saved
+        """
+        headers = []
+        for header_file, _ in shard_files:
+            with open(header_file) as fd:
+                headers.append(json.load(fd))
+        writer = PackedWriter(data_file, label_file, nbr_of_feature=headers[0]["nbr_of_feature"],
+                              label_dtype=_shard_label_dtype(headers))
+        for (header_file, shard_label_file), header in zip(shard_files, headers):
+            bits_file = os.path.join(os.path.dirname(header_file), header["bits"]["file"])
+            with open(bits_file, 'rb') as shard_fd:
+                shutil.copyfileobj(shard_fd, writer.bits_descriptor)
+            if label_file:
+                with open(shard_label_file, 'rb') as shard_fd:
+                    shutil.copyfileobj(shard_fd, writer.label_descriptor)
+                os.remove(shard_label_file)
+            writer.nbr_of_rows += header["nbr_of_rows"]
+            writer.nbr_of_one += header["nbr_of_one"]
+            for file in (header_file, bits_file):
+                os.remove(file)
+        writer.close()
+
+
+class BackgroundWriter:
+    """
+    Run a writer on a background thread: chunks are formatted by the caller, queued, and written to disk by the
+    thread (file writes and compression release the GIL), so generation and disk I/O overlap. The queue is bounded,
+    so the caller waits when the disk is the bottleneck and memory stays bounded.
+    Other attributes (data_file, label_file, nbr_of_bytes, ...) are the ones of the wrapped writer
+
+        writer : wrapped writer (DatWriter, CsrWriter, VarintWriter, PackedWriter)
+    """
+
+    def __init__(self, writer, queue_size: int = WRITE_QUEUE_SIZE):
+        self.writer = writer
+        self._queue = queue.Queue(queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="writer", daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name):
+        return getattr(self.writer, name)
+
+    def _run(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            if self._error is None:  # after an error, chunks are dropped so the caller never blocks
+                try:
+                    self.writer.write_formatted(chunk)
+                except BaseException as e:
+                    self._error = e
+            self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, lines: list, labels: list):
+        """
+        Format a chunk of lines and queue it
+        :param lines: list of sorted list of int
+        :param labels: label of each line
+        """
+        self._raise_error()
+        self._queue.put(self.writer.format(lines, labels))
+
+    def write_csr(self, indptr, indices, labels):
+        """
+        Format a chunk of lines given as CSR arrays and queue it
+        """
+        self._raise_error()
+        self._queue.put(self.writer.format_csr(indptr, indices, labels))
+
+    def checkpoint(self) -> dict:
+        """
+        Wait for the queued chunks to be written, then checkpoint the wrapped writer
+        """
+        self._queue.join()
+        self._raise_error()
+        return self.writer.checkpoint()
+
+    def close(self):
+        """
+        Wait for the queued chunks to be written and close the wrapped writer
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self.writer.close()
+        self._raise_error()
+
+
+def label_dtype(nbr_of_class: int) -> str:
+    """
+    Smallest dtype holding the labels of binary label files: uint8 up to 256 classes, then uint16, then uint32
+    :return: little-endian numpy dtype string
+    """
+    if nbr_of_class <= 1 << 8:
+        return CSR_LABEL_DTYPE
+    return '<u2' if nbr_of_class <= 1 << 16 else '<u4'
+
+
+def _shard_label_dtype(headers: list) -> str:
+    return headers[0]["labels"]["dtype"] if headers and "labels" in headers[0] else CSR_LABEL_DTYPE
+
+
+def _flush_files(descriptors: list, files: list) -> list:
+    """
+    Flush files to disk
+    :return: size of each file, None for the files not opened
+    """
+    offsets = []
+    for descriptor, file in zip(descriptors, files):
+        if descriptor is None:
+            offsets.append(None)
+            continue
+        descriptor.flush()
+        os.fsync(descriptor.fileno())
+        offsets.append(os.path.getsize(file))
+    return offsets
+
+
+def lines_to_csr(lines: list, dtype) -> tuple:
+    """
+    Convert a list of lines to CSR arrays
+    :param lines: list of list of int
+    :param dtype: dtype of indices
+    :return: (indptr, indices)
+    """
+    lengths = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+    indices = np.fromiter(itertools.chain.from_iterable(lines), dtype=dtype, count=lengths.sum())
+    return np.concatenate([[0], np.cumsum(lengths)]), indices
+
+
+def encode_varint_rows(indptr, indices) -> bytes:
+    """
+    Delta + varint encoding of rows, see VarintWriter
+    :param indptr: lines[i] is indices[indptr[i]:indptr[i+1]]
+    :param indices: 1-based column indices, sorted inside each line
+    :return: encoded rows
+    """
+    indptr = np.asarray(indptr, dtype=np.int64)
+    indices = np.asarray(indices, dtype=np.uint64)
+    counts = np.diff(indptr)
+    deltas = np.diff(indices, prepend=np.uint64(0))
+    starts = indptr[:-1][counts > 0] - indptr[0]
+    deltas[starts] = indices[starts]
+
+    # one token by index plus a 0 token ending each line
+    tokens = np.zeros(len(indices) + len(counts), dtype=np.uint64)
+    tokens[np.arange(len(indices)) + np.repeat(np.arange(len(counts)), counts)] = deltas
+
+    nbr_bytes = np.ones(len(tokens), dtype=np.int64)
+    for shift in range(7, 64, 7):
+        nbr_bytes += tokens >= (np.uint64(1) << np.uint64(shift))
+    token_of_byte = np.repeat(np.arange(len(tokens)), nbr_bytes)
+    byte_rank = np.arange(len(token_of_byte)) - np.repeat(np.cumsum(nbr_bytes) - nbr_bytes, nbr_bytes)
+    out = ((tokens[token_of_byte] >> (7 * byte_rank).astype(np.uint64)) & np.uint64(0x7f)).astype(np.uint8)
+    out[byte_rank < nbr_bytes[token_of_byte] - 1] |= 0x80
+    return out.tobytes()
+
+
+def write_csr_header(header_file: str, nbr_of_rows: int, nbr_of_one: int, max_index: int,
+                     indptr_file: str, indices_file: str, label_file: str = None, label_dtype: str = CSR_LABEL_DTYPE):
+    """
+    Write the JSON header of a binary CSR matrix. Array files are saved relative to the header
+    :param max_index: highest column index found in the lines
+    """
+    directory = os.path.dirname(header_file)
+    header = {"format": "csr",
+              "version": 1,
+              "index_base": 1,
+              "nbr_of_rows": nbr_of_rows,
+              "nbr_of_one": nbr_of_one,
+              "max_index": max_index,
+              "indptr": {"file": os.path.relpath(indptr_file, directory), "dtype": CSR_INDPTR_DTYPE,
+                         "length": nbr_of_rows + 1},
+              "indices": {"file": os.path.relpath(indices_file, directory), "dtype": CSR_INDICES_DTYPE,
+                          "length": nbr_of_one}}
+    if label_file:
+        header["labels"] = {"file": os.path.relpath(label_file, directory), "dtype": label_dtype,
+                            "length": nbr_of_rows}
+    with open(header_file, 'w') as fd:
+        json.dump(header, fd, indent=1)
+
+
+def pack_rows(indptr, indices, nbr_of_feature: int) -> np.ndarray:
+    """
+    Pack lines into a bit matrix (np.packbits layout) without building the dense matrix: the bits falling inside the
+    same byte are OR-ed together, which is a segmented reduction as indices are sorted inside each line
+    :param indptr: lines[i] is indices[indptr[i]:indptr[i+1]]
+    :param indices: 1-based column indices, sorted inside each line
+    :return: uint8 array of shape (nbr_of_rows, ceil(nbr_of_feature / 8))
+    """
+    indptr = np.asarray(indptr, dtype=np.int64)
+    columns = np.asarray(indices, dtype=np.int64) - 1
+    row_bytes = (nbr_of_feature + 7) // 8
+    nbr_of_rows = len(indptr) - 1
+    bits = np.zeros(nbr_of_rows * row_bytes, dtype=np.uint8)
+    if len(columns):
+        if columns.min() < 0 or columns.max() >= nbr_of_feature:
+            raise ValueError(f"Column indices must be inside [1, {nbr_of_feature}]")
+        rows = np.repeat(np.arange(nbr_of_rows), np.diff(indptr))
+        byte_pos = rows * row_bytes + (columns >> 3)
+        masks = (0x80 >> (columns & 7)).astype(np.uint8)
+        starts = np.flatnonzero(np.concatenate([[True], byte_pos[1:] != byte_pos[:-1]]))
+        bits[byte_pos[starts]] = np.bitwise_or.reduceat(masks, starts)
+    return bits.reshape(nbr_of_rows, row_bytes)
+
+
+def write_packed_header(header_file: str, nbr_of_rows: int, nbr_of_feature: int, nbr_of_one: int, bits_file: str,
+                        label_file: str = None, label_dtype: str = CSR_LABEL_DTYPE):
+    """
+    Write the JSON header of a bit matrix. Array files are saved relative to the header
+    """
+    directory = os.path.dirname(header_file)
+    header = {"format": "packed",
+              "version": 1,
+              "index_base": 1,
+              "bit_order": "big",
+              "nbr_of_rows": nbr_of_rows,
+              "nbr_of_feature": nbr_of_feature,
+              "nbr_of_one": nbr_of_one,
+              "bits": {"file": os.path.relpath(bits_file, directory), "dtype": "|u1",
+                       "shape": [nbr_of_rows, (nbr_of_feature + 7) // 8]}}
+    if label_file:
+        header["labels"] = {"file": os.path.relpath(label_file, directory), "dtype": label_dtype,
+                            "length": nbr_of_rows}
+    with open(header_file, 'w') as fd:
+        json.dump(header, fd, indent=1)
+
+
+WRITERS = {
+    "dat": DatWriter,
+    "csr": CsrWriter,
+    "varint": VarintWriter,
+    "packed": PackedWriter
+}